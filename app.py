@@ -17,26 +17,37 @@ from flask import (
 )
 from apscheduler.schedulers.background import BackgroundScheduler
 
-from database import init_db, get_conn, log_event
-from scheduler_jobs import (
-    capture_job,
-    queue_initial_messages_job,
-    dispatch_messages_job,
-    schedule_followups_job,
+from database import (
+    init_db,
+    get_conn,
+    log_event,
+    flush_events,
+    get_counters,
+    query_leads,
+    LEAD_FILTERS,
 )
-from utils import to_e164_br
+from job_runner import JOBS, run_job, submit_job, get_run, recent_runs, validate_kwargs
+from templating import TEMPLATES_PATH, save_templates
+from optout import optouts
+from leader import LeaderElector, SCHEDULER_LEASE
+from webhooks import enqueue_webhook
+from utils import to_e164_br, ttl_cache
+import metrics
 
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "dev")
 
 
 scheduler = None
+elector = None
 
 
 def start_scheduler():
     """
     Inicia o APScheduler apenas uma vez.
     Importante: evitar rodar no processo "reloader" do Flask debug.
+    Os jobs passam pelo job_runner (histórico em job_runs, sem sobreposição
+    com disparos manuais).
     """
     global scheduler
     if scheduler is not None:
@@ -45,16 +56,26 @@ def start_scheduler():
     sched = BackgroundScheduler(daemon=True)
 
     # Captura diária às 08:00
-    sched.add_job(capture_job, "cron", hour=8, minute=0)
+    sched.add_job(run_job, "cron", args=["capture"], hour=8, minute=0)
 
     # Enfileira mensagens logo após
-    sched.add_job(queue_initial_messages_job, "cron", hour=8, minute=10)
+    sched.add_job(run_job, "cron", args=["queue"], hour=8, minute=10)
 
     # Disparo frequente (o job respeita horário comercial)
-    sched.add_job(dispatch_messages_job, "interval", minutes=2)
+    sched.add_job(run_job, "interval", args=["dispatch"], minutes=2)
 
     # Follow-ups
-    sched.add_job(schedule_followups_job, "interval", minutes=30)
+    sched.add_job(run_job, "interval", args=["followups"], minutes=30)
+
+    # Normaliza telefones antigos (no startup e diariamente antes da captura)
+    sched.add_job(run_job, "cron", args=["backfill_phones"], hour=7, minute=50)
+    sched.add_job(run_job, "date", args=["backfill_phones"])
+
+    # Notificações ao admin (outbox / resumo)
+    sched.add_job(run_job, "interval", args=["notifications"], minutes=1)
+
+    # Callbacks da Z-API (recibos, respostas, SAIR) em lote
+    sched.add_job(run_job, "interval", args=["webhooks"], seconds=30)
 
     sched.start()
     scheduler = sched
@@ -62,78 +83,127 @@ def start_scheduler():
     return scheduler
 
 
+def stop_scheduler():
+    global scheduler
+    if scheduler is None:
+        return
+    scheduler.shutdown(wait=False)
+    scheduler = None
+    log_event("startup", "scheduler_stopped")
+
+
 def bootstrap():
     """
     Inicializa DB e Scheduler.
-    Chamado no startup do app (não em request).
+    Chamado no startup do app (não em request) — em cada worker, no gunicorn.
+    O scheduler só roda no worker que detém o lease "scheduler" (leader.py);
+    se ele morrer, outro assume quando o lease expira.
     """
+    global elector
     init_db()
+    optouts.reload()
 
     # Evita iniciar scheduler duplicado no debug reloader do Flask
     # - Quando debug=True, o Flask cria um processo "monitor" e outro que roda o app.
     # - Só queremos iniciar o scheduler no processo que realmente executa o app.
-    if app.debug:
-        if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
-            start_scheduler()
-    else:
-        start_scheduler()
+    if not app.debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        if elector is None:
+            elector = LeaderElector(SCHEDULER_LEASE, start_scheduler, stop_scheduler).start()
 
     log_event("startup", "app_bootstrapped")
 
 
-@app.route("/")
-def dashboard():
-    with get_conn() as conn:
-        total_leads = conn.execute("SELECT COUNT(*) c FROM leads").fetchone()["c"]
-        total_sent = conn.execute(
-            "SELECT COUNT(*) c FROM messages WHERE status='sent'"
-        ).fetchone()["c"]
-        total_failed = conn.execute(
-            "SELECT COUNT(*) c FROM messages WHERE status='failed'"
-        ).fetchone()["c"]
-        optouts = conn.execute("SELECT COUNT(*) c FROM opt_out").fetchone()["c"]
+def shutdown():
+    """
+    Encerramento do worker: para o scheduler e libera o lease.
+    """
+    global elector
+    if elector is not None:
+        elector.stop()
+        elector = None
+    flush_events()
+
+
+METRICS_TTL = float(os.getenv("METRICS_TTL", "5"))
 
-        last_leads = conn.execute("""
-            SELECT razao_social, cidade, uf, segmento, created_at, status
-            FROM leads ORDER BY id DESC LIMIT 10
-        """).fetchall()
 
+@ttl_cache(METRICS_TTL)
+def cached_metrics():
+    """
+    Contadores (tabela stats_counters) + envios por dia, com cache curto:
+    o /api/metrics é consultado a cada poucos segundos pelo monitoramento.
+    """
+    with get_conn(readonly=True) as conn:
+        data = get_counters(conn)
         sent_7d = conn.execute("""
-            SELECT substr(sent_at,1,10) as day, COUNT(*) as c
-            FROM messages
-            WHERE status='sent' AND sent_at IS NOT NULL
-            GROUP BY day
+            SELECT day, sent as c
+            FROM stats_daily_sent
+            WHERE sent > 0
             ORDER BY day DESC
             LIMIT 7
         """).fetchall()
+    data["sent_7d"] = [dict(r) for r in reversed(sent_7d)]
+    return data
+
+
+@app.route("/")
+def dashboard():
+    counters = cached_metrics()
+    with get_conn(readonly=True) as conn:
+        last_leads = conn.execute("""
+            SELECT razao_social, cidade, uf, segmento, created_at, status
+            FROM leads ORDER BY id DESC LIMIT 10
+        """).fetchall()
 
     return render_template(
         "dashboard.html",
-        total_leads=total_leads,
-        total_sent=total_sent,
-        total_failed=total_failed,
-        optouts=optouts,
+        total_leads=counters["leads"],
+        total_sent=counters["sent"],
+        total_failed=counters["failed"],
+        optouts=counters["optouts"],
         last_leads=last_leads,
-        sent_7d=list(reversed(sent_7d)),
+        sent_7d=counters["sent_7d"],
     )
 
 
+LEADS_PAGE_SIZE = 50
+
+
+def _leads_page():
+    """
+    Lê filtros/cursor da querystring e busca uma página de leads.
+    """
+    filters = {
+        k: request.args.get(k, "").strip()
+        for k in (*LEAD_FILTERS, "abertura_de", "abertura_ate", "q")
+    }
+    before = request.args.get("before", type=int)
+    limit = max(1, min(request.args.get("limit", LEADS_PAGE_SIZE, type=int), 500))
+    with get_conn(readonly=True) as conn:
+        rows = query_leads(conn, filters, before, limit)
+    next_before = rows[-1]["id"] if len(rows) == limit else None
+    return filters, rows, next_before
+
+
 @app.route("/leads")
 def leads():
-    with get_conn() as conn:
-        rows = conn.execute("""
-            SELECT id, cnpj, razao_social, cidade, uf, cnae_principal, telefone, email,
-                   segmento, status, created_at
-            FROM leads
-            ORDER BY id DESC
-            LIMIT 200
-        """).fetchall()
-    return render_template("leads.html", rows=rows)
+    filters, rows, next_before = _leads_page()
+    next_args = None
+    if next_before:
+        next_args = {k: v for k, v in filters.items() if v}
+        next_args["before"] = next_before
+    return render_template("leads.html", rows=rows, filters=filters, next_args=next_args)
+
+
+@app.route("/api/leads")
+def api_leads():
+    _, rows, next_before = _leads_page()
+    return jsonify({"items": [dict(r) for r in rows], "next_before": next_before})
 
 
 @app.route("/reports")
 def reports():
-    with get_conn() as conn:
+    with get_conn(readonly=True) as conn:
         by_segment = conn.execute("""
             SELECT segmento, COUNT(*) as leads
             FROM leads
@@ -157,22 +227,18 @@ def config():
     if request.method == "POST":
         templates_json = request.form.get("templates_json", "").strip()
         try:
-            data = json.loads(templates_json)
-            os.makedirs("message_templates", exist_ok=True)
-            with open("message_templates/templates.json", "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            # Valida os placeholders antes de gravar; o cache recarrega pelo mtime
+            save_templates(json.loads(templates_json))
             flash("Templates atualizados com sucesso.", "success")
         except Exception as e:
             flash(f"Erro ao salvar templates: {e}", "danger")
         return redirect(url_for("config"))
 
     # Se não existir ainda, cria um arquivo vazio para evitar crash
-    os.makedirs("message_templates", exist_ok=True)
-    if not os.path.exists("message_templates/templates.json"):
-        with open("message_templates/templates.json", "w", encoding="utf-8") as f:
-            json.dump({}, f, ensure_ascii=False, indent=2)
+    if not os.path.exists(TEMPLATES_PATH):
+        save_templates({})
 
-    with open("message_templates/templates.json", "r", encoding="utf-8") as f:
+    with open(TEMPLATES_PATH, "r", encoding="utf-8") as f:
         templates_json = f.read()
 
     env_view = {
@@ -199,73 +265,87 @@ def optout_admin():
             "INSERT OR IGNORE INTO opt_out(phone, created_at, source) VALUES(?,?,?)",
             (phone, datetime.utcnow().isoformat(), "admin"),
         )
+    optouts.add(phone)
     flash("Número adicionado ao opt-out.", "success")
     return redirect(url_for("config"))
 
 
 @app.route("/run/<job>")
-def run_job(job):
+def run_job_now(job):
+    if job not in JOBS:
+        flash("Job inválido.", "warning")
+        return redirect(url_for("dashboard"))
     try:
-        if job == "capture":
-            capture_job()
-        elif job == "queue":
-            queue_initial_messages_job()
-        elif job == "dispatch":
-            dispatch_messages_job()
-        elif job == "followups":
-            schedule_followups_job()
-        else:
-            flash("Job inválido.", "warning")
-            return redirect(url_for("dashboard"))
-
-        flash(f"Job '{job}' executado.", "success")
-    except Exception as e:
-        flash(f"Erro ao executar job '{job}': {e}", "danger")
+        validate_kwargs(job, None)
+    except ValueError as e:
+        flash(f"Job '{job}': {e}.", "warning")
+        return redirect(url_for("dashboard"))
+
+    run_id = submit_job(job)
+    if run_id is None:
+        flash(f"Job '{job}' já está em execução.", "warning")
+    else:
+        flash(f"Job '{job}' iniciado (execução #{run_id}).", "success")
     return redirect(url_for("dashboard"))
 
 
+@app.route("/api/jobs/<job>", methods=["POST"])
+def api_start_job(job):
+    if job not in JOBS:
+        return jsonify({"ok": False, "error": "job inválido"}), 404
+    # Parâmetros no corpo JSON, ex.: capture_backfill
+    # {"date_start": "2024-01-01", "date_end": "2024-01-31"}
+    body = request.get_json(silent=True)
+    if body is None and request.get_data():
+        return jsonify({"ok": False, "error": "corpo JSON inválido"}), 400
+    try:
+        kwargs = validate_kwargs(job, body)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    run_id = submit_job(job, kwargs=kwargs or None)
+    if run_id is None:
+        return jsonify({"ok": False, "error": "job já em execução"}), 409
+    return jsonify({"ok": True, "run_id": run_id, "status_url": url_for("api_job_run", run_id=run_id)}), 202
+
+
+@app.route("/api/jobs/runs/<int:run_id>")
+def api_job_run(run_id):
+    run = get_run(run_id)
+    if run is None:
+        return jsonify({"ok": False, "error": "execução não encontrada"}), 404
+    return jsonify(run)
+
+
+@app.route("/api/jobs")
+def api_jobs():
+    job = request.args.get("job") or None
+    limit = max(1, min(request.args.get("limit", 50, type=int), 500))
+    return jsonify({"jobs": sorted(JOBS), "runs": recent_runs(job, limit)})
+
+
 @app.route("/api/metrics")
 def api_metrics():
-    with get_conn() as conn:
-        leads_count = conn.execute("SELECT COUNT(*) c FROM leads").fetchone()["c"]
-        sent_count = conn.execute(
-            "SELECT COUNT(*) c FROM messages WHERE status='sent'"
-        ).fetchone()["c"]
-        failed_count = conn.execute(
-            "SELECT COUNT(*) c FROM messages WHERE status='failed'"
-        ).fetchone()["c"]
-        optouts_count = conn.execute("SELECT COUNT(*) c FROM opt_out").fetchone()["c"]
-        data = {
-            "leads": leads_count,
-            "sent": sent_count,
-            "failed": failed_count,
-            "optouts": optouts_count,
-        }
+    counters = cached_metrics()
+    data = {k: counters[k] for k in ("leads", "sent", "failed", "optouts")}
     return jsonify(data)
 
 
+@app.route("/metrics")
+def prometheus_metrics():
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
 @app.route("/webhook/zapi", methods=["POST"])
 def webhook_zapi():
-    payload = request.get_json(force=True, silent=True) or {}
-    phone = payload.get("phone") or payload.get("from")
-    text = (payload.get("text") or payload.get("message") or "").strip().upper()
-
-    if phone:
-        phone_e164 = to_e164_br(phone) or phone
-        if "SAIR" in text:
-            with get_conn() as conn:
-                conn.execute(
-                    "INSERT OR IGNORE INTO opt_out(phone, created_at, source) VALUES(?,?,?)",
-                    (phone_e164, datetime.utcnow().isoformat(), "webhook"),
-                )
-            log_event("optout", f"phone={phone_e164}")
-
+    # Só enfileira; recibos, respostas e opt-out são tratados em lote
+    enqueue_webhook(request.get_data(as_text=True) or "{}")
     return jsonify({"ok": True})
 
 
 @app.route("/health")
 def health():
-    with get_conn() as conn:
+    flush_events()
+    with get_conn(readonly=True) as conn:
         last = conn.execute("SELECT * FROM events ORDER BY id DESC LIMIT 1").fetchone()
         last_event = dict(last) if last else None
     return jsonify({"ok": True, "last_event": last_event})
@@ -0,0 +1,90 @@
+"""
+Gerador determinístico de base sintética (10k a 5M leads) para os benchmarks.
+Grava direto via executemany em blocos, com os triggers (contadores, FTS)
+ligados, como na produção.
+"""
+import random
+from datetime import datetime, timedelta
+
+from benchmarks.stubs import CIDADES, CNAES, NOMES, UFS
+from segmentation import segmento_por_cnae
+
+CHUNK = 50_000
+STATUS = ["novo"] * 6 + ["contatado"] * 3 + ["respondeu", "convertido", "bloqueado"]
+
+
+def _lead(rng, i: int, created: datetime) -> tuple:
+    uf = rng.choice(UFS)
+    cnae = rng.choice(CNAES)
+    numero = f"9{rng.randrange(10**7, 10**8)}"
+    abertura = created - timedelta(days=rng.randrange(0, 30))
+    return (
+        f"1{i:013d}",
+        f"{rng.choice(NOMES)} {rng.choice(CIDADES[uf].split())} {i} LTDA",
+        CIDADES[uf],
+        uf,
+        cnae,
+        f"(11){numero}",
+        f"+5511{numero}",
+        f"contato{i}@exemplo.com.br",
+        f"Rua Teste {i}, Centro, {CIDADES[uf]}-{uf}",
+        abertura.date().isoformat(),
+        segmento_por_cnae(cnae),
+        created.isoformat(),
+        rng.choice(STATUS),
+    )
+
+
+def generate(conn, n: int, seed: int = 42, sent_ratio: float = 0.6, optout_ratio: float = 0.01,
+             now: datetime = None) -> dict:
+    """
+    Insere `n` leads (criados ao longo do último ano), mensagens 'first'
+    enviadas para `sent_ratio` deles e opt-outs para `optout_ratio`.
+    """
+    rng = random.Random(seed)
+    now = now or datetime.utcnow()
+    start = now - timedelta(days=365)
+    first_id = (conn.execute("SELECT COALESCE(MAX(id), 0) FROM leads").fetchone()[0]) + 1
+    counts = {"leads": 0, "messages": 0, "optouts": 0}
+
+    for base in range(0, n, CHUNK):
+        size = min(CHUNK, n - base)
+        created = [start + timedelta(seconds=rng.randrange(0, 365 * 86400)) for _ in range(size)]
+        created.sort()
+        leads = [_lead(rng, base + k, created[k]) for k in range(size)]
+        conn.executemany(
+            """
+            INSERT INTO leads(cnpj, razao_social, cidade, uf, cnae_principal, telefone, telefone_e164,
+                              email, endereco, data_abertura, segmento, created_at, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            leads,
+        )
+        ids = range(first_id + base, first_id + base + size)
+        messages = []
+        optouts = []
+        for lead_id, lead in zip(ids, leads):
+            if rng.random() < sent_ratio:
+                sent_at = datetime.fromisoformat(lead[11]) + timedelta(minutes=rng.randrange(10, 600))
+                messages.append((lead_id, "Olá", "sent", sent_at.isoformat(), uuid_like(rng)))
+            if rng.random() < optout_ratio:
+                optouts.append((lead[6], lead[11]))
+        conn.executemany(
+            """
+            INSERT INTO messages(lead_id, kind, template_key, message_text, status, sent_at, provider_message_id)
+            VALUES (?, 'first', 'template_servicos', ?, ?, ?, ?)
+            """,
+            messages,
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO opt_out(phone, created_at, source) VALUES (?, ?, 'user')", optouts
+        )
+        conn.commit()
+        counts["leads"] += size
+        counts["messages"] += len(messages)
+        counts["optouts"] += len(optouts)
+    return counts
+
+
+def uuid_like(rng) -> str:
+    return f"{rng.getrandbits(128):032X}"
@@ -0,0 +1,228 @@
+"""
+Benchmark offline: base sintética + stand-ins locais da CNPJA e da Z-API.
+
+    python -m benchmarks.run --leads 100000 --json bench.json
+    python -m benchmarks.run --leads 100000 --baseline bench.json
+
+Mede throughput da captura e do disparo, latência do dashboard, /leads e
+/api/metrics e o tamanho do banco. Rode da raiz do repositório.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from benchmarks.stubs import StubConfig, start_stubs
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--leads", type=int, default=10_000, help="leads na base sintética (10k a 5M)")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--db", help="arquivo do banco (padrão: temporário)")
+    p.add_argument("--capture-days", type=int, default=3)
+    p.add_argument("--offices-per-day", type=int, default=200)
+    p.add_argument("--dispatch", type=int, default=300, help="mensagens no teste de disparo")
+    p.add_argument("--requests", type=int, default=30, help="requisições por rota")
+    p.add_argument("--latency", type=float, default=0.02, help="latência dos stubs (s)")
+    p.add_argument("--error-rate", type=float, default=0.02, help="fração de respostas 429")
+    p.add_argument("--json", help="grava o resultado neste arquivo")
+    p.add_argument("--baseline", help="compara com um resultado gravado antes")
+    return p.parse_args(argv)
+
+
+def configure_env(args, base_url: str, db_path: str):
+    # Antes de importar o projeto: as constantes são lidas do ambiente no import
+    os.environ.update({
+        "DB_PATH": db_path,
+        "CNPJA_API_KEY": "bench",
+        "CNPJA_BASE_URL": base_url,
+        "ZAPI_BASE_URL": base_url,
+        "ZAPI_INSTANCE_ID": "bench",
+        "ZAPI_TOKEN": "bench",
+        "CNPJA_RATE_PER_MIN": "1000000",
+        "CNPJA_RATE_BURST": "100",
+        "HTTP_BACKOFF_BASE": "0.01",
+        "HTTP_MAX_RETRIES": "8",
+        "CAPTURE_MAX_RETRIES": "8",
+        "INTERVALO_ENVIO": "0",
+        "LIMITE_DIARIO": str(args.dispatch),
+        "METRICS_TTL": "0",
+        "NOTIFY_DIGEST_SIZE": "1",
+    })
+
+
+def percentiles(samples: list) -> dict:
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]
+    return {
+        "p50_ms": round(statistics.median(samples) * 1000, 2),
+        "p95_ms": round(pick(0.95) * 1000, 2),
+        "max_ms": round(samples[-1] * 1000, 2),
+    }
+
+
+def bench_generate(args) -> dict:
+    from benchmarks.datagen import generate
+    from database import get_conn, init_db
+
+    init_db()
+    started = time.perf_counter()
+    with get_conn() as conn:
+        counts = generate(conn, args.leads, seed=args.seed)
+    seconds = time.perf_counter() - started
+    return {**counts, "seconds": round(seconds, 2), "leads_per_s": round(args.leads / seconds, 1)}
+
+
+def bench_capture(args) -> dict:
+    from capture_engine import build_shards, run_capture
+    from database import get_conn
+    from ingestion import ingest_leads, load_known_cnpjs
+
+    end = date.today()
+    start = end - timedelta(days=args.capture_days - 1)
+    shards = build_shards(start.isoformat(), end.isoformat())
+    with get_conn() as conn:
+        known = load_known_cnpjs(conn, start.isoformat(), end.isoformat())
+    inserted = []
+
+    def write_page(conn, shard, leads):
+        inserted.append(ingest_leads(conn, leads, known)["inserted"])
+
+    started = time.perf_counter()
+    progress = run_capture(shards, write_page)
+    seconds = time.perf_counter() - started
+    items = sum(p["items"] for p in progress)
+    return {
+        "items": items,
+        "inserted": sum(inserted),
+        "pages": sum(p["pages"] for p in progress),
+        "retries": sum(p["retries"] for p in progress),
+        "failed_shards": sum(1 for p in progress if p["status"] == "failed"),
+        "seconds": round(seconds, 2),
+        "items_per_s": round(items / seconds, 1),
+    }
+
+
+def bench_dispatch(args) -> dict:
+    import scheduler_jobs
+    from dispatcher import dispatch_queued
+
+    queued = scheduler_jobs.queue_initial_messages_job()["queued"]
+    started = time.perf_counter()
+    result = dispatch_queued()
+    seconds = time.perf_counter() - started
+    done = result["sent"] + result["failed"]
+    return {
+        "queued": queued,
+        **result,
+        "seconds": round(seconds, 2),
+        "messages_per_s": round(done / seconds, 1) if seconds else 0.0,
+    }
+
+
+def bench_routes(args) -> dict:
+    import app
+
+    client = app.app.test_client()
+    routes = ["/", "/leads", "/leads?uf=SP&segmento=restaurante", "/api/leads?q=padaria", "/api/metrics"]
+    out = {}
+    for route in routes:
+        samples = []
+        for _ in range(args.requests):
+            app.cached_metrics.cache_clear()  # mede o custo real, sem o cache curto
+            started = time.perf_counter()
+            r = client.get(route)
+            samples.append(time.perf_counter() - started)
+            if r.status_code != 200:
+                raise RuntimeError(f"{route} -> {r.status_code}")
+        out[route] = percentiles(samples)
+    return out
+
+
+def db_size(db_path: str) -> dict:
+    from database import get_conn
+
+    with get_conn() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    size = sum(os.path.getsize(p) for p in (db_path, db_path + "-wal") if os.path.exists(p))
+    return {"bytes": size, "mb": round(size / 1024 / 1024, 2)}
+
+
+def _flatten(data: dict, prefix: str = "") -> dict:
+    flat = {}
+    for k, v in data.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            flat.update(_flatten(v, key + "."))
+        elif isinstance(v, (int, float)):
+            flat[key] = v
+    return flat
+
+
+def report(result: dict, baseline: dict = None) -> str:
+    current = _flatten(result)
+    base = _flatten(baseline) if baseline else {}
+    lines = [f"{'métrica':<55} {'valor':>12}" + (f" {'baseline':>12} {'Δ%':>8}" if base else "")]
+    for key, value in current.items():
+        line = f"{key:<55} {value:>12}"
+        if key in base:
+            old = base[key]
+            delta = f"{(value - old) / old * 100:+.1f}" if old else "-"
+            line += f" {old:>12} {delta:>8}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    stub_config = StubConfig(latency=args.latency, error_rate=args.error_rate,
+                             offices_per_day=args.offices_per_day, seed=args.seed)
+    server, base_url = start_stubs(stub_config)
+    tmp = None
+    if args.db:
+        db_path = args.db
+    else:
+        tmp = tempfile.TemporaryDirectory(prefix="bench-")
+        db_path = os.path.join(tmp.name, "bench.db")
+    configure_env(args, base_url, db_path)
+
+    try:
+        result = {
+            "params": {"leads": args.leads, "seed": args.seed, "latency": args.latency,
+                       "error_rate": args.error_rate},
+            "generate": bench_generate(args),
+            "capture": bench_capture(args),
+            "dispatch": bench_dispatch(args),
+            "routes": bench_routes(args),
+            "db_size": db_size(db_path),
+            "stubs": dict(stub_config.stats),
+        }
+        from database import flush_events
+
+        flush_events()
+    finally:
+        server.shutdown()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print(report(result, baseline))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if tmp:
+        from database import close_thread_conns
+
+        close_thread_conns()
+        tmp.cleanup()
+    return result
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,140 @@
+"""
+Stand-ins locais da CNPJA (/office paginado por cursor) e da Z-API
+(/instances/<id>/send-text), com latência e 429 configuráveis.
+Não importa nada do projeto: pode subir antes de o ambiente ser configurado.
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+UFS = ["SP", "RJ", "MG", "PR", "RS", "SC", "BA", "PE", "CE", "GO", "DF", "ES"]
+CIDADES = {"SP": "São Paulo", "RJ": "Rio de Janeiro", "MG": "Belo Horizonte", "PR": "Curitiba",
+           "RS": "Porto Alegre", "SC": "Florianópolis", "BA": "Salvador", "PE": "Recife",
+           "CE": "Fortaleza", "GO": "Goiânia", "DF": "Brasília", "ES": "Vitória"}
+CNAES = ["5611201", "5611203", "4711302", "4781400", "6201501", "6204000", "1091102",
+         "2512800", "4120400", "8630503", "9602501", "4930202"]
+NOMES = ["Padaria", "Mercado", "Restaurante", "Tech", "Serralheria", "Clínica", "Salão", "Construtora"]
+
+MAX_PER_DAY = 999  # cabe no sufixo de 3 dígitos do CNPJ sintético
+
+
+def fake_office(day: str, uf: str, idx: int) -> dict:
+    """
+    Item no formato do /office da CNPJA, determinístico por (dia, UF, índice).
+    """
+    rng = random.Random(f"{day}:{uf}:{idx}")
+    cnpj = f"8{day.replace('-', '')}{UFS.index(uf):02d}{idx:03d}"
+    return {
+        "taxId": cnpj,
+        "alias": None,
+        "founded": day,
+        "company": {"name": f"{rng.choice(NOMES)} {uf} {idx} LTDA"},
+        "mainActivity": {"id": int(rng.choice(CNAES))},
+        "phones": [{"area": "11", "number": f"9{rng.randrange(10**7, 10**8)}"}],
+        "emails": [{"address": f"contato{idx}@exemplo.com.br"}],
+        "address": {"street": "Rua Teste", "number": str(idx), "district": "Centro",
+                    "city": CIDADES[uf], "state": uf},
+    }
+
+
+class StubConfig:
+    def __init__(self, latency=0.0, error_rate=0.0, retry_after=0.1, offices_per_day=200, seed=1):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.offices_per_day = min(MAX_PER_DAY * len(UFS), offices_per_day)
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"office": 0, "send_text": 0, "throttled": 0}
+
+    def throttle(self) -> bool:
+        with self.lock:
+            return self.rng.random() < self.error_rate
+
+
+def _days(gte: str, lte: str) -> list:
+    first = date.fromisoformat(gte)
+    last = date.fromisoformat(lte or gte)
+    return [(first + timedelta(days=i)).isoformat() for i in range((last - first).days + 1)]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None  # StubConfig, definido em start_stubs
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: dict, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _gate(self) -> bool:
+        if self.config.latency:
+            time.sleep(self.config.latency)
+        if self.config.throttle():
+            with self.config.lock:
+                self.config.stats["throttled"] += 1
+            self._send(429, {"message": "Too Many Requests"},
+                       {"Retry-After": str(self.config.retry_after)})
+            return False
+        return True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/office":
+            return self._send(404, {"message": "not found"})
+        if not self._gate():
+            return
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+        ufs = [u for u in (q.get("address.state.in") or "").split(",") if u in UFS] or UFS
+        per_uf = -(-self.config.offices_per_day // len(UFS))  # teto
+        # Cada dia tem per_uf escritórios por UF; o cursor é o deslocamento
+        keys = [(d, uf, i) for d in _days(q["founded.gte"], q.get("founded.lte"))
+                for uf in ufs for i in range(per_uf)]
+        offset = int(q.get("token") or 0)
+        limit = int(q.get("limit") or 50)
+        page = keys[offset:offset + limit]
+        nxt = offset + limit if offset + limit < len(keys) else None
+        with self.config.lock:
+            self.config.stats["office"] += 1
+        self._send(200, {
+            "next": str(nxt) if nxt is not None else None,
+            "limit": limit,
+            "count": len(keys),
+            "records": [fake_office(*k) for k in page],
+        })
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        if not self.path.endswith("/send-text"):
+            return self._send(404, {"message": "not found"})
+        if not self._gate():
+            return
+        with self.config.lock:
+            self.config.stats["send_text"] += 1
+        mid = uuid.uuid4().hex.upper()
+        self._send(200, {"zaapId": mid, "messageId": mid, "id": mid})
+
+
+def start_stubs(config: StubConfig):
+    """
+    Sobe o servidor numa thread e porta livre. Retorna (server, base_url).
+    """
+    handler = type("Handler", (StubHandler,), {"config": config})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stubs", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
@@ -0,0 +1,293 @@
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+import http_client
+from cnpj_scraper import iter_office_pages, normalize_office
+from database import (
+    get_conn,
+    log_event,
+    get_capture_cursor,
+    save_capture_cursor,
+    get_completed_shards,
+    mark_shard_complete,
+)
+
+# Limite do plano CNPJA (requisições por minuto) compartilhado entre os workers
+CNPJA_RATE_PER_MIN = float(os.getenv("CNPJA_RATE_PER_MIN", "60"))
+CNPJA_RATE_BURST = int(os.getenv("CNPJA_RATE_BURST", "5"))
+CAPTURE_WORKERS = int(os.getenv("CAPTURE_WORKERS", "4"))
+CAPTURE_MAX_RETRIES = int(os.getenv("CAPTURE_MAX_RETRIES", "5"))
+# Janela diária e quantos dias finais são sempre rebuscados (registros que
+# entram atrasados na base da CNPJA)
+CAPTURE_WINDOW_DAYS = int(os.getenv("CAPTURE_WINDOW_DAYS", "30"))
+CAPTURE_RECHECK_DAYS = int(os.getenv("CAPTURE_RECHECK_DAYS", "2"))
+
+UFS_BR = [
+    "AC", "AL", "AM", "AP", "BA", "CE", "DF", "ES", "GO", "MA", "MG", "MS", "MT", "PA",
+    "PB", "PE", "PI", "PR", "RJ", "RN", "RO", "RR", "RS", "SC", "SE", "SP", "TO",
+]
+
+_DONE = object()
+
+
+class CaptureStopped(Exception):
+    """
+    O writer parou (erro): o worker não faz mais requisições.
+    """
+
+
+class TokenBucket:
+    """
+    Token bucket thread-safe: `rate` tokens por segundo, até `capacity` acumulados.
+    """
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_bucket = None
+_bucket_lock = threading.Lock()
+
+
+def shared_bucket() -> TokenBucket:
+    """
+    Bucket único do processo: execuções de captura que se sobrepõem dividem
+    o mesmo limite da CNPJA em vez de somar o próprio.
+    """
+    global _bucket
+    rate = CNPJA_RATE_PER_MIN / 60.0
+    with _bucket_lock:
+        if _bucket is None or (_bucket.rate, _bucket.capacity) != (rate, max(1, CNPJA_RATE_BURST)):
+            _bucket = TokenBucket(rate, CNPJA_RATE_BURST)
+        return _bucket
+
+
+def build_shards(date_start: str, date_end: str, ufs=None, params=None, filters=None) -> list:
+    """
+    Divide a janela founded.gte/lte em uma fatia por dia (e por UF, se informado).
+    `params` são filtros extras da consulta (ver lead_filters.upstream_params);
+    a UF da fatia substitui address.state.in. `filters` (get_target_filters)
+    entra na assinatura da fatia: o filtro local também muda o resultado.
+    """
+    first = datetime.fromisoformat(date_start).date()
+    last = datetime.fromisoformat(date_end).date()
+    shards = []
+    day = first
+    while day <= last:
+        d = day.isoformat()
+        for uf in (ufs or [None]):
+            shard = {
+                "key": f"office:{d}", "day": d, "uf": uf, "params": dict(params or {}),
+                "filters": {k: list(v) for k, v in (filters or {}).items()},
+            }
+            if uf:
+                shard["key"] += f":{uf}"
+                shard["params"]["address.state.in"] = uf
+            shards.append(shard)
+        day += timedelta(days=1)
+    return shards
+
+
+def shard_signature(shard) -> str:
+    """
+    Filtros completos da fatia (CNAE/UF do ambiente + parâmetros enviados à
+    CNPJA). Prefixos de CNAE não vão na consulta, então só os params não
+    bastam para saber se o resultado mudou.
+    """
+    return json.dumps({"filters": shard.get("filters") or {}, "params": shard["params"]}, sort_keys=True)
+
+
+def pending_shards(shards: list, recheck_from: str = None) -> list:
+    """
+    Remove as fatias que o ledger já tem completas com os mesmos filtros.
+    Dias >= recheck_from são sempre buscados de novo.
+    """
+    if not shards:
+        return []
+    days = [s["day"] for s in shards]
+    done = get_completed_shards(min(days), max(days))
+    return [
+        s for s in shards
+        if (recheck_from and s["day"] >= recheck_from) or done.get(s["key"]) != shard_signature(s)
+    ]
+
+
+# Erros que a captura repete (cada tentativa passa de novo pelo TokenBucket)
+RETRYABLE_ERRORS = (
+    requests.exceptions.HTTPError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+
+
+def retry_after_seconds(error, attempt: int):
+    """
+    Espera antes de repetir uma página que falhou (Retry-After ou backoff).
+    None = erro não recuperável.
+    """
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    if status != 429 and status is not None and status < 500:
+        return None
+    wait = http_client.retry_after_seconds(response)
+    if wait is not None:
+        return wait
+    return min(60.0, 2.0 ** attempt)
+
+
+def _put(out, item, stop):
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _fetch_shard(shard, bucket, out, stop, progress, predicate=None):
+    """
+    Worker: pagina uma fatia (cnpj_scraper.iter_office_pages) sob o rate
+    limit compartilhado e entrega as páginas ao writer. Um 429 só pausa esta
+    fatia. Itens que não passam no `predicate` são descartados antes da
+    normalização.
+    """
+    if stop.is_set():
+        progress["status"] = "cancelled"
+        return
+    progress["status"] = "running"
+    started = time.monotonic()
+
+    def before_request():
+        if stop.is_set():
+            raise CaptureStopped()
+        bucket.acquire()
+        if stop.is_set():  # a espera pelo token pode atravessar a parada
+            raise CaptureStopped()
+
+    def retry_wait(error, attempt):
+        if not isinstance(error, RETRYABLE_ERRORS) or attempt >= CAPTURE_MAX_RETRIES:
+            return None
+        wait = retry_after_seconds(error, attempt)
+        if wait is not None:
+            progress["retries"] += 1
+            progress["waited"] += wait
+        return wait
+
+    # Toda tentativa (inclusive repetição) consome um token do bucket
+    pages = iter_office_pages(
+        shard["day"], shard["day"], shard.get("cursor"),
+        before_request=before_request, retry_wait=retry_wait, raw=True, **shard["params"]
+    )
+    try:
+        for items, nxt in pages:
+            if predicate is not None:
+                kept = [it for it in items if predicate(it)]
+                progress["dropped"] += len(items) - len(kept)
+                items = kept
+            leads = [normalize_office(it) for it in items]
+            progress["pages"] += 1
+            progress["items"] += len(leads)
+            if not _put(out, (shard, leads, nxt), stop):
+                break
+            if not nxt:
+                progress["status"] = "done"
+                break
+            if stop.is_set():
+                break
+    except CaptureStopped:
+        progress["status"] = "cancelled"
+    except Exception as e:
+        progress["status"] = "failed"
+        progress["error"] = str(e)[:300]
+    finally:
+        pages.close()
+        progress["seconds"] = round(time.monotonic() - started, 2)
+        _put(out, (shard, _DONE, None), stop)
+
+
+def run_capture(shards: list, write_page, workers: int = None, predicate=None) -> list:
+    """
+    Busca as fatias num pool de workers e grava tudo por um único writer
+    (a thread chamadora). write_page(conn, shard, leads) ingere uma página;
+    o cursor da fatia é salvo no mesmo commit para permitir retomada, e a
+    última página da fatia grava a entrada do capture_ledger no mesmo commit.
+    `predicate(item)` filtra os itens crus (lead_filters.compile_office_predicate).
+    Retorna o progresso por fatia.
+    """
+    workers = workers or CAPTURE_WORKERS
+    bucket = shared_bucket()
+    out = queue.Queue(maxsize=workers * 2)
+    stop = threading.Event()
+
+    progress = []
+    for shard in shards:
+        shard["signature"] = shard_signature(shard)
+        shard["cursor"] = get_capture_cursor(shard["key"], shard["signature"])
+        shard["progress"] = {
+            "shard": shard["key"], "status": "pending", "pages": 0, "items": 0, "dropped": 0,
+            "retries": 0, "waited": 0.0, "seconds": 0.0, "error": None,
+            "resumed": bool(shard["cursor"]),
+        }
+        progress.append(shard["progress"])
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="capture") as pool:
+        for shard in shards:
+            pool.submit(_fetch_shard, shard, bucket, out, stop, shard["progress"], predicate)
+
+        pending = len(shards)
+        try:
+            with get_conn() as conn:
+                while pending:
+                    shard, leads, nxt = out.get()
+                    if leads is _DONE:
+                        pending -= 1
+                        continue
+                    write_page(conn, shard, leads)
+                    save_capture_cursor(conn, shard["key"], nxt, shard["signature"])
+                    if not nxt:
+                        # Última página: ledger no mesmo commit dos leads e
+                        # da remoção do cursor
+                        p = shard["progress"]
+                        mark_shard_complete(
+                            conn, shard["key"], shard["day"], shard["uf"],
+                            shard["signature"], p["pages"], p["items"],
+                        )
+                    conn.commit()
+        finally:
+            stop.set()
+            # Fatias ainda na fila do pool nem chegam a começar
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    for p in progress:
+        log_event(
+            "capture_shard",
+            f"shard={p['shard']} status={p['status']} pages={p['pages']} items={p['items']}"
+            f" dropped={p['dropped']}"
+            f" retries={p['retries']} waited={p['waited']:.1f}s secs={p['seconds']}"
+            + (f" error={p['error']}" if p["error"] else ""),
+        )
+    return progress
@@ -1,15 +1,23 @@
 import os
+import time
+
 import requests
+
+import http_client
 from database import log_event
 
 CNPJA_API_KEY = os.getenv("CNPJA_API_KEY")
 CNPJA_BASE_URL = os.getenv("CNPJA_BASE_URL", "https://api.cnpja.com").rstrip("/")
+PAGE_LIMIT = int(os.getenv("CNPJA_PAGE_LIMIT", "50"))
 
 
-def fetch_offices_by_founded_range(date_start: str, date_end: str):
+def fetch_offices_by_founded_range(date_start: str, date_end: str, cursor: str = None,
+                                   retries: int = None, **extra_params):
     """
     GET /office?founded.gte=YYYY-MM-DD&founded.lte=YYYY-MM-DD
-    Retorna com paginação via cursor (next).
+    Retorna uma página; a próxima vem do cursor `next` do payload
+    (reenviado como `token`). Use iter_office_pages para percorrer tudo.
+    `retries` vai para o http_client (0 = sem novas tentativas).
     """
     if not CNPJA_API_KEY:
         raise RuntimeError("CNPJA_API_KEY não configurada.")
@@ -18,10 +26,17 @@ def fetch_offices_by_founded_range(date_start: str, date_end: str):
     params = {
         "founded.gte": date_start,
         "founded.lte": date_end,
-        "limit": 50,  # máximo de registros por requisição
+        "limit": PAGE_LIMIT,  # máximo de registros por requisição
     }
+    params.update(extra_params)
+    if cursor:
+        params["token"] = cursor
 
-    r = requests.get(url, headers={"Authorization": CNPJA_API_KEY}, params=params, timeout=30)
+    # Session compartilhada + retry/backoff em 429 e 5xx (honra Retry-After)
+    r = http_client.request(
+        "cnpja", "GET", url, endpoint="cnpja GET /office",
+        headers={"Authorization": CNPJA_API_KEY}, params=params, retries=retries,
+    )
     if r.status_code != 200:
         log_event("error", f"CNPJA /office {r.status_code}: {r.text[:500]}")
         r.raise_for_status()
@@ -29,6 +44,58 @@ def fetch_offices_by_founded_range(date_start: str, date_end: str):
     return r.json()
 
 
+def next_cursor(payload):
+    """
+    Cursor da próxima página (None quando acabou).
+    """
+    if isinstance(payload, dict):
+        return payload.get("next") or None
+    return None
+
+
+def iter_office_pages(date_start: str, date_end: str, cursor: str = None, before_request=None,
+                      retry_wait=None, raw: bool = False, **extra_params):
+    """
+    Percorre todas as páginas seguindo `next`.
+    Gera (leads_normalizados, proximo_cursor) página a página, então só uma
+    página fica em memória. Passe `cursor` para retomar de onde parou.
+
+    Ganchos (usados pela captura):
+    - before_request(): chamado antes de toda requisição, inclusive repetições
+      (ex.: TokenBucket.acquire);
+    - retry_wait(erro, tentativa): segundos até repetir a página ou None para
+      propagar o erro. Com ele o http_client não repete por conta própria;
+    - raw=True gera os itens crus do /office, sem normalize_office.
+    """
+    attempt = 0
+    while True:
+        if before_request is not None:
+            before_request()
+        try:
+            payload = fetch_offices_by_founded_range(
+                date_start, date_end, cursor,
+                retries=0 if retry_wait is not None else None, **extra_params
+            )
+        except requests.exceptions.RequestException as e:
+            wait = retry_wait(e, attempt) if retry_wait is not None else None
+            if wait is None:
+                raise
+            attempt += 1
+            time.sleep(wait)
+            continue
+        attempt = 0
+        items = extract_items(payload)
+        if not raw:
+            items = [normalize_office(it) for it in items]
+        nxt = next_cursor(payload)
+        if nxt == cursor:
+            nxt = None  # cursor repetido: evita loop infinito
+        yield items, nxt
+        if not nxt:
+            return
+        cursor = nxt
+
+
 def extract_items(payload):
     """
     A API pode devolver lista direta ou objeto com itens/paginação.
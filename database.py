@@ -1,20 +1,137 @@
+import atexit
 import os
 import sqlite3
+import threading
 from contextlib import contextmanager
 from datetime import datetime
+from time import perf_counter
+
+import metrics
 
 DB_PATH = os.getenv("DB_PATH", "prospeccao.db")
 
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_KB = int(os.getenv("SQLITE_CACHE_KB", "20000"))
+SQLITE_MMAP_BYTES = int(os.getenv("SQLITE_MMAP_BYTES", str(256 * 1024 * 1024)))
+SQLITE_CACHED_STATEMENTS = int(os.getenv("SQLITE_CACHED_STATEMENTS", "256"))
 
-@contextmanager
-def get_conn():
-    conn = sqlite3.connect(DB_PATH)
+# Uma conexão de escrita e uma somente-leitura por thread, mantidas abertas
+_local = threading.local()
+
+EVENT_FLUSH_SIZE = int(os.getenv("EVENT_FLUSH_SIZE", "200"))
+EVENT_FLUSH_INTERVAL = float(os.getenv("EVENT_FLUSH_INTERVAL", "2"))
+EVENT_BUFFER_MAX = int(os.getenv("EVENT_BUFFER_MAX", "10000"))
+
+# Buffer de eventos (log_event) gravado em lote por uma thread de fundo
+_event_buffer = []
+_event_lock = threading.Lock()
+_event_wakeup = threading.Event()
+_event_thread = None
+
+
+SQL_OPS = {"SELECT", "INSERT", "UPDATE", "DELETE", "BEGIN", "WITH"}
+
+
+def _sql_op(sql: str) -> str:
+    words = sql.split(None, 1)
+    word = words[0].upper() if words else ""
+    return word if word in SQL_OPS else "OTHER"
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    Conexão que mede execute/executemany/commit no histograma de SQL.
+    O tempo inclui a espera pelo lock (busy_timeout) e o primeiro passo da
+    consulta; o fetch das linhas seguintes fica de fora.
+    """
+
+    def execute(self, sql, *args):
+        started = perf_counter()
+        try:
+            return super().execute(sql, *args)
+        finally:
+            metrics.sql_duration.observe(perf_counter() - started, _sql_op(sql))
+
+    def executemany(self, sql, *args):
+        started = perf_counter()
+        try:
+            return super().executemany(sql, *args)
+        finally:
+            metrics.sql_duration.observe(perf_counter() - started, _sql_op(sql))
+
+    def commit(self):
+        started = perf_counter()
+        try:
+            return super().commit()
+        finally:
+            metrics.sql_duration.observe(perf_counter() - started, "COMMIT")
+
+
+def _connect(path: str, readonly: bool):
+    factory = TimedConnection if metrics.METRICS_ENABLED else sqlite3.Connection
+    if readonly:
+        conn = sqlite3.connect(
+            f"file:{path}?mode=ro", uri=True, cached_statements=SQLITE_CACHED_STATEMENTS,
+            factory=factory,
+        )
+    else:
+        conn = sqlite3.connect(path, cached_statements=SQLITE_CACHED_STATEMENTS, factory=factory)
+        # WAL: leituras (dashboard) não bloqueiam enquanto o scheduler grava
+        conn.execute("PRAGMA journal_mode=WAL")
     conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KB}")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_BYTES}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def _thread_entry(readonly: bool) -> dict:
+    entries = getattr(_local, "entries", None)
+    if entries is None:
+        entries = _local.entries = {}
+    entry = entries.get(readonly)
+    if entry is not None and entry["path"] != DB_PATH and entry["depth"] == 0:
+        entry["conn"].close()
+        entry = None
+    if entry is None:
+        entry = {"conn": _connect(DB_PATH, readonly), "path": DB_PATH, "depth": 0}
+        entries[readonly] = entry
+    return entry
+
+
+@contextmanager
+def get_conn(readonly: bool = False):
+    """
+    Conexão da thread atual (reaproveitada entre chamadas).
+    Commit ao sair do bloco mais externo; rollback se houver exceção.
+    Blocos aninhados na mesma thread compartilham a transação.
+    readonly=True usa uma conexão separada somente-leitura (views do Flask).
+    """
+    entry = _thread_entry(readonly)
+    conn = entry["conn"]
+    entry["depth"] += 1
     try:
         yield conn
-        conn.commit()
+        if entry["depth"] == 1 and conn.in_transaction:
+            conn.commit()
+    except BaseException:
+        if entry["depth"] == 1 and conn.in_transaction:
+            conn.rollback()
+        raise
     finally:
-        conn.close()
+        entry["depth"] -= 1
+
+
+def close_thread_conns():
+    """
+    Fecha as conexões da thread atual (shutdown / testes).
+    """
+    entries = getattr(_local, "entries", None) or {}
+    for entry in entries.values():
+        entry["conn"].close()
+    entries.clear()
 
 
 def init_db():
@@ -81,31 +198,571 @@ def init_db():
         )
         """)
 
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS capture_cursors (
+            key TEXT PRIMARY KEY, -- janela/fatia da captura
+            cursor TEXT NOT NULL, -- próximo `next` da API CNPJA
+            updated_at TEXT NOT NULL
+        )
+        """)
+
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            lead_id INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            status TEXT DEFAULT 'pending', -- pending, sending, sent, failed
+            attempts INTEGER NOT NULL DEFAULT 0,
+            sent_at TEXT,
+            error TEXT,
+            FOREIGN KEY (lead_id) REFERENCES leads(id)
+        )
+        """)
+
+        migrate(conn)
+
+
+def add_column(conn, table: str, column: str, decl: str):
+    """
+    ALTER TABLE ADD COLUMN idempotente (para usar nas migrações).
+    """
+    cols = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in cols:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+# Migrações versionadas: (versão, descrição, passos). Cada passo é um SQL ou
+# uma função(conn) e deve ser idempotente. Só acrescente no fim da lista.
+MIGRATIONS = [
+    (1, "indices das consultas dos jobs e do outbox", [
+        # dispatch: WHERE status='queued' ORDER BY id
+        "CREATE INDEX IF NOT EXISTS idx_messages_status ON messages(status, id)",
+        # queue: NOT EXISTS (... WHERE lead_id = leads.id)
+        "CREATE INDEX IF NOT EXISTS idx_messages_lead_id ON messages(lead_id, kind)",
+        # dashboard/follow-ups: envios por data
+        "CREATE INDEX IF NOT EXISTS idx_messages_sent_at ON messages(sent_at)",
+        # queue/capture: faixa de created_at
+        "CREATE INDEX IF NOT EXISTS idx_leads_created_at ON leads(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_events_type ON events(type, id)",
+        "CREATE INDEX IF NOT EXISTS idx_outbox_status ON notification_outbox(status, id)",
+    ]),
+    (2, "contadores do dashboard mantidos por triggers", [
+        """
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            key TEXT PRIMARY KEY, -- leads, optouts, messages:<status>
+            value INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS stats_daily_sent (
+            day TEXT PRIMARY KEY, -- YYYY-MM-DD de sent_at
+            sent INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_leads_count_ins AFTER INSERT ON leads BEGIN
+            INSERT INTO stats_counters(key, value) VALUES ('leads', 1)
+            ON CONFLICT(key) DO UPDATE SET value = value + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_leads_count_del AFTER DELETE ON leads BEGIN
+            UPDATE stats_counters SET value = value - 1 WHERE key = 'leads';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_optout_count_ins AFTER INSERT ON opt_out BEGIN
+            INSERT INTO stats_counters(key, value) VALUES ('optouts', 1)
+            ON CONFLICT(key) DO UPDATE SET value = value + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_optout_count_del AFTER DELETE ON opt_out BEGIN
+            UPDATE stats_counters SET value = value - 1 WHERE key = 'optouts';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_messages_count_ins AFTER INSERT ON messages BEGIN
+            INSERT INTO stats_counters(key, value)
+            SELECT 'messages:' || NEW.status, 1 WHERE NEW.status IS NOT NULL
+            ON CONFLICT(key) DO UPDATE SET value = value + 1;
+            INSERT INTO stats_daily_sent(day, sent)
+            SELECT substr(NEW.sent_at, 1, 10), 1
+            WHERE NEW.status = 'sent' AND NEW.sent_at IS NOT NULL
+            ON CONFLICT(day) DO UPDATE SET sent = sent + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_messages_count_del AFTER DELETE ON messages BEGIN
+            UPDATE stats_counters SET value = value - 1 WHERE key = 'messages:' || OLD.status;
+            UPDATE stats_daily_sent SET sent = sent - 1
+            WHERE day = substr(OLD.sent_at, 1, 10) AND OLD.status = 'sent';
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_messages_count_upd AFTER UPDATE OF status, sent_at ON messages
+        BEGIN
+            UPDATE stats_counters SET value = value - 1 WHERE key = 'messages:' || OLD.status;
+            INSERT INTO stats_counters(key, value)
+            SELECT 'messages:' || NEW.status, 1 WHERE NEW.status IS NOT NULL
+            ON CONFLICT(key) DO UPDATE SET value = value + 1;
+            UPDATE stats_daily_sent SET sent = sent - 1
+            WHERE day = substr(OLD.sent_at, 1, 10) AND OLD.status = 'sent';
+            INSERT INTO stats_daily_sent(day, sent)
+            SELECT substr(NEW.sent_at, 1, 10), 1
+            WHERE NEW.status = 'sent' AND NEW.sent_at IS NOT NULL
+            ON CONFLICT(day) DO UPDATE SET sent = sent + 1;
+        END
+        """,
+        # Carga inicial a partir dos dados existentes
+        "DELETE FROM stats_counters",
+        "INSERT INTO stats_counters(key, value) SELECT 'leads', COUNT(*) FROM leads",
+        "INSERT INTO stats_counters(key, value) SELECT 'optouts', COUNT(*) FROM opt_out",
+        """
+        INSERT INTO stats_counters(key, value)
+        SELECT 'messages:' || status, COUNT(*) FROM messages
+        WHERE status IS NOT NULL GROUP BY status
+        """,
+        "DELETE FROM stats_daily_sent",
+        """
+        INSERT INTO stats_daily_sent(day, sent)
+        SELECT substr(sent_at, 1, 10), COUNT(*) FROM messages
+        WHERE status = 'sent' AND sent_at IS NOT NULL
+        GROUP BY 1
+        """,
+    ]),
+    (3, "filtros e busca textual de leads (FTS5)", [
+        "CREATE INDEX IF NOT EXISTS idx_leads_uf ON leads(uf, id)",
+        "CREATE INDEX IF NOT EXISTS idx_leads_cidade ON leads(cidade, id)",
+        "CREATE INDEX IF NOT EXISTS idx_leads_segmento ON leads(segmento, id)",
+        "CREATE INDEX IF NOT EXISTS idx_leads_status ON leads(status, id)",
+        "CREATE INDEX IF NOT EXISTS idx_leads_data_abertura ON leads(data_abertura)",
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS leads_fts USING fts5(
+            razao_social, cidade,
+            content='leads', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_leads_fts_ins AFTER INSERT ON leads BEGIN
+            INSERT INTO leads_fts(rowid, razao_social, cidade)
+            VALUES (NEW.id, NEW.razao_social, NEW.cidade);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_leads_fts_del AFTER DELETE ON leads BEGIN
+            INSERT INTO leads_fts(leads_fts, rowid, razao_social, cidade)
+            VALUES ('delete', OLD.id, OLD.razao_social, OLD.cidade);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_leads_fts_upd AFTER UPDATE OF razao_social, cidade ON leads
+        BEGIN
+            INSERT INTO leads_fts(leads_fts, rowid, razao_social, cidade)
+            VALUES ('delete', OLD.id, OLD.razao_social, OLD.cidade);
+            INSERT INTO leads_fts(rowid, razao_social, cidade)
+            VALUES (NEW.id, NEW.razao_social, NEW.cidade);
+        END
+        """,
+        "INSERT INTO leads_fts(leads_fts) VALUES ('rebuild')",
+    ]),
+    (4, "telefone normalizado (E.164) em leads", [
+        # NULL = ainda não normalizado; '' = telefone inválido
+        lambda conn: add_column(conn, "leads", "telefone_e164", "TEXT"),
+        "CREATE INDEX IF NOT EXISTS idx_leads_telefone_e164 ON leads(telefone_e164)",
+    ]),
+    (5, "watermarks dos jobs e índice dos follow-ups", [
+        """
+        CREATE TABLE IF NOT EXISTS job_watermarks (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+        """,
+        # follow-ups: WHERE kind=? AND sent_at > ? AND sent_at <= ?
+        "CREATE INDEX IF NOT EXISTS idx_messages_kind_sent_at ON messages(kind, sent_at)",
+    ]),
+    (6, "reserva atômica da cota diária", [
+        lambda conn: add_column(conn, "daily_limits", "last_grant", "INTEGER NOT NULL DEFAULT 0"),
+    ]),
+    (7, "inbox de webhooks e recibos de entrega", [
+        """
+        CREATE TABLE IF NOT EXISTS webhook_inbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            received_at TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            processed_at TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_webhook_inbox_processed ON webhook_inbox(processed_at, id)",
+        lambda conn: add_column(conn, "messages", "delivered_at", "TEXT"),
+        lambda conn: add_column(conn, "messages", "read_at", "TEXT"),
+        "CREATE INDEX IF NOT EXISTS idx_messages_provider_id ON messages(provider_message_id)",
+    ]),
+    (8, "lease do líder do scheduler", [
+        """
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL, -- epoch (segundos)
+            renewed_at TEXT NOT NULL
+        )
+        """,
+    ]),
+    (9, "histórico de execução dos jobs", [
+        """
+        CREATE TABLE IF NOT EXISTS job_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job TEXT NOT NULL,
+            trigger TEXT NOT NULL, -- scheduler, manual
+            status TEXT NOT NULL, -- running, done, failed, abandoned
+            started_at TEXT NOT NULL,
+            finished_at TEXT,
+            seconds REAL,
+            counts TEXT, -- JSON
+            error TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_job_runs_job ON job_runs(job, id)",
+        # No máximo uma execução 'running' por job (entre processos)
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_job_runs_running ON job_runs(job) WHERE status = 'running'",
+    ]),
+    (10, "ledger de fatias da captura já paginadas", [
+        """
+        CREATE TABLE IF NOT EXISTS capture_ledger (
+            key TEXT PRIMARY KEY, -- mesma chave de capture_cursors (office:<dia>[:<uf>])
+            day TEXT NOT NULL,
+            uf TEXT,
+            params TEXT NOT NULL, -- assinatura dos filtros (JSON); mudou = refaz a fatia
+            pages INTEGER NOT NULL,
+            items INTEGER NOT NULL,
+            completed_at TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_capture_ledger_day ON capture_ledger(day)",
+    ]),
+    (11, "dono e heartbeat das execuções dos jobs", [
+        lambda conn: add_column(conn, "job_runs", "holder", "TEXT"),  # host:pid:id do processo
+        lambda conn: add_column(conn, "job_runs", "heartbeat_at", "TEXT"),
+    ]),
+    (12, "reserva das mensagens pelo dispatcher", [
+        # status='sending' + claimed_at: a mensagem é de um único dispatcher
+        lambda conn: add_column(conn, "messages", "claimed_at", "TEXT"),
+    ]),
+    (13, "assinatura dos filtros no cursor da captura", [
+        # Cursor salvo com outros CNAE_FILTRO/UF_FILTRO não é retomado
+        lambda conn: add_column(conn, "capture_cursors", "signature", "TEXT"),
+    ]),
+    (14, "slot de execução dos jobs", [
+        # Jobs no mesmo slot (capture e capture_backfill) não rodam juntos
+        lambda conn: add_column(conn, "job_runs", "slot", "TEXT"),
+        "UPDATE job_runs SET slot = job WHERE slot IS NULL",
+        "DROP INDEX IF EXISTS idx_job_runs_running",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_job_runs_slot_running ON job_runs(slot) WHERE status = 'running'",
+    ]),
+    (15, "reserva das notificações do outbox", [
+        # status='sending' + claimed_at: a notificação é de um único drain
+        lambda conn: add_column(conn, "notification_outbox", "claimed_at", "TEXT"),
+    ]),
+]
+
+
+def schema_version(conn) -> int:
+    row = conn.execute("SELECT MAX(version) v FROM schema_migrations").fetchone()
+    return row["v"] or 0
+
+
+def migrate(conn):
+    """
+    Aplica, em ordem, as migrações com versão maior que a registrada.
+    Cada migração roda e é registrada na mesma transação.
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TEXT NOT NULL
+    )
+    """)
+    conn.commit()
+
+    current = schema_version(conn)
+    for version, name, steps in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            # IMMEDIATE + releitura: com vários workers subindo juntos, só um
+            # aplica cada migração; os outros esperam o lock e pulam
+            conn.execute("BEGIN IMMEDIATE")
+            if schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(
+                "INSERT INTO schema_migrations(version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, datetime.utcnow().isoformat()),
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
 
 def log_event(event_type: str, payload: str = ""):
+    """
+    Enfileira o evento em memória; uma thread grava em lote quando o buffer
+    chega a EVENT_FLUSH_SIZE ou a cada EVENT_FLUSH_INTERVAL segundos.
+    """
+    with _event_lock:
+        _event_buffer.append((event_type, payload, datetime.utcnow().isoformat()))
+        full = len(_event_buffer) >= EVENT_FLUSH_SIZE
+    _ensure_event_writer()
+    if full:
+        _event_wakeup.set()
+
+
+def flush_events() -> int:
+    """
+    Grava os eventos pendentes numa única transação. Retorna quantos gravou.
+    """
+    with _event_lock:
+        batch = _event_buffer[:]
+        _event_buffer.clear()
+    if not batch:
+        return 0
+    try:
+        with get_conn() as conn:
+            conn.executemany(
+                "INSERT INTO events(type, payload, created_at) VALUES (?, ?, ?)", batch
+            )
+    except Exception:
+        # Devolve ao buffer (limitado) para a próxima tentativa
+        with _event_lock:
+            _event_buffer[:0] = batch
+            del _event_buffer[:-EVENT_BUFFER_MAX]
+        raise
+    return len(batch)
+
+
+def _event_writer_loop():
+    while True:
+        _event_wakeup.wait(EVENT_FLUSH_INTERVAL)
+        _event_wakeup.clear()
+        try:
+            flush_events()
+        except Exception:
+            pass  # banco ocupado/indisponível: tenta de novo no próximo ciclo
+
+
+def _ensure_event_writer():
+    global _event_thread
+    if _event_thread is not None and _event_thread.is_alive():
+        return
+    with _event_lock:
+        if _event_thread is None or not _event_thread.is_alive():
+            _event_thread = threading.Thread(
+                target=_event_writer_loop, name="event-writer", daemon=True
+            )
+            _event_thread.start()
+
+
+@atexit.register
+def _flush_events_at_exit():
+    try:
+        flush_events()
+    except Exception:
+        pass
+
+
+def upsert_daily_counter(day: str, inc: int = 1):
     with get_conn() as conn:
         conn.execute(
-            "INSERT INTO events(type, payload, created_at) VALUES (?, ?, ?)",
-            (event_type, payload, datetime.utcnow().isoformat())
+            """
+            INSERT INTO daily_limits(day, sent_count) VALUES (?, ?)
+            ON CONFLICT(day) DO UPDATE SET sent_count = sent_count + excluded.sent_count
+            """,
+            (day, inc),
         )
 
 
-def upsert_daily_counter(day: str, inc: int = 1):
+def reserve_daily_quota(day: str, n: int, limit: int) -> int:
+    """
+    Reserva até `n` envios do LIMITE_DIARIO do dia num único statement
+    (ler e incrementar juntos, sem janela para outro processo). Retorna
+    quantos foram concedidos (0 = limite atingido). A reserva já conta em
+    sent_count; o que não for enviado volta com release_daily_quota().
+    """
     with get_conn() as conn:
-        row = conn.execute("SELECT sent_count FROM daily_limits WHERE day=?", (day,)).fetchone()
-        if row is None:
-            conn.execute(
-                "INSERT INTO daily_limits(day, sent_count) VALUES(?, ?)",
-                (day, inc),
-            )
-        else:
-            conn.execute(
-                "UPDATE daily_limits SET sent_count = sent_count + ? WHERE day= ?",
-                (inc, day),
-            )
+        row = conn.execute(
+            """
+            INSERT INTO daily_limits(day, sent_count, last_grant)
+            VALUES (:day, MAX(0, MIN(:n, :limit)), MAX(0, MIN(:n, :limit)))
+            ON CONFLICT(day) DO UPDATE SET
+                last_grant = MAX(0, MIN(:n, :limit - sent_count)),
+                sent_count = sent_count + MAX(0, MIN(:n, :limit - sent_count))
+            RETURNING last_grant
+            """,
+            {"day": day, "n": n, "limit": limit},
+        ).fetchone()
+        return int(row["last_grant"])
+
+
+def release_daily_quota(day: str, n: int):
+    """
+    Devolve `n` envios reservados e não realizados (falha ou sobra do lote).
+    """
+    if n <= 0:
+        return
+    with get_conn() as conn:
+        conn.execute(
+            "UPDATE daily_limits SET sent_count = MAX(0, sent_count - ?) WHERE day=?",
+            (n, day),
+        )
 
 
 def get_daily_sent(day: str) -> int:
     with get_conn() as conn:
         row = conn.execute("SELECT sent_count FROM daily_limits WHERE day=?", (day,)).fetchone()
         return int(row["sent_count"]) if row else 0
+
+
+def get_capture_cursor(key: str, signature: str = None):
+    """
+    Cursor salvo da fatia. Com `signature`, um cursor gravado sob outros
+    filtros é ignorado (a fatia recomeça da primeira página).
+    """
+    with get_conn() as conn:
+        row = conn.execute(
+            "SELECT cursor, signature FROM capture_cursors WHERE key=?", (key,)
+        ).fetchone()
+    if not row or (signature is not None and row["signature"] != signature):
+        return None
+    return row["cursor"]
+
+
+def save_capture_cursor(conn, key: str, cursor, signature: str = None):
+    """
+    Grava o cursor (e a assinatura dos filtros da fatia) na mesma transação
+    dos leads da página.
+    cursor=None significa que a paginação terminou: remove o registro.
+    """
+    if cursor:
+        conn.execute(
+            """
+            INSERT INTO capture_cursors(key, cursor, updated_at, signature) VALUES(?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                cursor=excluded.cursor, updated_at=excluded.updated_at, signature=excluded.signature
+            """,
+            (key, cursor, datetime.utcnow().isoformat(), signature),
+        )
+    else:
+        conn.execute("DELETE FROM capture_cursors WHERE key=?", (key,))
+
+
+def get_completed_shards(date_start: str, date_end: str) -> dict:
+    """
+    Fatias da janela já paginadas até o fim: {key: assinatura (JSON)}.
+    """
+    with get_conn() as conn:
+        rows = conn.execute(
+            "SELECT key, params FROM capture_ledger WHERE day BETWEEN ? AND ?",
+            (date_start, date_end),
+        ).fetchall()
+    return {row["key"]: row["params"] for row in rows}
+
+
+def mark_shard_complete(conn, key: str, day: str, uf, params: str, pages: int, items: int):
+    """
+    Registra no ledger, na transação da última página, que a fatia terminou.
+    """
+    conn.execute(
+        """
+        INSERT INTO capture_ledger(key, day, uf, params, pages, items, completed_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(key) DO UPDATE SET
+            params=excluded.params, pages=excluded.pages, items=excluded.items,
+            completed_at=excluded.completed_at
+        """,
+        (key, day, uf, params, pages, items, datetime.utcnow().isoformat()),
+    )
+
+
+def get_counters(conn) -> dict:
+    """
+    Totais do dashboard lidos dos contadores mantidos por trigger (tempo constante).
+    """
+    values = dict(conn.execute("SELECT key, value FROM stats_counters").fetchall())
+    return {
+        "leads": values.get("leads", 0),
+        "sent": values.get("messages:sent", 0),
+        "failed": values.get("messages:failed", 0),
+        "optouts": values.get("optouts", 0),
+    }
+
+
+LEAD_FILTERS = ("uf", "cidade", "segmento", "status")
+
+
+def fts_query(text: str) -> str:
+    """
+    Converte o texto digitado numa consulta FTS5 segura (prefixo por termo).
+    """
+    terms = [t.replace('"', '""') for t in (text or "").split()]
+    return " ".join(f'"{t}"*' for t in terms)
+
+
+def query_leads(conn, filters: dict, before_id: int = None, limit: int = 50) -> list:
+    """
+    Página de leads em ordem decrescente de id (paginação por keyset: id < before_id).
+    filters: uf, cidade, segmento, status (igualdade), abertura_de/abertura_ate
+    (faixa de data_abertura) e q (busca FTS em razao_social/cidade).
+    """
+    where = []
+    params = []
+    for col in LEAD_FILTERS:
+        if filters.get(col):
+            where.append(f"{col} = ?")
+            params.append(filters[col])
+    if filters.get("abertura_de"):
+        where.append("data_abertura >= ?")
+        params.append(filters["abertura_de"])
+    if filters.get("abertura_ate"):
+        where.append("data_abertura <= ?")
+        params.append(filters["abertura_ate"])
+    if fts_query(filters.get("q")):
+        where.append("id IN (SELECT rowid FROM leads_fts WHERE leads_fts MATCH ?)")
+        params.append(fts_query(filters["q"]))
+    if before_id:
+        where.append("id < ?")
+        params.append(before_id)
+
+    sql = """
+        SELECT id, cnpj, razao_social, cidade, uf, cnae_principal, telefone, email,
+               segmento, status, data_abertura, created_at
+        FROM leads
+    """
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY id DESC LIMIT ?"
+    params.append(limit)
+    return conn.execute(sql, params).fetchall()
+
+
+def get_watermark(conn, name: str, default=None):
+    row = conn.execute("SELECT value FROM job_watermarks WHERE name=?", (name,)).fetchone()
+    return row["value"] if row else default
+
+
+def set_watermark(conn, name: str, value: str):
+    conn.execute(
+        """
+        INSERT INTO job_watermarks(name, value, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET value=excluded.value, updated_at=excluded.updated_at
+        """,
+        (name, value, datetime.utcnow().isoformat()),
+    )
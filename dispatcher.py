@@ -0,0 +1,240 @@
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from database import get_conn, get_daily_sent, reserve_daily_quota, release_daily_quota
+from utils import to_e164_br, today_str
+from optout import get_optouts
+from whatsapp_sender import send_text
+
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "4"))
+# Resultados gravados a cada N envios
+DISPATCH_COMMIT_BATCH = int(os.getenv("DISPATCH_COMMIT_BATCH", "20"))
+# Tempo máximo de uma execução (o job roda a cada 2 min)
+DISPATCH_BUDGET = float(os.getenv("DISPATCH_BUDGET", "110"))
+# Cota diária reservada de N em N envios (uma escrita por lote, não por mensagem)
+DISPATCH_QUOTA_BATCH = int(os.getenv("DISPATCH_QUOTA_BATCH", "10"))
+# Mensagem 'sending' há mais que isso é de um dispatcher que morreu: volta para a fila
+DISPATCH_CLAIM_TIMEOUT = float(os.getenv("DISPATCH_CLAIM_TIMEOUT", "600"))
+
+
+def available_slots(now: datetime, last_sent, interval: float, budget: float) -> tuple:
+    """
+    Quantos envios cabem nesta execução respeitando INTERVALO_ENVIO desde o
+    último envio. Retorna (slots, segundos até o primeiro envio).
+    """
+    delay = 0.0
+    if last_sent and interval > 0:
+        delay = max(0.0, interval - (now - datetime.fromisoformat(last_sent)).total_seconds())
+    if delay > budget:
+        return 0, delay
+    if interval <= 0:
+        return None, delay  # sem pacing: só o limite diário vale
+    return int((budget - delay) // interval) + 1, delay
+
+
+def _send(msg) -> dict:
+    # telefone_e164 vem pronto da captura/backfill ('' = inválido)
+    phone = msg["telefone_e164"]
+    if phone is None:
+        phone = to_e164_br(msg["telefone"])
+    if not phone:
+        return {"id": msg["id"], "lead_id": msg["lead_id"], "ok": False, "error": "telefone inválido"}
+    try:
+        result = send_text(phone, msg["message_text"])
+    except Exception as e:
+        result = {"ok": False, "error": str(e)}
+    return {
+        "id": msg["id"],
+        "lead_id": msg["lead_id"],
+        "ok": bool(result.get("ok")),
+        "message_id": result.get("message_id"),
+        "error": None if result.get("ok") else str(result.get("error"))[:500],
+        "sent_at": datetime.utcnow().isoformat(),
+    }
+
+
+def _work(msg, done):
+    try:
+        result = _send(msg)
+    except Exception as e:
+        result = {"id": msg["id"], "lead_id": msg["lead_id"], "ok": False, "error": str(e)[:500]}
+    done.put(result)
+
+
+def _record(results: list, day: str):
+    """
+    Grava um lote de resultados numa transação e devolve a cota das falhas.
+    """
+    if not results:
+        return
+    sent = [r for r in results if r["ok"]]
+    failed = [r for r in results if not r["ok"]]
+    with get_conn() as conn:
+        conn.executemany(
+            "UPDATE messages SET status='sent', sent_at=?, provider_message_id=?, error=NULL WHERE id=?",
+            [(r["sent_at"], r["message_id"], r["id"]) for r in sent],
+        )
+        conn.executemany(
+            "UPDATE messages SET status='failed', error=? WHERE id=?",
+            [(r["error"], r["id"]) for r in failed],
+        )
+        conn.executemany(
+            "UPDATE leads SET status='contatado' WHERE id=? AND status='novo'",
+            [(r["lead_id"],) for r in sent],
+        )
+        if failed:
+            release_daily_quota(day, len(failed))
+
+
+def reset_stale_claims(now: datetime) -> int:
+    """
+    Devolve para 'queued' as mensagens reservadas por um dispatcher que não
+    terminou (processo morto) há mais de DISPATCH_CLAIM_TIMEOUT segundos.
+    """
+    stale = (now - timedelta(seconds=DISPATCH_CLAIM_TIMEOUT)).isoformat()
+    with get_conn() as conn:
+        return conn.execute(
+            "UPDATE messages SET status='queued', claimed_at=NULL WHERE status='sending' AND claimed_at < ?",
+            (stale,),
+        ).rowcount
+
+
+def claim_queued(n: int, now: datetime) -> list:
+    """
+    Reserva até n mensagens 'queued' (as mais antigas) num único UPDATE:
+    dois dispatchers ao mesmo tempo nunca pegam a mesma mensagem.
+    """
+    with get_conn() as conn:
+        ids = [r["id"] for r in conn.execute(
+            """
+            UPDATE messages SET status='sending', claimed_at=?
+            WHERE id IN (SELECT id FROM messages WHERE status='queued' ORDER BY id LIMIT ?)
+            RETURNING id
+            """,
+            (now.isoformat(), n),
+        ).fetchall()]
+        if not ids:
+            return []
+        return conn.execute(f"""
+            SELECT m.id, m.lead_id, m.message_text, l.telefone, l.telefone_e164
+            FROM messages m JOIN leads l ON l.id = m.lead_id
+            WHERE m.id IN ({",".join("?" * len(ids))})
+            ORDER BY m.id
+        """, ids).fetchall()
+
+
+def _unclaim(messages: list):
+    """
+    Devolve para a fila as mensagens reservadas que não chegaram a ser enviadas.
+    """
+    if not messages:
+        return
+    with get_conn() as conn:
+        conn.executemany(
+            "UPDATE messages SET status='queued', claimed_at=NULL WHERE id=? AND status='sending'",
+            [(m["id"],) for m in messages],
+        )
+
+
+def _cancel_optouts(messages: list):
+    """
+    Cancela mensagens de quem pediu opt-out e bloqueia o lead.
+    """
+    if not messages:
+        return
+    with get_conn() as conn:
+        conn.executemany(
+            "UPDATE messages SET status='cancelled', error='opt-out' WHERE id=?",
+            [(m["id"],) for m in messages],
+        )
+        conn.executemany(
+            "UPDATE leads SET status='bloqueado' WHERE id=?",
+            [(m["lead_id"],) for m in messages],
+        )
+
+
+def dispatch_queued(now: datetime = None) -> dict:
+    """
+    Envia mensagens 'queued' com concorrência limitada (DISPATCH_WORKERS),
+    espaçadas por INTERVALO_ENVIO segundos e até o LIMITE_DIARIO do dia.
+    As mensagens são reservadas ('sending') antes do envio e a cota é
+    reservada em lotes de DISPATCH_QUOTA_BATCH, então vários dispatchers ao
+    mesmo tempo não repetem mensagens nem estouram o limite.
+    """
+    now = now or datetime.utcnow()
+    interval = float(os.getenv("INTERVALO_ENVIO", "30"))
+    limit = int(os.getenv("LIMITE_DIARIO", "50"))
+    day = today_str()
+
+    reset_stale_claims(now)
+    remaining = limit - get_daily_sent(day)
+    if remaining <= 0:
+        return {"sent": 0, "failed": 0, "reason": "limite_diario"}
+
+    with get_conn() as conn:
+        last_sent = conn.execute(
+            "SELECT MAX(sent_at) FROM messages WHERE sent_at IS NOT NULL"
+        ).fetchone()[0]
+    slots, delay = available_slots(now, last_sent, interval, DISPATCH_BUDGET)
+    if slots == 0:
+        return {"sent": 0, "failed": 0, "reason": "intervalo"}
+    n = remaining if slots is None else min(remaining, slots)
+    messages = claim_queued(n, now)
+
+    # Opt-out checado em memória (sem consulta por mensagem)
+    blocked_phones = get_optouts()
+    blocked = []
+    to_send = []
+    for msg in messages:
+        phone = msg["telefone_e164"] if msg["telefone_e164"] is not None else to_e164_br(msg["telefone"])
+        (blocked if phone in blocked_phones else to_send).append(msg)
+    _cancel_optouts(blocked)
+    messages = to_send
+
+    done = queue.Queue()
+    pending = []
+    counts = {"sent": 0, "failed": 0, "optout": len(blocked)}
+
+    def take(timeout):
+        try:
+            result = done.get(timeout=timeout)
+        except queue.Empty:
+            return
+        counts["sent" if result["ok"] else "failed"] += 1
+        pending.append(result)
+        if len(pending) >= DISPATCH_COMMIT_BATCH:
+            _record(pending, day)
+            pending.clear()
+
+    start = time.monotonic() + delay
+    granted = 0
+    submitted = 0
+    with ThreadPoolExecutor(max_workers=DISPATCH_WORKERS, thread_name_prefix="dispatch") as pool:
+        for i, msg in enumerate(messages):
+            slot = start + i * max(0.0, interval)
+            # Enquanto espera o próximo horário, grava o que já voltou
+            while True:
+                wait = slot - time.monotonic()
+                if wait <= 0:
+                    break
+                take(wait)
+            if not granted:
+                granted = reserve_daily_quota(
+                    day, min(DISPATCH_QUOTA_BATCH, len(messages) - i), limit
+                )
+                if not granted:
+                    counts["reason"] = "limite_diario"  # outro dispatcher usou a cota
+                    break
+            granted -= 1
+            pool.submit(_work, msg, done)
+            submitted += 1
+
+        while counts["sent"] + counts["failed"] < submitted:
+            take(1.0)
+    _record(pending, day)
+    _unclaim(messages[submitted:])
+    release_daily_quota(day, granted)
+    return counts
@@ -0,0 +1,72 @@
+import os
+from datetime import datetime, timedelta
+
+from database import get_conn, get_watermark, set_watermark
+from templating import get_templates, template_for
+
+# (kind, kind de origem, horas após o envio da origem, template)
+# A cadeia 24h -> 72h -> 7d conta a partir do envio do passo anterior, então
+# um follow-up só nasce depois que o anterior realmente saiu.
+FOLLOWUP_STEPS = [
+    ("followup_24h", "first", 24, "template_followup_24h"),
+    ("followup_72h", "followup_24h", 48, "template_followup_72h"),
+    ("followup_7d", "followup_72h", 96, "template_followup_7d"),
+]
+
+# Na primeira execução (sem watermark) só olha este tanto para trás, para não
+# disparar follow-ups de todo o histórico de uma vez
+FOLLOWUP_LOOKBACK_HOURS = int(os.getenv("FOLLOWUP_LOOKBACK_HOURS", "24"))
+
+# Leads nestes status não recebem mais follow-up
+FOLLOWUP_STOP_STATUS = ("respondeu", "convertido", "bloqueado")
+
+FOLLOWUP_SQL = """
+    INSERT INTO messages(lead_id, kind, template_key, message_text, status)
+    SELECT m.lead_id, :kind, :template_key, {text}, 'queued'
+    FROM messages m JOIN leads l ON l.id = m.lead_id
+    WHERE m.kind = :source AND m.status = 'sent'
+      AND m.sent_at > :since AND m.sent_at <= :until
+      AND COALESCE(l.status, '') NOT IN ({stop})
+      AND NOT EXISTS (SELECT 1 FROM opt_out o WHERE o.phone = l.telefone_e164)
+      AND NOT EXISTS (SELECT 1 FROM messages f WHERE f.lead_id = m.lead_id AND f.kind = :kind)
+"""
+
+
+def schedule_followups(now: datetime = None) -> dict:
+    """
+    Enfileira os follow-ups vencidos com um INSERT ... SELECT por passo.
+    Cada passo guarda a watermark do último `sent_at` já considerado, então
+    cada execução só varre (watermark, now - atraso] pelo índice (kind, sent_at).
+    Retorna {kind: enfileirados}.
+    """
+    now = now or datetime.utcnow()
+    templates = get_templates()
+    stop = ", ".join(f"'{s}'" for s in FOLLOWUP_STOP_STATUS)
+
+    counts = {}
+    with get_conn() as conn:
+        for kind, source, hours, template_key in FOLLOWUP_STEPS:
+            until = (now - timedelta(hours=hours)).isoformat()
+            since = get_watermark(conn, f"followup:{kind}")
+            if since is None:
+                since = (now - timedelta(hours=hours + FOLLOWUP_LOOKBACK_HOURS)).isoformat()
+            if since >= until:
+                counts[kind] = 0
+                continue
+
+            tpl = template_for(template_key, templates)
+            text, params = tpl.sql_expression("l")
+            cur = conn.execute(
+                FOLLOWUP_SQL.format(text=text, stop=stop),
+                {
+                    **params,
+                    "kind": kind,
+                    "template_key": tpl.key,
+                    "source": source,
+                    "since": since,
+                    "until": until,
+                },
+            )
+            counts[kind] = cur.rowcount
+            set_watermark(conn, f"followup:{kind}", until)
+    return counts
@@ -0,0 +1,22 @@
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count() * 2 + 1)))
+threads = int(os.getenv("WEB_THREADS", "2"))
+timeout = int(os.getenv("WEB_TIMEOUT", "60"))
+graceful_timeout = 30
+
+# Sem preload: o scheduler (threads) e as conexões SQLite precisam nascer em
+# cada worker, não no master antes do fork
+preload_app = False
+
+accesslog = "-"
+errorlog = "-"
+
+
+def worker_exit(server, worker):
+    # Libera o lease na hora para outro worker assumir o scheduler
+    from app import shutdown
+
+    shutdown()
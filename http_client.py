@@ -0,0 +1,145 @@
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "4"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "30"))
+# Retry-After acima disso não é esperado aqui: a resposta volta ao chamador
+HTTP_RETRY_AFTER_MAX = float(os.getenv("HTTP_RETRY_AFTER_MAX", "120"))
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+_sessions = {}
+_stats = {}
+_lock = threading.Lock()
+
+
+def get_session(upstream: str) -> requests.Session:
+    """
+    Session keep-alive (pool de conexões) por upstream: "cnpja", "zapi"...
+    """
+    with _lock:
+        session = _sessions.get(upstream)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[upstream] = session
+        return session
+
+
+def retry_after_seconds(response):
+    """
+    Valor do cabeçalho Retry-After (segundos ou data HTTP), ou None.
+    """
+    value = (getattr(response, "headers", None) or {}).get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def backoff_delay(attempt: int, retry_after: float = None) -> float:
+    """
+    Retry-After quando o upstream informa; senão backoff exponencial com jitter.
+    """
+    if retry_after is not None:
+        return retry_after
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+
+def _record(endpoint: str, seconds: float, error: bool, status="error"):
+    metrics.upstream_duration.observe(seconds, endpoint, status)
+    with _lock:
+        st = _stats.get(endpoint)
+        if st is None:
+            st = _stats[endpoint] = {
+                "count": 0, "errors": 0, "retries": 0, "total_seconds": 0.0, "max_seconds": 0.0,
+            }
+        st["count"] += 1
+        st["errors"] += int(error)
+        st["total_seconds"] += seconds
+        st["max_seconds"] = max(st["max_seconds"], seconds)
+
+
+def _count_retry(endpoint: str):
+    metrics.upstream_retries.inc(endpoint)
+    with _lock:
+        _stats[endpoint]["retries"] += 1
+
+
+def get_stats() -> dict:
+    """
+    Latência e erros por endpoint desde o início do processo.
+    """
+    with _lock:
+        return {
+            k: dict(v, avg_seconds=v["total_seconds"] / v["count"] if v["count"] else 0.0)
+            for k, v in _stats.items()
+        }
+
+
+def request(upstream: str, method: str, url: str, endpoint: str = None,
+            idempotent: bool = True, retries: int = None, **kwargs):
+    """
+    Requisição pela Session do upstream, com timeouts de conexão/leitura
+    separados e novas tentativas em 429/5xx e falhas de rede.
+
+    idempotent=False (ex.: envio de mensagem) só repete quando é certo que o
+    pedido não foi processado: 429 e falha ao conectar.
+    retries=0 desliga as novas tentativas (quem chama faz as suas, ex.: sob
+    o rate limit da captura); None = HTTP_MAX_RETRIES.
+    Retorna a última resposta; exceções de rede sobem após a última tentativa.
+    """
+    kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    endpoint = endpoint or f"{upstream} {method} {urlparse(url).path}"
+    session = get_session(upstream)
+    max_retries = HTTP_MAX_RETRIES if retries is None else retries
+
+    attempt = 0
+    while True:
+        started = time.monotonic()
+        try:
+            r = session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            _record(endpoint, time.monotonic() - started, error=True)
+            retryable = isinstance(e, requests.exceptions.ConnectTimeout) or (
+                idempotent and isinstance(e, (requests.exceptions.ConnectionError,
+                                              requests.exceptions.Timeout))
+            )
+            if not retryable or attempt >= max_retries:
+                raise
+            _count_retry(endpoint)
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+            continue
+
+        _record(endpoint, time.monotonic() - started, r.status_code >= 400, str(r.status_code))
+
+        retryable = r.status_code == 429 or (idempotent and r.status_code in RETRY_STATUS)
+        if not retryable or attempt >= max_retries:
+            return r
+        wait = retry_after_seconds(r)
+        if wait is not None and wait > HTTP_RETRY_AFTER_MAX:
+            return r
+        _count_retry(endpoint)
+        time.sleep(backoff_delay(attempt, wait))
+        attempt += 1
@@ -0,0 +1,90 @@
+import os
+from datetime import datetime
+
+from segmentation import segmentos_por_cnae
+from utils import to_e164_br_many
+
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "500"))
+
+LEAD_COLUMNS = (
+    "cnpj", "razao_social", "cidade", "uf", "cnae_principal",
+    "telefone", "telefone_e164", "email", "endereco", "data_abertura", "segmento",
+    "created_at", "status",
+)
+
+INSERT_LEAD_SQL = f"""
+    INSERT INTO leads({", ".join(LEAD_COLUMNS)})
+    VALUES ({", ".join("?" for _ in LEAD_COLUMNS)})
+    ON CONFLICT(cnpj) DO NOTHING
+"""
+
+
+def load_known_cnpjs(conn, date_start: str = None, date_end: str = None) -> set:
+    """
+    CNPJs já gravados, para descartar duplicados antes de tocar no banco.
+    Com date_start/date_end carrega só os abertos nessa faixa (a captura
+    busca por data de abertura, então só eles podem se repetir); o que
+    escapar cai no ON CONFLICT.
+    """
+    if date_start is None and date_end is None:
+        return {row[0] for row in conn.execute("SELECT cnpj FROM leads")}
+    return {
+        row[0] for row in conn.execute(
+            "SELECT cnpj FROM leads WHERE data_abertura BETWEEN ? AND ?",
+            (date_start or "", date_end or "9999-12-31"),
+        )
+    }
+
+
+def ingest_leads(conn, leads, known: set = None, chunk_size: int = None) -> dict:
+    """
+    Insere leads normalizados em lote (executemany + ON CONFLICT DO NOTHING).
+
+    `known` é o conjunto de CNPJs já vistos; é consultado e atualizado aqui.
+    Todos os leads inseridos na chamada recebem o mesmo created_at, devolvido
+    no resultado para o chamador localizar as linhas novas com um SELECT.
+    Não faz commit: roda na transação do chamador.
+    """
+    chunk_size = chunk_size or INGEST_CHUNK_SIZE
+    if known is None:
+        known = set()
+    created_at = datetime.utcnow().isoformat()
+
+    inserted = 0
+    skipped = 0
+    fresh = []
+    for lead in leads:
+        cnpj = lead.get("cnpj")
+        if not cnpj or cnpj in known:
+            skipped += 1
+            continue
+        known.add(cnpj)
+        fresh.append(lead)
+
+    segmentos = segmentos_por_cnae([lead.get("cnae_principal") for lead in fresh])
+    telefones = to_e164_br_many([lead.get("telefone") for lead in fresh])
+    rows = [
+        (
+            lead["cnpj"],
+            lead.get("razao_social"),
+            lead.get("cidade"),
+            lead.get("uf"),
+            lead.get("cnae_principal"),
+            lead.get("telefone"),
+            e164 or "",
+            lead.get("email"),
+            lead.get("endereco"),
+            lead.get("data_abertura"),
+            seg,
+            created_at,
+            "novo",
+        )
+        for lead, seg, e164 in zip(fresh, segmentos, telefones)
+    ]
+    for i in range(0, len(rows), chunk_size):
+        inserted += conn.executemany(INSERT_LEAD_SQL, rows[i:i + chunk_size]).rowcount
+
+    # Conflitos que passaram pelo pré-filtro (ex.: outro processo gravou
+    # antes) também contam como ignorados
+    skipped += len(rows) - inserted
+    return {"inserted": inserted, "skipped": skipped, "created_at": created_at}
@@ -0,0 +1,234 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import metrics
+from database import get_conn, log_event
+from leader import holder_id
+from scheduler_jobs import (
+    capture_job,
+    capture_backfill_job,
+    queue_initial_messages_job,
+    dispatch_messages_job,
+    schedule_followups_job,
+    drain_notifications_job,
+    backfill_phones_job,
+    process_webhooks_job,
+)
+
+JOBS = {
+    "capture": capture_job,
+    "capture_backfill": capture_backfill_job,  # date_start, date_end[, force]
+    "queue": queue_initial_messages_job,
+    "dispatch": dispatch_messages_job,
+    "followups": schedule_followups_job,
+    "notifications": drain_notifications_job,
+    "backfill_phones": backfill_phones_job,
+    "webhooks": process_webhooks_job,
+}
+
+# Jobs que disputam o mesmo recurso dividem um slot: só um roda por vez
+# (o backfill pagina a CNPJA com o mesmo limite e os mesmos cursores da captura)
+JOB_SLOTS = {"capture_backfill": "capture"}
+
+# Parâmetros aceitos no corpo de POST /api/jobs/<job>
+JOB_PARAMS = {"capture_backfill": {"date_start", "date_end", "force"}}
+
+# Cada execução renova heartbeat_at a cada JOB_HEARTBEAT_SECONDS; 'running'
+# sem heartbeat há mais de JOB_STALE_SECONDS é de um processo que morreu
+# (ex.: líder antigo após failover) e é abandonada
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "15"))
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "90"))
+JOB_RUNNER_WORKERS = int(os.getenv("JOB_RUNNER_WORKERS", "2"))
+# Execuções terminadas mais velhas que isso são apagadas (o scheduler grava
+# milhares por dia)
+JOB_RUNS_RETENTION_DAYS = int(os.getenv("JOB_RUNS_RETENTION_DAYS", "7"))
+
+# Identifica este processo nas execuções que ele registra
+RUNNER_ID = holder_id()
+
+_pool = ThreadPoolExecutor(max_workers=JOB_RUNNER_WORKERS, thread_name_prefix="job")
+
+
+class UnknownJob(KeyError):
+    pass
+
+
+def job_slot(job: str) -> str:
+    return JOB_SLOTS.get(job, job)
+
+
+def validate_kwargs(job: str, body) -> dict:
+    """
+    Valida os parâmetros de uma execução manual (corpo JSON da API).
+    Retorna os kwargs do job; ValueError com a mensagem para o cliente.
+    """
+    if body is None:
+        body = {}
+    if not isinstance(body, dict):
+        raise ValueError("o corpo deve ser um objeto JSON")
+    unknown = set(body) - JOB_PARAMS.get(job, set())
+    if unknown:
+        raise ValueError(f"parâmetros desconhecidos: {', '.join(sorted(unknown))}")
+    if job == "capture_backfill":
+        days = []
+        for name in ("date_start", "date_end"):
+            value = body.get(name)
+            try:
+                days.append(date.fromisoformat(value))
+            except (TypeError, ValueError):
+                raise ValueError(f"{name} obrigatório no formato AAAA-MM-DD")
+        if days[0] > days[1]:
+            raise ValueError("date_start depois de date_end")
+        if not isinstance(body.get("force", False), bool):
+            raise ValueError("force deve ser true ou false")
+    return body
+
+
+def start_run(job: str, trigger: str):
+    """
+    Registra o início de uma execução. O índice único parcial em
+    job_runs(slot) WHERE status='running' garante uma execução por slot
+    (JOB_SLOTS) entre todos os processos. Retorna o id da execução ou None
+    se já há uma rodando.
+    """
+    if job not in JOBS:
+        raise UnknownJob(job)
+    slot = job_slot(job)
+    now = datetime.utcnow()
+    stale = (now - timedelta(seconds=JOB_STALE_SECONDS)).isoformat()
+    cutoff = (now - timedelta(days=JOB_RUNS_RETENTION_DAYS)).isoformat()
+    with get_conn() as conn:
+        # Retenção: só o histórico deste job (faixa do idx_job_runs_job)
+        conn.execute(
+            "DELETE FROM job_runs WHERE job=? AND status != 'running' AND started_at < ?",
+            (job, cutoff),
+        )
+        conn.execute(
+            """
+            UPDATE job_runs SET status='abandoned', finished_at=?, error='execução abandonada'
+            WHERE slot=? AND status='running' AND COALESCE(heartbeat_at, started_at) < ?
+            """,
+            (now.isoformat(), slot, stale),
+        )
+        cur = conn.execute(
+            """
+            INSERT OR IGNORE INTO job_runs(job, slot, trigger, status, started_at, holder, heartbeat_at)
+            VALUES (?, ?, ?, 'running', ?, ?, ?)
+            """,
+            (job, slot, trigger, now.isoformat(), RUNNER_ID, now.isoformat()),
+        )
+        return cur.lastrowid if cur.rowcount else None
+
+
+def heartbeat(run_id: int) -> bool:
+    """
+    Renova o heartbeat da execução. False = ela já não está 'running'
+    (foi abandonada por outro processo).
+    """
+    with get_conn() as conn:
+        cur = conn.execute(
+            "UPDATE job_runs SET heartbeat_at=? WHERE id=? AND status='running'",
+            (datetime.utcnow().isoformat(), run_id),
+        )
+        return cur.rowcount > 0
+
+
+def _heartbeat_loop(run_id: int, done: threading.Event):
+    while not done.wait(JOB_HEARTBEAT_SECONDS):
+        try:
+            if not heartbeat(run_id):
+                return
+        except Exception as e:
+            log_event("job_error", f"run={run_id} heartbeat error={str(e)[:200]}")
+
+
+def finish_run(run_id: int, seconds: float, counts=None, error: str = None):
+    with get_conn() as conn:
+        conn.execute(
+            """
+            UPDATE job_runs SET status=?, finished_at=?, seconds=?, counts=?, error=?
+            WHERE id=?
+            """,
+            (
+                "failed" if error else "done",
+                datetime.utcnow().isoformat(),
+                round(seconds, 3),
+                json.dumps(counts) if counts is not None else None,
+                error,
+                run_id,
+            ),
+        )
+
+
+def _execute(job: str, run_id: int, kwargs: dict = None):
+    started = time.monotonic()
+    done = threading.Event()
+    threading.Thread(
+        target=_heartbeat_loop, args=(run_id, done), name=f"job-heartbeat-{run_id}", daemon=True
+    ).start()
+    try:
+        counts = JOBS[job](**(kwargs or {}))
+    except Exception as e:
+        done.set()
+        seconds = time.monotonic() - started
+        metrics.job_duration.observe(seconds, job, "failed")
+        finish_run(run_id, seconds, error=str(e)[:500])
+        log_event("job_error", f"job={job} run={run_id} error={str(e)[:300]}")
+        return None
+    done.set()
+    seconds = time.monotonic() - started
+    metrics.job_duration.observe(seconds, job, "done")
+    finish_run(run_id, seconds, counts if isinstance(counts, dict) else None)
+    return counts
+
+
+def run_job(job: str, trigger: str = "scheduler"):
+    """
+    Executa o job na thread atual (uso do APScheduler), registrando a
+    execução. Se o mesmo job já está rodando em qualquer processo, pula.
+    """
+    run_id = start_run(job, trigger)
+    if run_id is None:
+        # Só o contador: um evento por tick sobreposto encheria a tabela events
+        metrics.job_skipped.inc(job)
+        return None
+    return _execute(job, run_id)
+
+
+def submit_job(job: str, trigger: str = "manual", kwargs: dict = None):
+    """
+    Registra a execução e roda o job em background (com `kwargs`, ex.: o
+    intervalo do capture_backfill). Retorna o id da execução (para polling)
+    ou None se o job já está rodando.
+    """
+    run_id = start_run(job, trigger)
+    if run_id is not None:
+        _pool.submit(_execute, job, run_id, kwargs)
+    return run_id
+
+
+def _row(row) -> dict:
+    run = dict(row)
+    run["counts"] = json.loads(run["counts"]) if run["counts"] else None
+    return run
+
+
+def get_run(run_id: int):
+    with get_conn(readonly=True) as conn:
+        row = conn.execute("SELECT * FROM job_runs WHERE id=?", (run_id,)).fetchone()
+    return _row(row) if row else None
+
+
+def recent_runs(job: str = None, limit: int = 50) -> list:
+    with get_conn(readonly=True) as conn:
+        if job:
+            rows = conn.execute(
+                "SELECT * FROM job_runs WHERE job=? ORDER BY id DESC LIMIT ?", (job, limit)
+            ).fetchall()
+        else:
+            rows = conn.execute("SELECT * FROM job_runs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+    return [_row(r) for r in rows]
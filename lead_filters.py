@@ -0,0 +1,67 @@
+import os
+import re
+
+from segmentation import CNAE_LEN
+
+
+def parse_list(value: str) -> list:
+    return [v.strip() for v in (value or "").split(",") if v.strip()]
+
+
+def get_target_filters() -> dict:
+    """
+    CNAE_FILTRO e UF_FILTRO (listas separadas por vírgula) do ambiente.
+    CNAE aceita subclasse completa ("5611201", "56.11-2-01") ou prefixo
+    ("56", "5611"). Vazio = sem filtro.
+    """
+    cnaes = []
+    for c in parse_list(os.getenv("CNAE_FILTRO", "")):
+        digits = re.sub(r"\D", "", c)[:CNAE_LEN]
+        if digits and digits not in cnaes:
+            cnaes.append(digits)
+    ufs = sorted({u.upper() for u in parse_list(os.getenv("UF_FILTRO", ""))})
+    return {"cnaes": tuple(cnaes), "ufs": tuple(ufs)}
+
+
+def upstream_params(filters: dict) -> dict:
+    """
+    Parte dos filtros que a CNPJA aplica no servidor. mainActivity.id.in só
+    aceita códigos completos: se houver algum prefixo, o CNAE fica todo para
+    o filtro local (o predicado continua valendo para tudo).
+    """
+    params = {}
+    if filters["ufs"]:
+        params["address.state.in"] = ",".join(filters["ufs"])
+    if filters["cnaes"] and all(len(c) == CNAE_LEN for c in filters["cnaes"]):
+        params["mainActivity.id.in"] = ",".join(filters["cnaes"])
+    return params
+
+
+def _cnae_digits(value) -> str:
+    if value is None:
+        return ""
+    digits = re.sub(r"\D", "", str(value))
+    return digits.zfill(CNAE_LEN) if len(digits) == CNAE_LEN - 1 else digits
+
+
+def compile_office_predicate(filters: dict):
+    """
+    Predicado sobre o item cru do /office (antes do normalize_office).
+    Retorna None quando não há filtro, para o chamador pular a checagem.
+    """
+    cnaes = tuple(filters["cnaes"])
+    ufs = frozenset(filters["ufs"])
+    if not cnaes and not ufs:
+        return None
+
+    def match(item) -> bool:
+        if ufs and ((item.get("address") or {}).get("state") or "").upper() not in ufs:
+            return False
+        if cnaes:
+            activity = item.get("mainActivity")
+            code = _cnae_digits(activity.get("id") if isinstance(activity, dict) else None)
+            if not code.startswith(cnaes):
+                return False
+        return True
+
+    return match
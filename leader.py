@@ -0,0 +1,106 @@
+import os
+import socket
+import threading
+import time
+import uuid
+
+from database import get_conn, log_event
+
+# O líder renova o lease a cada LEASE_HEARTBEAT segundos; se parar de renovar
+# (processo morto/travado), outro worker assume depois de LEASE_TTL segundos
+LEASE_TTL = float(os.getenv("LEASE_TTL", "30"))
+LEASE_HEARTBEAT = float(os.getenv("LEASE_HEARTBEAT", "10"))
+
+SCHEDULER_LEASE = "scheduler"
+
+
+def holder_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def acquire_lease(name: str, holder: str, ttl: float = None, now: float = None) -> bool:
+    """
+    Pega ou renova o lease num único statement: só atualiza se o holder já
+    for o dono ou se o lease do dono atual expirou. True = somos o líder.
+    """
+    ttl = LEASE_TTL if ttl is None else ttl
+    now = time.time() if now is None else now
+    with get_conn() as conn:
+        row = conn.execute(
+            """
+            INSERT INTO leases(name, holder, expires_at, renewed_at)
+            VALUES (:name, :holder, :expires_at, datetime('now'))
+            ON CONFLICT(name) DO UPDATE SET
+                holder = excluded.holder,
+                expires_at = excluded.expires_at,
+                renewed_at = excluded.renewed_at
+            WHERE leases.holder = excluded.holder OR leases.expires_at < :now
+            RETURNING holder
+            """,
+            {"name": name, "holder": holder, "expires_at": now + ttl, "now": now},
+        ).fetchone()
+    return row is not None
+
+
+def release_lease(name: str, holder: str):
+    with get_conn() as conn:
+        conn.execute("DELETE FROM leases WHERE name=? AND holder=?", (name, holder))
+
+
+class LeaderElector:
+    """
+    Thread de heartbeat: tenta pegar/renovar o lease periodicamente e chama
+    on_elected() ao virar líder e on_demoted() ao perder o lease.
+    """
+
+    def __init__(self, name: str, on_elected, on_demoted, holder: str = None,
+                 ttl: float = None, heartbeat: float = None):
+        self.name = name
+        self.holder = holder or holder_id()
+        self.ttl = LEASE_TTL if ttl is None else ttl
+        self.heartbeat = LEASE_HEARTBEAT if heartbeat is None else heartbeat
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.is_leader = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def tick(self) -> bool:
+        try:
+            leader = acquire_lease(self.name, self.holder, self.ttl)
+        except Exception as e:
+            # Sem conseguir renovar não dá para garantir exclusividade
+            log_event("leader_error", f"holder={self.holder} error={str(e)[:200]}")
+            leader = False
+        if leader and not self.is_leader:
+            self.is_leader = True
+            log_event("leader", f"elected holder={self.holder}")
+            self.on_elected()
+        elif not leader and self.is_leader:
+            self.is_leader = False
+            log_event("leader", f"demoted holder={self.holder}")
+            self.on_demoted()
+        return leader
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.tick()
+            self._stop.wait(self.heartbeat)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="leader", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Para o heartbeat e libera o lease para outro worker assumir na hora.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.heartbeat + 1)
+        if self.is_leader:
+            self.is_leader = False
+            self.on_demoted()
+            release_lease(self.name, self.holder)
@@ -0,0 +1,127 @@
+import bisect
+import os
+import threading
+
+# Desligue com METRICS_ENABLED=0 (o custo é um perf_counter e um lock por observação)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+# Buckets em segundos
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+HTTP_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+JOB_BUCKETS = (0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+_registry = []
+
+
+def _sort_key(item):
+    # Rótulos podem misturar tipos (ex.: status 200 e "error"); ordena como texto
+    return tuple(map(str, item[0]))
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return ",".join(pairs)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            items = sorted(self.values.items(), key=_sort_key)
+        for labels, value in items:
+            lbl = _labels(self.labelnames, labels)
+            lines.append(f"{self.name}{{{lbl}}} {value}" if lbl else f"{self.name} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    Histograma em memória no formato do Prometheus (buckets cumulativos na
+    exportação, contagem por bucket no processo).
+    """
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=HTTP_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}  # labels -> [contagens por bucket (+Inf no fim), soma]
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, seconds: float, *labels):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += seconds
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {labels: (list(counts), total) for labels, (counts, total) in self.series.items()}
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self.snapshot().items(), key=_sort_key):
+            base = _labels(self.labelnames, labels)
+            sep = "," if base else ""
+            running = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                running += count
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{bound}"}} {running}')
+            lbl = f"{{{base}}}" if base else ""
+            lines.append(f"{self.name}_sum{lbl} {total:.6f}")
+            lines.append(f"{self.name}_count{lbl} {running}")
+        return lines
+
+
+def render() -> str:
+    """
+    Todas as métricas no formato texto do Prometheus (/metrics).
+    """
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+job_duration = Histogram(
+    "prospec_job_duration_seconds", "Duração das execuções dos jobs", ("job", "status"), JOB_BUCKETS
+)
+job_skipped = Counter(
+    "prospec_job_skipped_total", "Execuções puladas porque o job já estava rodando", ("job",)
+)
+upstream_duration = Histogram(
+    "prospec_upstream_request_duration_seconds",
+    "Latência por tentativa das chamadas HTTP aos upstreams (CNPJA, Z-API)",
+    ("endpoint", "status"),
+    HTTP_BUCKETS,
+)
+upstream_retries = Counter(
+    "prospec_upstream_retries_total", "Novas tentativas de chamadas HTTP", ("endpoint",)
+)
+sql_duration = Histogram(
+    "prospec_sql_duration_seconds",
+    "Tempo de execute/executemany/commit no SQLite (inclui espera por lock)",
+    ("op",),
+    SQL_BUCKETS,
+)
@@ -0,0 +1,55 @@
+import threading
+
+from database import get_conn
+
+
+class OptOutSet:
+    """
+    Cópia em memória da tabela opt_out para checagem O(1) no envio.
+    refresh() só lê as linhas novas (id > último visto); como o opt-out só
+    cresce na prática, remoções manuais pedem reload().
+    """
+
+    def __init__(self):
+        self.phones = set()
+        self.last_id = 0
+        self.lock = threading.Lock()
+
+    def refresh(self) -> int:
+        with self.lock:
+            with get_conn(readonly=True) as conn:
+                rows = conn.execute(
+                    "SELECT id, phone FROM opt_out WHERE id > ? ORDER BY id", (self.last_id,)
+                ).fetchall()
+            for row in rows:
+                self.phones.add(row["phone"])
+            if rows:
+                self.last_id = rows[-1]["id"]
+            return len(rows)
+
+    def reload(self):
+        with self.lock:
+            self.phones = set()
+            self.last_id = 0
+        self.refresh()
+
+    def add(self, phone: str):
+        with self.lock:
+            self.phones.add(phone)
+
+    def __contains__(self, phone) -> bool:
+        return bool(phone) and phone in self.phones
+
+    def __len__(self) -> int:
+        return len(self.phones)
+
+
+optouts = OptOutSet()
+
+
+def get_optouts() -> OptOutSet:
+    """
+    Conjunto global, atualizado incrementalmente a cada chamada.
+    """
+    optouts.refresh()
+    return optouts
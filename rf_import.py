@@ -0,0 +1,214 @@
+"""
+Importação offline dos dados abertos do CNPJ (Receita Federal).
+
+    python rf_import.py Estabelecimentos0.zip Estabelecimentos1.zip \
+        --desde 2024-01-01 --ate 2024-12-31 --municipios Municipios.zip
+
+Lê os .zip em streaming (sem extrair), filtra pela data de início de
+atividade, CNAE_FILTRO e UF_FILTRO antes de montar qualquer dict e grava em
+transações grandes. O progresso (linhas lidas) fica em capture_cursors com a
+chave rf:<arquivo>:<membros do zip>, então uma importação interrompida
+continua de onde parou e o dump do mês seguinte (mesmo nome de arquivo,
+membro com outra data, ex.: ...D40113... -> ...D40210...) começa do zero.
+"""
+import argparse
+import csv
+import io
+import os
+import zipfile
+
+from cnpj_scraper import normalize_office
+from database import get_conn, get_capture_cursor, init_db, log_event, save_capture_cursor
+from ingestion import ingest_leads
+from lead_filters import get_target_filters
+
+RF_ENCODING = "latin-1"
+# Leads por transação
+RF_IMPORT_CHUNK = int(os.getenv("RF_IMPORT_CHUNK", "5000"))
+# Salva o progresso pelo menos a cada N linhas lidas, mesmo sem leads novos
+RF_PROGRESS_ROWS = int(os.getenv("RF_PROGRESS_ROWS", "500000"))
+
+# Colunas do layout "Estabelecimentos"
+COL_CNPJ_BASICO, COL_CNPJ_ORDEM, COL_CNPJ_DV = 0, 1, 2
+COL_NOME_FANTASIA = 4
+COL_SITUACAO = 5
+COL_DATA_INICIO = 10
+COL_CNAE = 11
+COL_TIPO_LOGRADOURO, COL_LOGRADOURO, COL_NUMERO = 13, 14, 15
+COL_BAIRRO = 17
+COL_UF = 19
+COL_MUNICIPIO = 20
+COL_DDD1, COL_TELEFONE1 = 21, 22
+COL_EMAIL = 27
+N_COLS = 30
+
+SITUACAO_ATIVA = "02"
+
+
+def _open_csv(zf: zipfile.ZipFile, name: str):
+    text = io.TextIOWrapper(zf.open(name), encoding=RF_ENCODING, newline="")
+    return csv.reader(text, delimiter=";")
+
+
+def load_municipios(path: str) -> dict:
+    """
+    Tabela de municípios da Receita (código;nome) -> dict.
+    """
+    municipios = {}
+    with zipfile.ZipFile(path) as zf:
+        for name in zf.namelist():
+            for row in _open_csv(zf, name):
+                if len(row) >= 2:
+                    municipios[row[0]] = row[1].strip().title()
+    return municipios
+
+
+def iter_rows(path: str):
+    """
+    Linhas cruas de todos os CSVs dentro do zip, sem extrair para o disco.
+    """
+    with zipfile.ZipFile(path) as zf:
+        for name in zf.namelist():
+            if not name.endswith("/"):
+                yield from _open_csv(zf, name)
+
+
+def progress_key(path: str) -> str:
+    """
+    Chave do progresso em capture_cursors: nome do arquivo + nomes dos CSVs
+    internos, que trazem a data do dump (o nome do zip se repete todo mês).
+    """
+    with zipfile.ZipFile(path) as zf:
+        members = [n for n in zf.namelist() if not n.endswith("/")]
+    return f"rf:{os.path.basename(path)}:{','.join(members)}"
+
+
+def _yyyymmdd(iso: str) -> str:
+    return iso.replace("-", "") if iso else ""
+
+
+def build_row_filter(date_from: str = None, date_to: str = None, cnaes=(), ufs=(),
+                     only_active: bool = True):
+    """
+    Predicado sobre a linha crua (lista de strings): só comparações de texto,
+    nada é convertido antes de a linha passar.
+    """
+    lo = _yyyymmdd(date_from)
+    hi = _yyyymmdd(date_to) or "99999999"
+    cnaes = tuple(cnaes)
+    ufs = frozenset(ufs)
+
+    def match(row) -> bool:
+        if len(row) < N_COLS:
+            return False
+        if only_active and row[COL_SITUACAO] != SITUACAO_ATIVA:
+            return False
+        if not lo <= row[COL_DATA_INICIO] <= hi:
+            return False
+        if ufs and row[COL_UF] not in ufs:
+            return False
+        if cnaes and not row[COL_CNAE].startswith(cnaes):
+            return False
+        return True
+
+    return match
+
+
+def row_to_office(row, municipios: dict = None) -> dict:
+    """
+    Linha do Estabelecimentos -> item no formato do /office da CNPJA,
+    para passar pelo mesmo normalize_office da captura.
+    """
+    d = row[COL_DATA_INICIO]
+    municipio = row[COL_MUNICIPIO]
+    nome = row[COL_NOME_FANTASIA].strip() or None
+    return {
+        "taxId": row[COL_CNPJ_BASICO] + row[COL_CNPJ_ORDEM] + row[COL_CNPJ_DV],
+        "alias": nome,
+        "founded": f"{d[:4]}-{d[4:6]}-{d[6:8]}" if len(d) == 8 else None,
+        "company": {"name": nome},
+        "mainActivity": {"id": row[COL_CNAE]},
+        "phones": [{"area": row[COL_DDD1].strip(), "number": row[COL_TELEFONE1].strip()}],
+        "emails": [row[COL_EMAIL].strip().lower()] if row[COL_EMAIL].strip() else [],
+        "address": {
+            "street": f"{row[COL_TIPO_LOGRADOURO]} {row[COL_LOGRADOURO]}".strip(),
+            "number": row[COL_NUMERO].strip(),
+            "district": row[COL_BAIRRO].strip(),
+            "city": (municipios or {}).get(municipio, municipio),
+            "state": row[COL_UF],
+        },
+    }
+
+
+def import_file(path: str, match, municipios: dict = None, chunk_size: int = None) -> dict:
+    """
+    Importa um zip de Estabelecimentos. O offset (linhas já lidas) é salvo
+    na mesma transação de cada lote; ao retomar, as linhas anteriores são
+    lidas e descartadas sem montar leads.
+    """
+    chunk_size = chunk_size or RF_IMPORT_CHUNK
+    key = progress_key(path)
+    start = int(get_capture_cursor(key) or 0)
+    stats = {"file": os.path.basename(path), "resumed_at": start, "rows": 0, "matched": 0,
+             "inserted": 0, "skipped": 0}
+
+    batch = []
+    last_saved = start
+
+    def flush(offset: int):
+        nonlocal last_saved
+        with get_conn() as conn:
+            if batch:
+                result = ingest_leads(conn, batch)
+                stats["inserted"] += result["inserted"]
+                stats["skipped"] += result["skipped"]
+            save_capture_cursor(conn, key, str(offset))
+        batch.clear()
+        last_saved = offset
+
+    offset = 0
+    for offset, row in enumerate(iter_rows(path), start=1):
+        if offset <= start:
+            continue
+        stats["rows"] += 1
+        if not match(row):
+            if offset - last_saved >= RF_PROGRESS_ROWS:
+                flush(offset)
+            continue
+        stats["matched"] += 1
+        batch.append(normalize_office(row_to_office(row, municipios)))
+        if len(batch) >= chunk_size:
+            flush(offset)
+    if offset > last_saved:
+        flush(offset)
+
+    log_event("rf_import", " ".join(f"{k}={v}" for k, v in stats.items()))
+    return stats
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Importa Estabelecimentos*.zip da Receita Federal.")
+    p.add_argument("files", nargs="+")
+    p.add_argument("--desde", help="data de início de atividade mínima (AAAA-MM-DD)")
+    p.add_argument("--ate", help="data de início de atividade máxima (AAAA-MM-DD)")
+    p.add_argument("--municipios", help="zip da tabela de municípios (código -> nome)")
+    p.add_argument("--incluir-inativas", action="store_true")
+    p.add_argument("--reiniciar", action="store_true", help="ignora o progresso salvo")
+    args = p.parse_args(argv)
+
+    init_db()
+    filters = get_target_filters()
+    match = build_row_filter(
+        args.desde, args.ate, filters["cnaes"], filters["ufs"], only_active=not args.incluir_inativas
+    )
+    municipios = load_municipios(args.municipios) if args.municipios else None
+
+    for path in args.files:
+        if args.reiniciar:
+            with get_conn() as conn:
+                save_capture_cursor(conn, progress_key(path), None)
+        print(import_file(path, match, municipios))
+
+
+if __name__ == "__main__":
+    main()
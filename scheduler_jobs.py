@@ -1,98 +1,249 @@
-from datetime import datetime
+import os
+import threading
+from datetime import datetime, timedelta
 from database import get_conn, log_event
-from utils import today_str
-from segmentation import segmento_por_cnae
-from cnpj_scraper import fetch_offices_by_founded_range, extract_items, normalize_office
-from whatsapp_sender import notify_admin_new_lead
+from utils import today_str, to_e164_br_many
+from ingestion import ingest_leads, load_known_cnpjs
+from capture_engine import (
+    build_shards,
+    pending_shards,
+    run_capture,
+    UFS_BR,
+    CAPTURE_WINDOW_DAYS,
+    CAPTURE_RECHECK_DAYS,
+)
+from lead_filters import get_target_filters, upstream_params, compile_office_predicate
+from dispatcher import dispatch_queued
+from followups import schedule_followups
+from templating import render_batch
+from optout import get_optouts
+from webhooks import process_webhook_inbox
+from whatsapp_sender import notify_admin_new_lead, notify_admin_digest
+
+_drain_lock = threading.Lock()
+
+# Notificação 'sending' há mais que isso é de um drain que morreu: volta para a fila
+NOTIFY_CLAIM_TIMEOUT = float(os.getenv("NOTIFY_CLAIM_TIMEOUT", "600"))
 
 
 def capture_job():
-    """Captura leads da API CNPJA dos últimos 30 dias e insere no banco."""
+    """
+    Captura diária: busca na CNPJA só os dias da janela (CAPTURE_WINDOW_DAYS)
+    que o capture_ledger ainda não tem completos, mais os últimos
+    CAPTURE_RECHECK_DAYS dias, sempre rebuscados.
+    """
     from datetime import timedelta
 
-    hoje = today_str()
-    trinta_dias_atras = (
-        __import__("datetime").datetime.fromisoformat(hoje) - timedelta(days=30)
-    ).strftime("%Y-%m-%d")
+    hoje = datetime.fromisoformat(today_str())
+    inicio = (hoje - timedelta(days=CAPTURE_WINDOW_DAYS)).strftime("%Y-%m-%d")
+    recheck_from = (hoje - timedelta(days=CAPTURE_RECHECK_DAYS)).strftime("%Y-%m-%d")
+    return _capture_range(inicio, hoje.strftime("%Y-%m-%d"), recheck_from)
+
+
+def capture_backfill_job(date_start: str, date_end: str, force: bool = False):
+    """
+    Backfill manual de um intervalo de datas de abertura. Usa o mesmo ledger:
+    dias já completos são pulados, a não ser com force=True.
+    """
+    return _capture_range(date_start, date_end, date_start if force else None)
+
+
+def _capture_range(date_start: str, date_end: str, recheck_from: str = None) -> dict:
+    # CNAE_FILTRO/UF_FILTRO vão na consulta quando a CNPJA aceita; o resto
+    # é filtrado localmente antes de normalizar
+    filters = get_target_filters()
+    predicate = compile_office_predicate(filters)
+
+    # Uma fatia por dia (e por UF, se CAPTURE_SHARD_BY_UF=1); cada fatia
+    # retoma do próprio cursor salvo se a captura anterior foi interrompida
+    ufs = None
+    if os.getenv("CAPTURE_SHARD_BY_UF", "0") == "1":
+        ufs = list(filters["ufs"]) or UFS_BR
+    all_shards = build_shards(date_start, date_end, ufs, upstream_params(filters), filters)
+    shards = pending_shards(all_shards, recheck_from)
+
+    counts = {"inserted": 0, "skipped": 0}
+    known = set()
+    if shards:
+        days = [s["day"] for s in shards]
+        with get_conn() as conn:
+            known = load_known_cnpjs(conn, min(days), max(days))
+
+    def write_page(conn, shard, leads):
+        result = ingest_leads(conn, leads, known)
+        counts["inserted"] += result["inserted"]
+        counts["skipped"] += result["skipped"]
+        if result["inserted"]:
+            # Notificação ao admin vai para o outbox na mesma transação;
+            # o envio (HTTP) acontece depois do commit, fora do lock do banco
+            conn.execute(
+                """
+                INSERT INTO notification_outbox(lead_id, created_at)
+                SELECT id, ? FROM leads WHERE created_at=?
+                """,
+                (result["created_at"], result["created_at"]),
+            )
+
+    progress = run_capture(shards, write_page, predicate=predicate) if shards else []
+
+    pages = sum(p["pages"] for p in progress)
+    dropped = sum(p["dropped"] for p in progress)
+    failed = sum(1 for p in progress if p["status"] == "failed")
+    cached = len(all_shards) - len(shards)
+    slowest = max(progress, key=lambda p: p["seconds"], default=None)
+    log_event(
+        "capture",
+        f"range={date_start}..{date_end} total={counts['inserted'] + counts['skipped']}"
+        f" inserted={counts['inserted']} skipped={counts['skipped']} dropped={dropped} pages={pages}"
+        f" shards={len(shards)} ledger_skipped={cached} failed_shards={failed}"
+        + (f" slowest={slowest['shard']}:{slowest['seconds']}s" if slowest else ""),
+    )
+
+    if counts["inserted"]:
+        threading.Thread(target=drain_notifications_job, daemon=True).start()
+    return {
+        **counts, "dropped": dropped, "pages": pages, "shards": len(shards),
+        "ledger_skipped": cached, "failed_shards": failed,
+    }
+
+
+def drain_notifications_job():
+    """
+    Envia as notificações pendentes do outbox ao admin.
+    NOTIFY_DIGEST_SIZE=1 manda uma mensagem por lead; acima disso agrupa até N
+    leads por mensagem. Um grupo incompleto só sai quando o lead mais antigo
+    passa de NOTIFY_DIGEST_WINDOW segundos na fila.
+    """
+    if not _drain_lock.acquire(blocking=False):
+        return {"skipped": 1}  # outro drain já está rodando
+    try:
+        return _drain_outbox()
+    finally:
+        _drain_lock.release()
 
-    inserted = 0
-    total = 0
-    page_num = 0
 
+def _claim_outbox(now: datetime, limit: int = 1000) -> list:
+    """
+    Reserva as notificações pendentes num único UPDATE: drains em processos
+    diferentes (job do líder e o disparado após uma captura manual) nunca
+    pegam a mesma linha. Antes, devolve à fila reservas vencidas.
+    """
+    stale = (now - timedelta(seconds=NOTIFY_CLAIM_TIMEOUT)).isoformat()
     with get_conn() as conn:
-        payload = fetch_offices_by_founded_range(trinta_dias_atras, hoje)
-        items = extract_items(payload)
+        conn.execute(
+            """
+            UPDATE notification_outbox SET status='pending', claimed_at=NULL
+            WHERE status='sending' AND claimed_at < ?
+            """,
+            (stale,),
+        )
+        ids = [r["id"] for r in conn.execute(
+            """
+            UPDATE notification_outbox SET status='sending', claimed_at=?
+            WHERE id IN (SELECT id FROM notification_outbox WHERE status='pending' ORDER BY id LIMIT ?)
+            RETURNING id
+            """,
+            (now.isoformat(), limit),
+        ).fetchall()]
+        if not ids:
+            return []
+        return conn.execute(f"""
+            SELECT o.id, o.created_at, o.attempts, l.cnpj, l.razao_social,
+                   l.cidade, l.uf, l.segmento
+            FROM notification_outbox o JOIN leads l ON l.id = o.lead_id
+            WHERE o.id IN ({",".join("?" * len(ids))})
+            ORDER BY o.id
+        """, ids).fetchall()
 
-        if items:
-            for it in items:
-                lead = normalize_office(it)
-                if not lead.get("cnpj"):
-                    continue
 
-                seg = segmento_por_cnae(lead.get("cnae_principal"))
-                try:
-                    conn.execute(
-                        """
-                        INSERT INTO leads(
-                            cnpj, razao_social, cidade, uf, cnae_principal,
-                            telefone, email, endereco, data_abertura, segmento,
-                            created_at, status
-                        )
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'novo')
-                    """,
-                        (
-                            lead["cnpj"],
-                            lead["razao_social"],
-                            lead["cidade"],
-                            lead["uf"],
-                            lead["cnae_principal"],
-                            lead["telefone"],
-                            lead["email"],
-                            lead["endereco"],
-                            lead["data_abertura"],
-                            seg,
-                            datetime.utcnow().isoformat(),
-                        ),
-                    )
-                    inserted += 1
-                    # Envia notificação para o admin
-                    notify_admin_new_lead(
+def _drain_outbox():
+    digest_size = max(1, int(os.getenv("NOTIFY_DIGEST_SIZE", "1")))
+    window = int(os.getenv("NOTIFY_DIGEST_WINDOW", "0"))
+    max_attempts = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "3"))
+
+    pending = _claim_outbox(datetime.utcnow())
+    sent = 0
+    failed = 0
+    i = 0
+    try:
+        while i < len(pending):
+            group = pending[i:i + digest_size]
+            if len(group) < digest_size and window:
+                oldest = datetime.fromisoformat(group[0]["created_at"])
+                if (datetime.utcnow() - oldest).total_seconds() < window:
+                    break  # espera completar o resumo ou vencer a janela
+
+            try:
+                if digest_size == 1:
+                    lead = group[0]
+                    result = notify_admin_new_lead(
                         lead["cnpj"],
                         lead["razao_social"],
                         lead["cidade"],
                         lead["uf"],
-                        seg
+                        lead["segmento"]
                     )
-                except Exception as e:
-                    log_event("error", f"Failed to insert lead: {str(e)}")
+                else:
+                    result = notify_admin_digest(group)
+            except Exception as e:
+                result = {"ok": False, "error": str(e)}
 
-                total += 1
-            page_num = 1
-        
-        conn.commit()
+            ids = [row["id"] for row in group]
+            marks = ",".join("?" for _ in ids)
+            with get_conn() as conn:
+                if result.get("ok"):
+                    sent += len(ids)
+                    conn.execute(
+                        f"UPDATE notification_outbox SET status='sent', sent_at=? WHERE id IN ({marks})",
+                        [datetime.utcnow().isoformat(), *ids],
+                    )
+                else:
+                    failed += len(ids)
+                    conn.execute(
+                        f"""
+                        UPDATE notification_outbox
+                        SET attempts = attempts + 1, error = ?, claimed_at = NULL,
+                            status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END
+                        WHERE id IN ({marks})
+                        """,
+                        [str(result.get("error"))[:500], max_attempts, *ids],
+                    )
+            i += len(group)
+    finally:
+        # O que foi reservado e não saiu (janela do resumo, erro) volta para a fila
+        if i < len(pending):
+            with get_conn() as conn:
+                conn.executemany(
+                    "UPDATE notification_outbox SET status='pending', claimed_at=NULL "
+                    "WHERE id=? AND status='sending'",
+                    [(row["id"],) for row in pending[i:]],
+                )
 
-    log_event(
-        "capture",
-        f"date={hoje} total={total} inserted={inserted} pages={page_num}",
-    )
+    if sent or failed:
+        log_event("notify", f"sent={sent} failed={failed}")
+    return {"sent": sent, "failed": failed}
 
 
 def queue_initial_messages_job():
     """Enfileira mensagens iniciais para leads do dia."""
     with get_conn() as conn:
         leads = conn.execute("""
-            SELECT id, telefone FROM leads
+            SELECT id, cnpj, razao_social, cidade, uf, segmento, telefone_e164 FROM leads
             WHERE created_at >= datetime('now', '-1 day')
-            AND id NOT IN (SELECT lead_id FROM messages)
+            AND NOT EXISTS (SELECT 1 FROM messages m WHERE m.lead_id = leads.id)
         """).fetchall()
+        optouts = get_optouts()
+        leads = [lead for lead in leads if lead["telefone_e164"] not in optouts]
 
-        for lead in leads:
-            conn.execute("""
-                INSERT INTO messages(lead_id, kind, template_key, message_text, status)
-                VALUES (?, ?, ?, ?, 'queued')
-            """, (lead["id"], "first", "default", "Olá!"))
+        # Templates compilados em cache; um render por lead, agrupado por segmento
+        rendered = render_batch(leads)
+        conn.executemany("""
+            INSERT INTO messages(lead_id, kind, template_key, message_text, status)
+            VALUES (?, 'first', ?, ?, 'queued')
+        """, rendered)
 
-        log_event("queue", f"queued={len(leads)} messages")
+        log_event("queue", f"queued={len(rendered)} messages")
+    return {"queued": len(rendered)}
 
 
 def dispatch_messages_job():
@@ -100,24 +251,54 @@ def dispatch_messages_job():
     from utils import is_business_hours
 
     if not is_business_hours():
-        return
+        return {"sent": 0, "failed": 0, "reason": "fora_do_horario"}
 
-    with get_conn() as conn:
-        messages = conn.execute("""
-            SELECT id, lead_id FROM messages
-            WHERE status='queued'
-            LIMIT 10
-        """).fetchall()
+    result = dispatch_queued()
+    log_event(
+        "dispatch",
+        f"sent={result['sent']} failed={result['failed']} optout={result.get('optout', 0)}"
+        + (f" reason={result['reason']}" if result.get("reason") else ""),
+    )
+    return result
 
-        for msg in messages:
-            conn.execute(
-                "UPDATE messages SET status='sent', sent_at=? WHERE id=?",
-                (datetime.utcnow().isoformat(), msg["id"]),
+
+def backfill_phones_job(batch_size: int = 1000):
+    """Preenche telefone_e164 dos leads gravados antes da coluna existir."""
+    total = 0
+    last_id = 0
+    while True:
+        with get_conn() as conn:
+            rows = conn.execute("""
+                SELECT id, telefone FROM leads
+                WHERE telefone_e164 IS NULL AND id > ?
+                ORDER BY id
+                LIMIT ?
+            """, (last_id, batch_size)).fetchall()
+            if not rows:
+                break
+            phones = to_e164_br_many([r["telefone"] for r in rows])
+            conn.executemany(
+                "UPDATE leads SET telefone_e164=? WHERE id=?",
+                [(phone or "", r["id"]) for r, phone in zip(rows, phones)],
             )
+        last_id = rows[-1]["id"]
+        total += len(rows)
 
-        log_event("dispatch", f"sent={len(messages)}")
+    if total:
+        log_event("backfill", f"telefone_e164={total}")
+    return {"telefone_e164": total}
 
 
 def schedule_followups_job():
-    """Agenda mensagens de follow-up."""
-    log_event("followup", "scheduled")
+    """Agenda mensagens de follow-up (24h, 72h, 7d) vencidas desde a última execução."""
+    counts = schedule_followups()
+    log_event("followup", " ".join(f"{kind}={n}" for kind, n in counts.items()))
+    return counts
+
+
+def process_webhooks_job():
+    """Processa os callbacks da Z-API acumulados no webhook_inbox."""
+    counts = process_webhook_inbox()
+    if counts["callbacks"]:
+        log_event("webhook", " ".join(f"{k}={v}" for k, v in counts.items()))
+    return counts
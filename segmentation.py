@@ -1,54 +1,90 @@
-# Mapeie prefixos de CNAE -> segmento
-# Ex.: "5611" cobre restaurantes, "47" cobre varejo etc.
-CNAE_SEGMENTOS = {
-    "5611": "restaurante",
-    "47": "varejo",
-    "10": "industria",
-    "11": "industria",
-    "12": "industria",
-    "13": "industria",
-    "14": "industria",
-    "15": "industria",
-    "16": "industria",
-    "17": "industria",
-    "18": "industria",
-    "19": "industria",
-    "20": "industria",
-    "21": "industria",
-    "22": "industria",
-    "23": "industria",
-    "24": "industria",
-    "25": "industria",
-    "26": "industria",
-    "27": "industria",
-    "28": "industria",
-    "29": "industria",
-    "30": "industria",
-    "31": "industria",
-    "32": "industria",
-    "33": "industria",
-    "62": "tecnologia",
-    "69": "servicos",
-    "70": "servicos",
-}
+import csv
+import os
+import re
+from functools import lru_cache
+
+# Tabela CNAE -> segmento (prefixo de divisão, grupo, classe ou subclasse).
+# Todas as divisões CNAE 2.x estão mapeadas; prefixos mais longos refinam as
+# divisões (ex.: 5611 dentro de 56, 1091102 dentro de 10).
+CNAE_TABLE_PATH = os.getenv(
+    "CNAE_TABLE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "cnae_segmentos.csv"),
+)
+
+# Segmento usado só para CNAE vazio ou fora da tabela
+SEGMENTO_PADRAO = "servicos"
 
 SEGMENTO_TEMPLATE = {
     "restaurante": "template_restaurante",
     "industria": "template_industria",
     "varejo": "template_varejo",
+    "comercio": "template_varejo",
     "servicos": "template_servicos",
     "tecnologia": "template_servicos",
 }
 
+CNAE_LEN = 7  # subclasse: 7 dígitos
+
+
+def load_cnae_table(path: str = CNAE_TABLE_PATH) -> dict:
+    """
+    Lê o CSV (prefixo;segmento;descricao) num dict prefixo -> segmento.
+    """
+    table = {}
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f, delimiter=";"):
+            prefixo = re.sub(r"\D", "", row["prefixo"])
+            if prefixo:
+                table[prefixo] = row["segmento"].strip()
+    return table
+
+
+# Índice de prefixos: a busca testa code[:7], code[:6], ... code[:2] e o
+# primeiro acerto é o prefixo mais longo, independente da ordem do arquivo
+CNAE_SEGMENTOS = load_cnae_table()
+
+
+def normalize_cnae(cnae) -> str:
+    """
+    "56.11-2-01", 5611201 ou "5611201" -> "5611201".
+    Inteiros de 6 dígitos perderam o zero à esquerda (divisões 01-09).
+    """
+    if cnae is None:
+        return ""
+    digits = re.sub(r"\D", "", str(cnae))
+    if len(digits) == CNAE_LEN - 1:
+        digits = digits.zfill(CNAE_LEN)
+    return digits[:CNAE_LEN]
+
+
+@lru_cache(maxsize=4096)
+def _segmento(code: str) -> str:
+    for size in range(len(code), 1, -1):
+        seg = CNAE_SEGMENTOS.get(code[:size])
+        if seg:
+            return seg
+    return SEGMENTO_PADRAO
+
 
 def segmento_por_cnae(cnae: str) -> str:
     if not cnae:
-        return "servicos"
-    c = str(cnae)
-    for prefixo, seg in CNAE_SEGMENTOS.items():
-        if c.startswith(prefixo):
-            return seg
-    return "servicos"
+        return SEGMENTO_PADRAO
+    return _segmento(normalize_cnae(cnae))
+
+
+def segmentos_por_cnae(cnaes) -> list:
+    """
+    Classifica um lote inteiro (ex.: uma página da ingestão) numa passada.
+    Códigos repetidos no lote são resolvidos uma vez só.
+    """
+    resolved = {}
+    out = []
+    for cnae in cnaes:
+        seg = resolved.get(cnae)
+        if seg is None:
+            seg = resolved[cnae] = segmento_por_cnae(cnae)
+        out.append(seg)
+    return out
 
 
 def template_por_segmento(segmento: str) -> str:
@@ -0,0 +1,147 @@
+import json
+import os
+import string
+import threading
+
+from segmentation import template_por_segmento
+
+TEMPLATES_PATH = os.getenv("TEMPLATES_PATH", "message_templates/templates.json")
+
+# Campos disponíveis nos templates -> coluna de leads
+PLACEHOLDERS = {
+    "empresa": "razao_social",
+    "cidade": "cidade",
+    "uf": "uf",
+    "segmento": "segmento",
+    "cnpj": "cnpj",
+}
+
+FALLBACK_TEMPLATE = "template_servicos"
+
+
+class TemplateError(ValueError):
+    pass
+
+
+class CompiledTemplate:
+    """
+    Template já analisado: lista de (texto literal, coluna do lead ou None).
+    """
+
+    def __init__(self, key: str, text: str):
+        if not isinstance(text, str):
+            raise TemplateError(f"{key}: o template deve ser um texto")
+        self.key = key
+        self.text = text
+        self.parts = []
+        try:
+            parsed = list(string.Formatter().parse(text))
+        except ValueError as e:
+            raise TemplateError(f"{key}: {e}") from None
+        for literal, field, spec, conversion in parsed:
+            column = None
+            if field is not None:
+                if field not in PLACEHOLDERS:
+                    validos = ", ".join("{" + p + "}" for p in sorted(PLACEHOLDERS))
+                    raise TemplateError(f"{key}: campo {{{field}}} desconhecido (use {validos})")
+                if spec or conversion:
+                    raise TemplateError(f"{key}: formatação não suportada em {{{field}}}")
+                column = PLACEHOLDERS[field]
+            self.parts.append((literal, column))
+
+    def sql_expression(self, alias: str, prefix: str = "t") -> tuple:
+        """
+        Expressão SQL que monta o texto a partir das colunas de `alias`
+        (para INSERT ... SELECT). Retorna (expr, parâmetros nomeados).
+        """
+        pieces = []
+        params = {}
+        for i, (literal, column) in enumerate(self.parts):
+            if literal:
+                name = f"{prefix}{i}"
+                params[name] = literal
+                pieces.append(f":{name}")
+            if column:
+                pieces.append(f"COALESCE({alias}.{column}, '')")
+        return " || ".join(pieces) or "''", params
+
+    def render(self, lead) -> str:
+        out = []
+        for literal, column in self.parts:
+            out.append(literal)
+            if column:
+                out.append(str(lead[column] or ""))
+        return "".join(out)
+
+
+def compile_templates(data) -> dict:
+    """
+    Valida e compila o conteúdo do templates.json. Levanta TemplateError.
+    """
+    if not isinstance(data, dict):
+        raise TemplateError("templates.json deve ser um objeto {chave: texto}")
+    return {key: CompiledTemplate(key, text) for key, text in data.items()}
+
+
+_cache = {"stamp": None, "templates": {}}
+_lock = threading.Lock()
+
+
+def get_templates(path: str = None) -> dict:
+    """
+    Templates compilados; só relê o arquivo quando mtime/tamanho mudam.
+    """
+    path = path or TEMPLATES_PATH
+    try:
+        st = os.stat(path)
+        stamp = (path, st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        stamp = (path, None, None)
+    with _lock:
+        if _cache["stamp"] != stamp:
+            data = {}
+            if stamp[1] is not None:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            _cache["templates"] = compile_templates(data)
+            _cache["stamp"] = stamp
+        return _cache["templates"]
+
+
+def save_templates(data, path: str = None):
+    """
+    Valida e grava o templates.json (escrita atômica). Levanta TemplateError.
+    """
+    path = path or TEMPLATES_PATH
+    compile_templates(data)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def template_for(key: str, templates: dict = None) -> CompiledTemplate:
+    templates = templates if templates is not None else get_templates()
+    tpl = templates.get(key) or templates.get(FALLBACK_TEMPLATE)
+    if tpl is None:
+        raise TemplateError(f"template {key} (nem {FALLBACK_TEMPLATE}) não encontrado")
+    return tpl
+
+
+def render_batch(leads) -> list:
+    """
+    Renderiza a mensagem inicial de um lote de leads, agrupando por segmento.
+    Cada lead precisa de id, segmento e as colunas de PLACEHOLDERS.
+    Retorna [(lead_id, template_key, texto)].
+    """
+    templates = get_templates()
+    by_segment = {}
+    for lead in leads:
+        by_segment.setdefault(lead["segmento"], []).append(lead)
+
+    out = []
+    for segmento, group in by_segment.items():
+        tpl = template_for(template_por_segmento(segmento), templates)
+        out.extend((lead["id"], tpl.key, tpl.render(lead)) for lead in group)
+    return out
@@ -0,0 +1,16 @@
+import pytest
+
+
+@pytest.fixture
+def db(monkeypatch, tmp_path):
+    """
+    Banco SQLite vazio (schema + migrações) num arquivo temporário.
+    Retorna o módulo database; fecha as conexões da thread no fim.
+    """
+    monkeypatch.setattr("database.DB_PATH", str(tmp_path / "t.db"))
+
+    import database
+
+    database.init_db()
+    yield database
+    database.close_thread_conns()
@@ -0,0 +1,31 @@
+import pytest
+import requests
+
+
+def test_office_stub_paginates_by_cursor_and_throttles(monkeypatch):
+    from benchmarks.stubs import StubConfig, start_stubs
+    from cnpj_scraper import iter_office_pages
+
+    config = StubConfig(offices_per_day=24, error_rate=0.0)
+    server, base_url = start_stubs(config)
+    try:
+        monkeypatch.setattr("cnpj_scraper.CNPJA_BASE_URL", base_url)
+        monkeypatch.setattr("cnpj_scraper.CNPJA_API_KEY", "bench")
+        monkeypatch.setattr("cnpj_scraper.PAGE_LIMIT", 10)
+
+        pages = list(iter_office_pages("2024-01-01", "2024-01-02", **{"address.state.in": "SP,RJ"}))
+        leads = [lead for items, _ in pages for lead in items]
+        assert len(pages) == 1 and len(leads) == 8  # 2 dias x 2 UFs x 2 por UF
+        assert {lead["uf"] for lead in leads} == {"SP", "RJ"}
+        assert len({lead["cnpj"] for lead in leads}) == 8
+
+        monkeypatch.setattr("cnpj_scraper.PAGE_LIMIT", 3)
+        assert [len(items) for items, _ in iter_office_pages("2024-01-01", "2024-01-02")] == [3] * 16
+
+        config.error_rate = 1.0
+        monkeypatch.setattr("http_client.HTTP_MAX_RETRIES", 0)
+        with pytest.raises(requests.exceptions.HTTPError):
+            next(iter_office_pages("2024-01-01", "2024-01-01"))
+        assert config.stats["throttled"] == 1
+    finally:
+        server.shutdown()
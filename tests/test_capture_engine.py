@@ -0,0 +1,181 @@
+import requests
+
+from tests.test_cnpj_scraper import make_response
+
+
+def test_build_shards_per_day_and_uf():
+    from capture_engine import build_shards
+
+    shards = build_shards("2020-01-30", "2020-02-01")
+    assert [s["key"] for s in shards] == [
+        "office:2020-01-30",
+        "office:2020-01-31",
+        "office:2020-02-01",
+    ]
+
+    shards = build_shards("2020-01-01", "2020-01-02", ["SP", "RJ"])
+    assert len(shards) == 4
+    assert shards[1]["key"] == "office:2020-01-01:RJ"
+    assert shards[1]["params"] == {"address.state.in": "RJ"}
+
+
+def test_retry_after_seconds():
+    from capture_engine import retry_after_seconds
+
+    def http_error(status, headers=None):
+        resp = make_response(status, None, "")
+        resp.headers = headers or {}
+        return requests.exceptions.HTTPError(response=resp)
+
+    assert retry_after_seconds(http_error(429, {"Retry-After": "7"}), 0) == 7.0
+    assert retry_after_seconds(http_error(429), 3) == 8.0
+    assert retry_after_seconds(http_error(401), 0) is None
+
+
+def test_run_capture_retries_429_and_saves_cursor(monkeypatch, tmp_path):
+    monkeypatch.setattr("database.DB_PATH", str(tmp_path / "t.db"))
+    monkeypatch.setattr("capture_engine.log_event", lambda t, p: None)
+    monkeypatch.setattr("capture_engine.CNPJA_RATE_PER_MIN", 6000)
+
+    import database
+    from capture_engine import build_shards, run_capture
+
+    database.init_db()
+    calls = {}
+
+    def fake_fetch(date_start, date_end, cursor=None, **params):
+        n = calls[date_start] = calls.get(date_start, 0) + 1
+        if date_start == "2020-01-01" and n == 1:
+            resp = make_response(429, None, "slow down")
+            resp.headers = {"Retry-After": "0"}
+            raise requests.exceptions.HTTPError(response=resp)
+        if date_start == "2020-01-02" and cursor is None:
+            return {"records": [{"taxId": "2a"}], "next": "p2"}
+        if date_start == "2020-01-02" and cursor == "p2":
+            raise requests.exceptions.HTTPError(response=make_response(401, None, ""))
+        return {"records": [{"taxId": date_start}], "next": None}
+
+    monkeypatch.setattr("cnpj_scraper.fetch_offices_by_founded_range", fake_fetch)
+
+    written = []
+    progress = run_capture(
+        build_shards("2020-01-01", "2020-01-02"),
+        lambda conn, shard, leads: written.extend(l["cnpj"] for l in leads),
+        workers=2,
+    )
+
+    by_shard = {p["shard"]: p for p in progress}
+    assert sorted(written) == ["2020-01-01", "2a"]
+    assert by_shard["office:2020-01-01"]["status"] == "done"
+    assert by_shard["office:2020-01-01"]["retries"] == 1
+    assert by_shard["office:2020-01-02"]["status"] == "failed"
+
+    # A fatia que falhou fica com o cursor salvo para retomada
+    assert database.get_capture_cursor("office:2020-01-02") == "p2"
+    assert database.get_capture_cursor("office:2020-01-01") is None
+
+
+def test_capture_retries_go_through_the_token_bucket(monkeypatch, tmp_path):
+    monkeypatch.setattr("database.DB_PATH", str(tmp_path / "t.db"))
+    monkeypatch.setattr("capture_engine.log_event", lambda t, p: None)
+    monkeypatch.setattr("capture_engine.retry_after_seconds", lambda e, attempt: 0.0)
+    from tests.test_cnpj_scraper import patch_get
+
+    import capture_engine
+    import database
+
+    database.init_db()
+    responses = [make_response(429), make_response(503), make_response(200, {"records": []})]
+    patch_get(monkeypatch, lambda url, headers, params, timeout: responses.pop(0))
+
+    acquired = []
+    original = capture_engine.TokenBucket.acquire
+    monkeypatch.setattr(
+        capture_engine.TokenBucket, "acquire", lambda self: acquired.append(1) or original(self)
+    )
+
+    progress = capture_engine.run_capture(
+        capture_engine.build_shards("2020-01-01", "2020-01-01"), lambda conn, shard, leads: None
+    )
+
+    # Uma requisição por token: o http_client não repete por conta própria
+    assert progress[0]["status"] == "done" and progress[0]["retries"] == 2
+    assert responses == [] and len(acquired) == 3
+
+
+def test_last_page_and_ledger_commit_together(monkeypatch, tmp_path):
+    import pytest
+
+    monkeypatch.setattr("database.DB_PATH", str(tmp_path / "t.db"))
+    monkeypatch.setattr("capture_engine.log_event", lambda t, p: None)
+    monkeypatch.setattr("capture_engine.CNPJA_RATE_PER_MIN", 6000)
+
+    import capture_engine
+    import database
+
+    database.init_db()
+
+    def fake_fetch(date_start, date_end, cursor=None, **params):
+        if cursor is None:
+            return {"records": [{"taxId": "1"}], "next": "p2"}
+        return {"records": [{"taxId": "2"}], "next": None}
+
+    def write_page(conn, shard, leads):
+        for lead in leads:
+            conn.execute("INSERT INTO leads(cnpj, created_at) VALUES (?, 'x')", (lead["cnpj"],))
+
+    def broken_ledger(*args):
+        raise RuntimeError("queda")
+
+    monkeypatch.setattr("cnpj_scraper.fetch_offices_by_founded_range", fake_fetch)
+    monkeypatch.setattr("capture_engine.mark_shard_complete", broken_ledger)
+    shards = capture_engine.build_shards("2020-01-01", "2020-01-01")
+    with pytest.raises(RuntimeError):
+        capture_engine.run_capture(shards, write_page, workers=1)
+
+    # A última página não foi gravada sem o ledger: retoma do cursor p2
+    with database.get_conn() as conn:
+        cnpjs = [r[0] for r in conn.execute("SELECT cnpj FROM leads")]
+    assert cnpjs == ["1"] and database.get_capture_cursor("office:2020-01-01") == "p2"
+
+    monkeypatch.setattr("capture_engine.mark_shard_complete", database.mark_shard_complete)
+    shards = capture_engine.build_shards("2020-01-01", "2020-01-01")
+    capture_engine.run_capture(shards, write_page, workers=1)
+    assert database.get_capture_cursor("office:2020-01-01") is None
+    assert database.get_completed_shards("2020-01-01", "2020-01-01") == {
+        "office:2020-01-01": capture_engine.shard_signature(shards[0])
+    }
+
+
+def test_queued_shards_never_fetch_after_writer_error(monkeypatch, tmp_path):
+    import threading
+
+    import pytest
+
+    monkeypatch.setattr("database.DB_PATH", str(tmp_path / "t.db"))
+    monkeypatch.setattr("capture_engine.log_event", lambda t, p: None)
+    monkeypatch.setattr("capture_engine.CNPJA_RATE_PER_MIN", 60000)
+
+    import capture_engine
+    import database
+
+    database.init_db()
+    calls = []
+    lock = threading.Lock()
+
+    def fake_fetch(date_start, date_end, cursor=None, **params):
+        with lock:
+            calls.append(date_start)
+        return {"records": [{"taxId": date_start}], "next": None}
+
+    def write_page(conn, shard, leads):
+        raise RuntimeError("disco cheio")
+
+    monkeypatch.setattr("cnpj_scraper.fetch_offices_by_founded_range", fake_fetch)
+    shards = capture_engine.build_shards("2020-01-01", "2020-01-30")
+    with pytest.raises(RuntimeError):
+        capture_engine.run_capture(shards, write_page, workers=2)
+
+    # Só as fatias já em andamento chegaram a buscar
+    assert len(calls) <= 4
+    assert all(s["progress"]["status"] in ("pending", "cancelled") for s in shards[4:])
@@ -2,13 +2,41 @@ import requests
 
 import pytest
 
-from tests.test_cnpj_scraper import make_response
+from tests.test_cnpj_scraper import make_response, patch_get
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr("http_client.HTTP_MAX_RETRIES", 2)
+    monkeypatch.setattr("http_client.time.sleep", lambda s: None)
+
+
+def test_fetch_offices_rate_limit_is_retried(monkeypatch):
+    responses = [
+        make_response(429, {"error": "slow down"}, "slow down", {"Retry-After": "1"}),
+        make_response(200, {"records": [{"taxId": "1"}]}, "ok"),
+    ]
+
+    def fake_get(url, headers, params, timeout):
+        return responses.pop(0)
+
+    patch_get(monkeypatch, fake_get)
+    monkeypatch.setattr("cnpj_scraper.log_event", lambda t, p: None)
+
+    from cnpj_scraper import fetch_offices_by_founded_range
+    import http_client
+
+    before = http_client.get_stats().get("cnpja GET /office", {}).get("retries", 0)
+    assert fetch_offices_by_founded_range("2020-01-01", "2020-01-01") == {"records": [{"taxId": "1"}]}
+    assert http_client.get_stats()["cnpja GET /office"]["retries"] == before + 1
 
 
 def test_fetch_offices_rate_limit(monkeypatch):
     fake_resp = make_response(429, {"error": "no credits"}, "no credits")
+    calls = []
 
     def fake_get(url, headers, params, timeout):
+        calls.append(timeout)
         return fake_resp
 
     captured = {}
@@ -17,13 +45,33 @@ def test_fetch_offices_rate_limit(monkeypatch):
         captured["type"] = t
         captured["payload"] = p
 
-    monkeypatch.setattr("cnpj_scraper.requests.get", fake_get)
+    patch_get(monkeypatch, fake_get)
     monkeypatch.setattr("cnpj_scraper.log_event", fake_log_event)
 
     from cnpj_scraper import fetch_offices_by_founded_range
 
+    # Esgotadas as tentativas, o 429 sobe como antes
     with pytest.raises(requests.exceptions.HTTPError):
         fetch_offices_by_founded_range("2020-01-01", "2020-01-01")
 
+    assert len(calls) == 3
+    assert isinstance(calls[0], tuple)  # timeouts de conexão e leitura separados
     assert captured.get("type") == "error"
     assert "429" in captured.get("payload", "")
+
+
+def test_send_text_does_not_retry_server_errors(monkeypatch):
+    calls = []
+
+    class FakeSession:
+        def request(self, method, url, **kwargs):
+            calls.append(method)
+            return make_response(500, None, "oops")
+
+    monkeypatch.setattr("http_client.get_session", lambda upstream: FakeSession())
+    monkeypatch.setattr("whatsapp_sender.log_event", lambda t, p: None)
+
+    from whatsapp_sender import send_text
+
+    assert send_text("+5511912345678", "oi")["ok"] is False
+    assert calls == ["POST"]
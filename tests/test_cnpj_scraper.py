@@ -4,12 +4,13 @@ import requests
 import pytest
 
 
-def make_response(status_code=200, json_data=None, text=""):
+def make_response(status_code=200, json_data=None, text="", headers=None):
     class FakeResponse:
         def __init__(self, status_code, json_data, text):
             self.status_code = status_code
             self._json = json_data
             self.text = text
+            self.headers = headers or {}
 
         def json(self):
             return self._json
@@ -21,6 +22,17 @@ def make_response(status_code=200, json_data=None, text=""):
     return FakeResponse(status_code, json_data, text)
 
 
+def patch_get(monkeypatch, fake_get):
+    """
+    Faz a Session do http_client responder via fake_get(url, headers, params, timeout).
+    """
+    class FakeSession:
+        def request(self, method, url, **kwargs):
+            return fake_get(url, kwargs.get("headers"), kwargs.get("params"), kwargs.get("timeout"))
+
+    monkeypatch.setattr("http_client.get_session", lambda upstream: FakeSession())
+
+
 def test_extract_items_variants():
     from cnpj_scraper import extract_items
 
@@ -68,7 +80,7 @@ def test_fetch_offices_success(monkeypatch):
         assert "Authorization" in headers
         return fake_resp
 
-    monkeypatch.setattr("cnpj_scraper.requests.get", fake_get)
+    patch_get(monkeypatch, fake_get)
 
     # Act
     from cnpj_scraper import fetch_offices_by_founded_range
@@ -85,7 +97,7 @@ def test_fetch_offices_raises_on_unauthorized(monkeypatch):
     def fake_get(url, headers, params, timeout):
         return fake_resp
 
-    monkeypatch.setattr("cnpj_scraper.requests.get", fake_get)
+    patch_get(monkeypatch, fake_get)
 
     # Patch log_event to avoid DB side effect
     monkeypatch.setattr("cnpj_scraper.log_event", lambda t, p: None)
@@ -110,3 +122,32 @@ def test_fetch_offices_no_api_key(monkeypatch, tmp_path):
     # Restore module state for other tests
     monkeypatch.setenv("CNPJA_API_KEY", os.getenv("CNPJA_API_KEY", "dummy-key"))
     importlib.reload(cs)
+
+
+def test_iter_office_pages_follows_next_cursor(monkeypatch):
+    pages = {
+        None: {"records": [{"taxId": "1"}, {"taxId": "2"}], "next": "c2"},
+        "c2": {"records": [{"taxId": "3"}], "next": "c3"},
+        "c3": {"records": [], "next": None},
+    }
+    seen = []
+
+    def fake_get(url, headers, params, timeout):
+        token = params.get("token")
+        seen.append(token)
+        return make_response(200, pages[token], "ok")
+
+    patch_get(monkeypatch, fake_get)
+
+    from cnpj_scraper import iter_office_pages
+
+    result = list(iter_office_pages("2020-01-01", "2020-01-31"))
+
+    assert seen == [None, "c2", "c3"]
+    assert [[l["cnpj"] for l in leads] for leads, _ in result] == [["1", "2"], ["3"], []]
+    assert [nxt for _, nxt in result] == ["c2", "c3", None]
+
+    # Retomada: começa direto do cursor salvo
+    seen.clear()
+    list(iter_office_pages("2020-01-01", "2020-01-31", cursor="c2"))
+    assert seen == ["c2", "c3"]
@@ -0,0 +1,156 @@
+import sqlite3
+
+import pytest
+
+
+def test_get_conn_reuses_tuned_thread_connection(db):
+    with db.get_conn() as conn:
+        first = conn
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+        assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == db.SQLITE_BUSY_TIMEOUT_MS
+
+    with db.get_conn() as conn:
+        assert conn is first
+
+
+def test_nested_get_conn_shares_outer_transaction(db):
+    with pytest.raises(RuntimeError):
+        with db.get_conn() as outer:
+            outer.execute("INSERT INTO opt_out(phone, created_at) VALUES('+551100000000', 'x')")
+            with db.get_conn() as inner:
+                inner.execute("INSERT INTO opt_out(phone, created_at) VALUES('+551100000001', 'x')")
+            raise RuntimeError("boom")
+
+    with db.get_conn(readonly=True) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM opt_out").fetchone()[0] == 0
+
+
+def test_readonly_conn_sees_commits_and_rejects_writes(db):
+    with db.get_conn() as conn:
+        conn.execute("INSERT INTO opt_out(phone, created_at) VALUES('+551100000000', 'x')")
+
+    with db.get_conn(readonly=True) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM opt_out").fetchone()[0] == 1
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("DELETE FROM opt_out")
+
+
+def test_log_event_is_buffered_and_flushed_in_batch(db):
+    for i in range(5):
+        db.log_event("test", f"n={i}")
+
+    db.flush_events()
+
+    with db.get_conn(readonly=True) as conn:
+        rows = conn.execute("SELECT payload FROM events WHERE type='test' ORDER BY id").fetchall()
+    assert [r["payload"] for r in rows] == [f"n={i}" for i in range(5)]
+    assert db.flush_events() == 0
+
+
+def _plan(conn, sql, params=()):
+    return " | ".join(row["detail"] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params))
+
+
+def test_migrations_are_recorded_and_idempotent(db):
+    with db.get_conn() as conn:
+        assert db.schema_version(conn) == db.MIGRATIONS[-1][0]
+        db.migrate(conn)
+        db.add_column(conn, "leads", "cidade", "TEXT")
+        count = conn.execute("SELECT COUNT(*) FROM schema_migrations").fetchone()[0]
+    assert count == len(db.MIGRATIONS)
+
+
+def test_job_queries_use_indexes(db):
+    with db.get_conn(readonly=True) as conn:
+        plan = _plan(conn, "SELECT id, lead_id FROM messages WHERE status='queued' ORDER BY id LIMIT 10")
+        assert "USING INDEX idx_messages_status" in plan
+        assert "TEMP B-TREE" not in plan
+
+        plan = _plan(conn, """
+            SELECT id, telefone FROM leads
+            WHERE created_at >= datetime('now', '-1 day')
+            AND NOT EXISTS (SELECT 1 FROM messages m WHERE m.lead_id = leads.id)
+        """)
+        assert "idx_leads_created_at" in plan
+        assert "idx_messages_lead_id" in plan
+
+        plan = _plan(conn, "SELECT COUNT(*) FROM messages WHERE sent_at >= ?", ("2020-01-01",))
+        assert "idx_messages_sent_at" in plan
+
+        plan = _plan(conn, "SELECT * FROM events WHERE type='capture' ORDER BY id DESC LIMIT 1")
+        assert "idx_events_type" in plan
+
+
+def test_counters_follow_inserts_updates_and_deletes(db):
+    with db.get_conn() as conn:
+        conn.execute("INSERT INTO leads(cnpj, created_at) VALUES ('1', 'x'), ('2', 'x')")
+        conn.execute("INSERT OR IGNORE INTO opt_out(phone, created_at) VALUES ('+5511', 'x')")
+        conn.execute("INSERT OR IGNORE INTO opt_out(phone, created_at) VALUES ('+5511', 'x')")
+        conn.executemany(
+            "INSERT INTO messages(lead_id, kind, message_text) VALUES (?, 'first', 'oi')",
+            [(1,), (2,), (2,)],
+        )
+        conn.execute("UPDATE messages SET status='sent', sent_at='2020-01-02T10:00:00' WHERE id IN (1, 2)")
+        conn.execute("UPDATE messages SET status='failed' WHERE id=3")
+        conn.execute("UPDATE messages SET status='failed', sent_at=NULL WHERE id=2")
+        conn.execute("DELETE FROM leads WHERE cnpj='2'")
+
+        counters = db.get_counters(conn)
+        days = conn.execute("SELECT day, sent FROM stats_daily_sent").fetchall()
+
+    assert counters == {"leads": 1, "sent": 1, "failed": 2, "optouts": 1}
+    assert [tuple(r) for r in days] == [("2020-01-02", 1)]
+
+
+def test_query_leads_filters_search_and_keyset(db):
+    with db.get_conn() as conn:
+        conn.executemany(
+            "INSERT INTO leads(cnpj, razao_social, cidade, uf, segmento, data_abertura, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, 'x')",
+            [
+                ("1", "Padaria Pão Quente", "São Paulo", "SP", "restaurante", "2020-01-01"),
+                ("2", "Mercado Bom Preço", "Campinas", "SP", "varejo", "2020-01-02"),
+                ("3", "Padaria Central", "Rio de Janeiro", "RJ", "restaurante", "2020-01-03"),
+                ("4", "Padaria Sao Jorge", "Santos", "SP", "restaurante", "2020-01-04"),
+            ],
+        )
+
+        def ids(filters, before=None, limit=50):
+            return [r["id"] for r in db.query_leads(conn, filters, before, limit)]
+
+        assert ids({"uf": "SP"}) == [4, 2, 1]
+        assert ids({"uf": "SP", "segmento": "restaurante"}, limit=1) == [4]
+        assert ids({"uf": "SP", "segmento": "restaurante"}, before=4) == [1]
+        assert ids({"abertura_de": "2020-01-02", "abertura_ate": "2020-01-03"}) == [3, 2]
+        # Busca sem acento e por prefixo
+        assert ids({"q": "padar sao"}) == [4, 1]
+        assert ids({"q": 'campinas"'}) == [2]
+
+        conn.execute("UPDATE leads SET razao_social='Restaurante X' WHERE id=1")
+        assert ids({"q": "padaria"}) == [4, 3]
+
+        plan = _plan(conn, "SELECT id FROM leads WHERE uf = ? AND id < ? ORDER BY id DESC LIMIT 50", ("SP", 10))
+        assert "idx_leads_uf" in plan and "TEMP B-TREE" not in plan
+
+
+def test_reserve_daily_quota_never_overshoots_limit(db):
+    from concurrent.futures import ThreadPoolExecutor
+
+    def claim(_):
+        got = 0
+        while True:
+            n = db.reserve_daily_quota("2020-01-01", 3, 20)
+            if not n:
+                return got
+            got += n
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        grants = list(pool.map(claim, range(4)))
+
+    assert sum(grants) == 20
+    assert db.get_daily_sent("2020-01-01") == 20
+
+    db.release_daily_quota("2020-01-01", 5)
+    assert db.reserve_daily_quota("2020-01-01", 10, 20) == 5
+    assert db.reserve_daily_quota("2020-01-02", 10, 0) == 0
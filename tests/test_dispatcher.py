@@ -0,0 +1,151 @@
+from datetime import datetime
+
+import pytest
+
+
+@pytest.fixture
+def db(db):
+    with db.get_conn() as conn:
+        for i in range(5):
+            phone = "(11)912345678" if i != 2 else "123"
+            conn.execute(
+                "INSERT INTO leads(cnpj, telefone, created_at) VALUES (?, ?, 'x')", (str(i), phone)
+            )
+            conn.execute(
+                "INSERT INTO messages(lead_id, kind, message_text) VALUES (?, 'first', 'oi')", (i + 1,)
+            )
+    import optout
+
+    optout.optouts.reload()
+    return db
+
+
+def test_available_slots():
+    from dispatcher import available_slots
+
+    now = datetime(2020, 1, 1, 12, 0, 0)
+    assert available_slots(now, None, 30, 110) == (4, 0.0)
+    assert available_slots(now, "2020-01-01T11:59:50", 30, 110) == (4, 20.0)
+    assert available_slots(now, "2020-01-01T11:59:50", 1800, 110)[0] == 0
+    assert available_slots(now, "2020-01-01T11:59:50", 0, 110) == (None, 0.0)
+
+
+def test_dispatch_queued_records_results_and_respects_daily_limit(db, monkeypatch):
+    import dispatcher
+
+    monkeypatch.setenv("INTERVALO_ENVIO", "0")
+    monkeypatch.setenv("LIMITE_DIARIO", "4")
+    monkeypatch.setattr("dispatcher.DISPATCH_COMMIT_BATCH", 2)
+
+    sent_to = []
+
+    def fake_send(phone, text):
+        sent_to.append(phone)
+        if len(sent_to) == 1:
+            return {"ok": False, "error": "boom"}
+        return {"ok": True, "message_id": f"m{len(sent_to)}"}
+
+    monkeypatch.setattr("dispatcher.send_text", fake_send)
+
+    result = dispatcher.dispatch_queued()
+
+    assert result == {"sent": 2, "failed": 2, "optout": 0}
+    assert set(sent_to) == {"+5511912345678"}
+    with db.get_conn() as conn:
+        rows = conn.execute("SELECT status, provider_message_id, error FROM messages ORDER BY id").fetchall()
+        contacted = conn.execute("SELECT COUNT(*) FROM leads WHERE status='contatado'").fetchone()[0]
+    statuses = [r["status"] for r in rows]
+    assert statuses.count("sent") == 2 and statuses.count("failed") == 2 and statuses[4] == "queued"
+    assert rows[2]["error"] == "telefone inválido"
+    assert all(r["provider_message_id"] for r in rows if r["status"] == "sent")
+    assert contacted == 2
+    assert db.get_daily_sent(dispatcher.today_str()) == 2
+
+    # Quota do dia: só sobram 2 envios
+    result = dispatcher.dispatch_queued()
+    assert result["sent"] + result["failed"] == 1
+
+
+def test_dispatch_skips_opted_out_phones(db, monkeypatch):
+    import dispatcher
+
+    monkeypatch.setenv("INTERVALO_ENVIO", "0")
+    monkeypatch.setenv("LIMITE_DIARIO", "50")
+    monkeypatch.setattr("dispatcher.send_text", lambda phone, text: {"ok": True, "message_id": "x"})
+
+    with db.get_conn() as conn:
+        conn.execute("UPDATE leads SET telefone='(11)987654321' WHERE id=4")
+        conn.execute("INSERT INTO opt_out(phone, created_at) VALUES ('+5511912345678', 'x')")
+
+    result = dispatcher.dispatch_queued()
+
+    assert result == {"sent": 1, "failed": 1, "optout": 3}
+    with db.get_conn() as conn:
+        statuses = [r[0] for r in conn.execute("SELECT status FROM messages ORDER BY id")]
+        blocked = conn.execute("SELECT COUNT(*) FROM leads WHERE status='bloqueado'").fetchone()[0]
+    assert statuses == ["cancelled", "cancelled", "failed", "sent", "cancelled"]
+    assert blocked == 3
+
+
+def test_dispatch_reclaims_stale_sending_and_returns_unsent_claims(db, monkeypatch):
+    import dispatcher
+
+    monkeypatch.setenv("INTERVALO_ENVIO", "0")
+    monkeypatch.setenv("LIMITE_DIARIO", "50")
+    monkeypatch.setattr("dispatcher.send_text", lambda phone, text: {"ok": True, "message_id": "x"})
+
+    now = datetime.utcnow()
+    with db.get_conn() as conn:
+        # 1: reservada por um dispatcher que morreu; 2: reservada por um que ainda roda
+        conn.execute("UPDATE messages SET status='sending', claimed_at='2000-01-01' WHERE id=1")
+        conn.execute("UPDATE messages SET status='sending', claimed_at=? WHERE id=2", (now.isoformat(),))
+
+    # Sem cota: nada é enviado e as reservas voltam para a fila
+    monkeypatch.setattr("dispatcher.reserve_daily_quota", lambda day, n, limit: 0)
+    assert dispatcher.dispatch_queued(now)["reason"] == "limite_diario"
+    with db.get_conn() as conn:
+        statuses = [r[0] for r in conn.execute("SELECT status FROM messages ORDER BY id")]
+    assert statuses == ["queued", "sending", "queued", "queued", "queued"]
+
+
+def test_concurrent_dispatchers_send_each_message_once(db, monkeypatch):
+    import threading
+    import time
+
+    import dispatcher
+
+    monkeypatch.setenv("INTERVALO_ENVIO", "0")
+    monkeypatch.setenv("LIMITE_DIARIO", "50")
+    with db.get_conn() as conn:
+        conn.execute("UPDATE messages SET message_text='oi ' || id")
+
+    sent = []
+    lock = threading.Lock()
+
+    def fake_send(phone, text):
+        time.sleep(0.02)
+        with lock:
+            sent.append(text)
+        return {"ok": True, "message_id": text}
+
+    monkeypatch.setattr("dispatcher.send_text", fake_send)
+
+    barrier = threading.Barrier(2)
+    results = []
+
+    def run():
+        barrier.wait()
+        results.append(dispatcher.dispatch_queued())
+        db.close_thread_conns()
+
+    threads = [threading.Thread(target=run) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+
+    assert sorted(sent) == ["oi 1", "oi 2", "oi 4", "oi 5"]
+    assert sum(r["sent"] for r in results) == 4
+    with db.get_conn() as conn:
+        statuses = [r[0] for r in conn.execute("SELECT status FROM messages ORDER BY id")]
+    assert statuses == ["sent", "sent", "failed", "sent", "sent"]
@@ -0,0 +1,44 @@
+def _lead(cnpj, cnae="5611201"):
+    return {
+        "cnpj": cnpj,
+        "razao_social": f"Empresa {cnpj}",
+        "cidade": "São Paulo",
+        "uf": "SP",
+        "cnae_principal": cnae,
+        "telefone": "(11)999990000",
+        "email": None,
+        "endereco": "",
+        "data_abertura": "2020-01-01",
+    }
+
+
+def test_ingest_leads_counts_inserted_and_skipped(monkeypatch, tmp_path):
+    monkeypatch.setattr("database.DB_PATH", str(tmp_path / "t.db"))
+
+    import database
+    from ingestion import ingest_leads, load_known_cnpjs
+
+    database.init_db()
+
+    with database.get_conn() as conn:
+        known = load_known_cnpjs(conn)
+        result = ingest_leads(conn, [_lead("1"), _lead("2"), _lead("1"), _lead(None)], known, chunk_size=1)
+    assert (result["inserted"], result["skipped"]) == (2, 2)
+
+    # Recaptura: pré-filtro em memória descarta tudo sem tocar no banco
+    with database.get_conn() as conn:
+        result = ingest_leads(conn, [_lead("1"), _lead("2"), _lead("3")], known)
+    assert (result["inserted"], result["skipped"]) == (1, 2)
+
+    # Conjunto desatualizado: o ON CONFLICT garante a contagem exata
+    with database.get_conn() as conn:
+        result = ingest_leads(conn, [_lead("1"), _lead("4")], set())
+        segs = dict(conn.execute("SELECT cnpj, segmento FROM leads").fetchall())
+    assert (result["inserted"], result["skipped"]) == (1, 1)
+    assert segs == {"1": "restaurante", "2": "restaurante", "3": "restaurante", "4": "restaurante"}
+
+    # Só os CNPJs abertos na faixa das fatias entram no conjunto
+    with database.get_conn() as conn:
+        ingest_leads(conn, [dict(_lead("5"), data_abertura="2020-02-01")])
+        assert load_known_cnpjs(conn, "2020-02-01", "2020-02-01") == {"5"}
+        assert load_known_cnpjs(conn) == {"1", "2", "3", "4", "5"}
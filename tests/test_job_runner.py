@@ -0,0 +1,123 @@
+import threading
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def quiet_events(monkeypatch):
+    monkeypatch.setattr("job_runner.log_event", lambda t, p="": None)
+
+
+def test_submit_job_runs_in_background_and_blocks_overlap(db, monkeypatch):
+    import job_runner
+
+    release = threading.Event()
+
+    def slow_job():
+        release.wait(5)
+        return {"inserted": 3}
+
+    monkeypatch.setitem(job_runner.JOBS, "capture", slow_job)
+    monkeypatch.setitem(job_runner.JOBS, "queue", lambda: 1 / 0)
+
+    run_id = job_runner.submit_job("capture")
+    assert run_id is not None
+    assert job_runner.get_run(run_id)["status"] == "running"
+    # Mesmo job não roda de novo, nem pelo scheduler
+    assert job_runner.submit_job("capture") is None
+    assert job_runner.run_job("capture") is None
+
+    release.set()
+    for _ in range(50):
+        run = job_runner.get_run(run_id)
+        if run["status"] != "running":
+            break
+        threading.Event().wait(0.05)
+    assert run["status"] == "done" and run["counts"] == {"inserted": 3}
+    assert run["seconds"] is not None and run["trigger"] == "manual"
+
+    assert job_runner.run_job("queue") is None
+    failed = job_runner.recent_runs("queue")[0]
+    assert failed["status"] == "failed" and "division" in failed["error"]
+
+
+def test_stale_running_job_is_abandoned(db, monkeypatch):
+    import job_runner
+
+    with db.get_conn() as conn:
+        conn.execute(
+            "INSERT INTO job_runs(job, slot, trigger, status, started_at) "
+            "VALUES ('dispatch', 'dispatch', 'manual', 'running', '2000-01-01')"
+        )
+    monkeypatch.setitem(job_runner.JOBS, "dispatch", lambda: {"sent": 0})
+
+    assert job_runner.run_job("dispatch") == {"sent": 0}
+    assert [r["status"] for r in job_runner.recent_runs("dispatch")] == ["done", "abandoned"]
+
+
+def test_run_without_heartbeat_is_abandoned_but_live_run_blocks(db, monkeypatch):
+    from datetime import datetime, timedelta
+
+    import job_runner
+
+    now = datetime.utcnow()
+    recent = (now - timedelta(seconds=5)).isoformat()
+    silent = (now - timedelta(seconds=job_runner.JOB_STALE_SECONDS + 5)).isoformat()
+    with db.get_conn() as conn:
+        # Iniciada há pouco, mas o processo (líder antigo) parou de dar heartbeat
+        conn.execute(
+            "INSERT INTO job_runs(job, slot, trigger, status, started_at, holder, heartbeat_at) "
+            "VALUES ('webhooks', 'webhooks', 'scheduler', 'running', ?, 'morto:1:x', ?)",
+            (recent, silent),
+        )
+        # Rodando há horas, com heartbeat em dia
+        conn.execute(
+            "INSERT INTO job_runs(job, slot, trigger, status, started_at, holder, heartbeat_at) "
+            "VALUES ('capture', 'capture', 'scheduler', 'running', '2000-01-01', 'vivo:2:y', ?)",
+            (recent,),
+        )
+    monkeypatch.setitem(job_runner.JOBS, "webhooks", lambda: {"processed": 0})
+
+    assert job_runner.run_job("webhooks") == {"processed": 0}
+    runs = job_runner.recent_runs("webhooks")
+    assert [r["status"] for r in runs] == ["done", "abandoned"]
+    assert runs[0]["holder"] == job_runner.RUNNER_ID
+    assert job_runner.start_run("capture", "manual") is None
+    # Backfill divide o slot com a captura
+    assert job_runner.start_run("capture_backfill", "manual") is None
+
+
+def test_validate_kwargs_rejects_bad_backfill_bodies():
+    import job_runner
+
+    ok = {"date_start": "2024-01-01", "date_end": "2024-01-31"}
+    assert job_runner.validate_kwargs("capture_backfill", ok) == ok
+    assert job_runner.validate_kwargs("queue", None) == {}
+    for body in (None, {}, [ok], {**ok, "x": 1}, {**ok, "date_end": "31/01/2024"},
+                 {"date_start": "2024-02-01", "date_end": "2024-01-01"}, {**ok, "force": "sim"}):
+        with pytest.raises(ValueError):
+            job_runner.validate_kwargs("capture_backfill", body)
+    with pytest.raises(ValueError):
+        job_runner.validate_kwargs("queue", {"limit": 1})
+
+
+def test_finished_runs_past_retention_are_purged(db, monkeypatch):
+    import job_runner
+
+    with db.get_conn() as conn:
+        for status, started in (("done", "2000-01-01"), ("failed", "2000-01-02"), ("done", "2999-01-01")):
+            conn.execute(
+                "INSERT INTO job_runs(job, slot, trigger, status, started_at) VALUES ('queue', 'queue', 'scheduler', ?, ?)",
+                (status, started),
+            )
+        conn.execute(
+            "INSERT INTO job_runs(job, slot, trigger, status, started_at) VALUES ('dispatch', 'dispatch', 'scheduler', 'done', '2000-01-01')"
+        )
+    monkeypatch.setitem(job_runner.JOBS, "queue", lambda: {"queued": 0})
+
+    job_runner.run_job("queue")
+
+    # Sobram a execução recente e a nova; as antigas de 'queue' foram apagadas
+    runs = job_runner.recent_runs("queue")
+    assert len(runs) == 2 and all(r["started_at"] > "2001" for r in runs)
+    assert len(job_runner.recent_runs("dispatch")) == 1  # outros jobs ficam para o próprio start_run
@@ -0,0 +1,37 @@
+def test_filters_push_full_codes_upstream_and_prefixes_locally(monkeypatch):
+    from lead_filters import get_target_filters, upstream_params, compile_office_predicate
+
+    monkeypatch.setenv("CNAE_FILTRO", "56.11-2-01, 4711302")
+    monkeypatch.setenv("UF_FILTRO", "sp, RJ,")
+    filters = get_target_filters()
+    assert filters == {"cnaes": ("5611201", "4711302"), "ufs": ("RJ", "SP")}
+    assert upstream_params(filters) == {
+        "address.state.in": "RJ,SP",
+        "mainActivity.id.in": "5611201,4711302",
+    }
+
+    # Com prefixo, o CNAE não vai para a API: só o filtro local
+    monkeypatch.setenv("CNAE_FILTRO", "5611201,47")
+    filters = get_target_filters()
+    assert upstream_params(filters) == {"address.state.in": "RJ,SP"}
+
+    match = compile_office_predicate(filters)
+    item = lambda cnae, uf: {"mainActivity": {"id": cnae}, "address": {"state": uf}}
+    assert match(item(5611201, "SP"))
+    assert match(item("4712100", "RJ"))
+    assert not match(item(5611203, "SP"))
+    assert not match(item(4711302, "MG"))
+    assert not match({"address": {"state": "SP"}})
+
+    monkeypatch.setenv("CNAE_FILTRO", "")
+    monkeypatch.setenv("UF_FILTRO", "")
+    assert compile_office_predicate(get_target_filters()) is None
+
+
+def test_build_shards_merges_upstream_params():
+    from capture_engine import build_shards
+
+    params = {"address.state.in": "RJ,SP", "mainActivity.id.in": "5611201"}
+    assert build_shards("2020-01-01", "2020-01-01", None, params)[0]["params"] == params
+    shard = build_shards("2020-01-01", "2020-01-01", ["SP"], params)[0]
+    assert shard["params"] == {"address.state.in": "SP", "mainActivity.id.in": "5611201"}
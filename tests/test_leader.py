@@ -0,0 +1,27 @@
+def test_lease_is_exclusive_until_it_expires(db):
+    from leader import acquire_lease, release_lease
+
+    assert acquire_lease("scheduler", "a", ttl=30, now=1000)
+    assert not acquire_lease("scheduler", "b", ttl=30, now=1010)
+    assert acquire_lease("scheduler", "a", ttl=30, now=1020)  # heartbeat renova
+    assert not acquire_lease("scheduler", "b", ttl=30, now=1049)
+    assert acquire_lease("scheduler", "b", ttl=30, now=1051)  # failover
+    assert not acquire_lease("scheduler", "a", ttl=30, now=1052)
+
+    release_lease("scheduler", "b")
+    assert acquire_lease("scheduler", "a", ttl=30, now=1053)
+
+
+def test_elector_starts_and_stops_scheduler_once(db, monkeypatch):
+    from leader import LeaderElector
+
+    monkeypatch.setattr("leader.log_event", lambda t, p="": None)
+    calls = []
+    a = LeaderElector("scheduler", lambda: calls.append("a+"), lambda: calls.append("a-"), holder="a")
+    b = LeaderElector("scheduler", lambda: calls.append("b+"), lambda: calls.append("b-"), holder="b")
+
+    assert a.tick() and a.tick()
+    assert not b.tick()
+    a.stop()  # libera o lease
+    assert b.tick()
+    assert calls == ["a+", "a-", "b+"]
@@ -0,0 +1,69 @@
+def test_histogram_renders_cumulative_prometheus_buckets():
+    from metrics import Histogram, _registry
+
+    h = Histogram("t_seconds", "teste", ("op",), buckets=(0.1, 1))
+    _registry.remove(h)
+    for v in (0.05, 0.5, 0.5, 3):
+        h.observe(v, 'a"b')
+
+    lines = h.render()
+    assert 't_seconds_bucket{op="a\\"b",le="0.1"} 1' in lines
+    assert 't_seconds_bucket{op="a\\"b",le="1"} 3' in lines
+    assert 't_seconds_bucket{op="a\\"b",le="+Inf"} 4' in lines
+    assert 't_seconds_count{op="a\\"b"} 4' in lines
+
+
+def test_render_sorts_mixed_label_types():
+    from metrics import Counter, Histogram, _registry
+
+    h = Histogram("t_mixed_seconds", "teste", ("endpoint", "status"), buckets=(1,))
+    c = Counter("t_mixed_total", "teste", ("status",))
+    _registry.remove(h)
+    _registry.remove(c)
+    h.observe(0.5, "x", 200)
+    h.observe(0.5, "x", "error")
+    c.inc(200)
+    c.inc("error")
+
+    lines = h.render() + c.render()
+    assert 't_mixed_seconds_count{endpoint="x",status="200"} 1' in lines
+    assert 't_mixed_seconds_count{endpoint="x",status="error"} 1' in lines
+    assert 't_mixed_total{status="error"} 1' in lines
+
+
+def test_sql_op_reads_the_first_keyword():
+    from database import _sql_op
+
+    assert _sql_op("BEGIN IMMEDIATE") == "BEGIN"
+    assert _sql_op("\n  WITH x AS (SELECT 1) SELECT * FROM x") == "WITH"
+    assert _sql_op("select 1") == "SELECT"
+    assert _sql_op("PRAGMA user_version") == "OTHER"
+    assert _sql_op("   ") == "OTHER"
+
+
+def test_sql_upstream_and_job_timings_are_recorded(monkeypatch, tmp_path):
+    import database
+    import metrics
+    from tests.test_cnpj_scraper import make_response, patch_get
+
+    monkeypatch.setattr("database.DB_PATH", str(tmp_path / "t.db"))
+    database.init_db()
+
+    def count(hist, labels):
+        counts, _ = hist.snapshot().get(labels, ([], 0))
+        return sum(counts)
+
+    before = count(metrics.sql_duration, ("INSERT",))
+    with database.get_conn() as conn:
+        conn.execute("INSERT INTO leads(cnpj, created_at) VALUES ('1', 'x')")
+    assert count(metrics.sql_duration, ("INSERT",)) == before + 1
+
+    patch_get(monkeypatch, lambda url, headers, params, timeout: make_response(200, {"items": []}))
+    from cnpj_scraper import fetch_offices_by_founded_range
+
+    fetch_offices_by_founded_range("2020-01-01", "2020-01-01")
+    assert count(metrics.upstream_duration, ("cnpja GET /office", "200")) >= 1
+
+    text = metrics.render()
+    assert "# TYPE prospec_sql_duration_seconds histogram" in text
+    assert 'prospec_upstream_request_duration_seconds_count{endpoint="cnpja GET /office",status="200"}' in text
@@ -0,0 +1,81 @@
+import io
+import zipfile
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def quiet_events(monkeypatch):
+    monkeypatch.setattr("rf_import.log_event", lambda t, p="": None)
+
+
+def _row(n, uf="SP", cnae="5611201", inicio="20240110", situacao="02"):
+    row = [""] * 30
+    row[0], row[1], row[2] = f"{n:08d}", "0001", "00"
+    row[4] = f"Padaria São {n}"
+    row[5] = situacao
+    row[10] = inicio
+    row[11] = cnae
+    row[13], row[14], row[15], row[17] = "RUA", "DAS FLORES", "10", "CENTRO"
+    row[19], row[20] = uf, "7107"
+    row[21], row[22] = "11", "912345678"
+    row[27] = "CONTATO@EXEMPLO.COM"
+    return row
+
+
+def _zip(path, rows, member="K3241.K03200Y0.D40113.ESTABELE"):
+    buf = io.StringIO()
+    for row in rows:
+        buf.write(";".join(f'"{v}"' for v in row) + "\n")
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(member, buf.getvalue().encode("latin-1"))
+    return str(path)
+
+
+def test_import_file_filters_maps_and_resumes(db, monkeypatch, tmp_path):
+    import rf_import
+
+    rows = [_row(i) for i in range(1, 7)] + [
+        _row(7, uf="RJ"),
+        _row(8, cnae="4711302"),
+        _row(9, inicio="20230101"),
+        _row(10, situacao="08"),
+    ]
+    path = _zip(tmp_path / "Estabelecimentos0.zip", rows)
+    match = rf_import.build_row_filter("2024-01-01", "2024-12-31", ("5611",), {"SP"})
+
+    # Cai no meio: o 2º lote falha depois do 1º ter sido gravado
+    real_ingest = rf_import.ingest_leads
+    calls = []
+
+    def flaky(conn, leads):
+        calls.append(len(leads))
+        if len(calls) == 2:
+            raise RuntimeError("queda")
+        return real_ingest(conn, leads)
+
+    monkeypatch.setattr("rf_import.ingest_leads", flaky)
+    with pytest.raises(RuntimeError):
+        rf_import.import_file(path, match, {"7107": "São Paulo"}, chunk_size=4)
+
+    monkeypatch.setattr("rf_import.ingest_leads", real_ingest)
+    stats = rf_import.import_file(path, match, {"7107": "São Paulo"}, chunk_size=4)
+    assert (stats["resumed_at"], stats["matched"], stats["inserted"]) == (4, 2, 2)
+
+    with db.get_conn() as conn:
+        leads = conn.execute("SELECT * FROM leads ORDER BY cnpj").fetchall()
+    assert [l["cnpj"] for l in leads] == [f"{i:08d}000100" for i in range(1, 7)]
+    lead = leads[0]
+    assert (lead["razao_social"], lead["cidade"], lead["uf"]) == ("Padaria São 1", "São Paulo", "SP")
+    assert (lead["data_abertura"], lead["segmento"], lead["telefone_e164"]) == (
+        "2024-01-10", "restaurante", "+5511912345678"
+    )
+    assert lead["email"] == "contato@exemplo.com"
+
+    # Mesmo dump já importado: nada novo
+    assert rf_import.import_file(path, match)["rows"] == 0
+
+    # Dump do mês seguinte com o mesmo nome de arquivo: lido do início
+    _zip(tmp_path / "Estabelecimentos0.zip", rows + [_row(11)], member="K3241.K03200Y0.D40210.ESTABELE")
+    stats = rf_import.import_file(path, match)
+    assert (stats["resumed_at"], stats["rows"], stats["inserted"]) == (0, 11, 1)
@@ -0,0 +1,285 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def quiet_events(monkeypatch):
+    monkeypatch.setattr("scheduler_jobs.log_event", lambda t, p="": None)
+
+
+def _seed_leads(conn, n):
+    from ingestion import ingest_leads
+
+    leads = [
+        {"cnpj": str(i), "razao_social": f"Empresa {i}", "cidade": "Campinas", "uf": "SP",
+         "cnae_principal": "5611201" if i % 2 else "4711302"}
+        for i in range(n)
+    ]
+    return ingest_leads(conn, leads)
+
+
+def test_drain_notifications_digest_groups_by_segment(db, monkeypatch):
+    import scheduler_jobs
+
+    with db.get_conn() as conn:
+        result = _seed_leads(conn, 5)
+        conn.execute(
+            "INSERT INTO notification_outbox(lead_id, created_at) SELECT id, ? FROM leads",
+            (result["created_at"],),
+        )
+
+    digests = []
+    monkeypatch.setenv("NOTIFY_DIGEST_SIZE", "2")
+    monkeypatch.setenv("NOTIFY_DIGEST_WINDOW", "3600")
+    monkeypatch.setattr(
+        "scheduler_jobs.notify_admin_digest",
+        lambda leads: digests.append([l["segmento"] for l in leads]) or {"ok": True},
+    )
+
+    scheduler_jobs.drain_notifications_job()
+
+    # Dois resumos completos; o 5º lead espera a janela
+    assert digests == [["varejo", "restaurante"], ["varejo", "restaurante"]]
+    with db.get_conn() as conn:
+        status = [r[0] for r in conn.execute("SELECT status FROM notification_outbox ORDER BY id")]
+    assert status == ["sent", "sent", "sent", "sent", "pending"]
+
+    # Sem janela, o grupo incompleto sai; falhas voltam para a fila
+    monkeypatch.setenv("NOTIFY_DIGEST_WINDOW", "0")
+    monkeypatch.setattr("scheduler_jobs.notify_admin_digest", lambda leads: {"ok": False, "error": "x"})
+    scheduler_jobs.drain_notifications_job()
+    with db.get_conn() as conn:
+        row = conn.execute("SELECT status, attempts FROM notification_outbox WHERE id=5").fetchone()
+    assert (row["status"], row["attempts"]) == ("pending", 1)
+
+
+def test_queue_initial_messages_renders_segment_templates(db, monkeypatch, tmp_path):
+    import scheduler_jobs
+    import templating
+
+    monkeypatch.setattr("templating.TEMPLATES_PATH", str(tmp_path / "templates.json"))
+    templating.save_templates({
+        "template_restaurante": "Oi {empresa}, em {cidade}",
+        "template_varejo": "Olá loja {empresa}",
+        "template_servicos": "Olá",
+    })
+
+    with db.get_conn() as conn:
+        _seed_leads(conn, 3)
+
+    scheduler_jobs.queue_initial_messages_job()
+    scheduler_jobs.queue_initial_messages_job()  # não duplica
+
+    with db.get_conn() as conn:
+        rows = conn.execute(
+            "SELECT lead_id, kind, template_key, message_text FROM messages ORDER BY lead_id"
+        ).fetchall()
+    assert [tuple(r) for r in rows] == [
+        (1, "first", "template_varejo", "Olá loja Empresa 0"),
+        (2, "first", "template_restaurante", "Oi Empresa 1, em Campinas"),
+        (3, "first", "template_varejo", "Olá loja Empresa 2"),
+    ]
+
+
+def test_backfill_phones_fills_e164_column(db):
+    import scheduler_jobs
+
+    with db.get_conn() as conn:
+        conn.executemany(
+            "INSERT INTO leads(cnpj, telefone, created_at) VALUES (?, ?, 'x')",
+            [("1", "(11)912345678"), ("2", "123"), ("3", None), ("4", "(11)912345678")],
+        )
+
+    scheduler_jobs.backfill_phones_job(batch_size=2)
+
+    with db.get_conn() as conn:
+        phones = [r[0] for r in conn.execute("SELECT telefone_e164 FROM leads ORDER BY id")]
+        plan = " ".join(r["detail"] for r in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM leads WHERE telefone_e164 = ?", ("+5511912345678",)
+        ))
+    assert phones == ["+5511912345678", "", "", "+5511912345678"]
+    assert "idx_leads_telefone_e164" in plan
+
+    # Leads novos já chegam normalizados pela ingestão
+    with db.get_conn() as conn:
+        _seed_leads(conn, 1)
+        assert conn.execute("SELECT COUNT(*) FROM leads WHERE telefone_e164 IS NULL").fetchone()[0] == 0
+
+
+def test_schedule_followups_is_set_based_and_incremental(db, monkeypatch, tmp_path):
+    from datetime import datetime, timedelta
+
+    import scheduler_jobs
+    import templating
+    from followups import schedule_followups
+
+    monkeypatch.setattr("templating.TEMPLATES_PATH", str(tmp_path / "templates.json"))
+    templating.save_templates({
+        "template_servicos": "Olá",
+        "template_followup_24h": "Oi {empresa}, viu minha mensagem?",
+    })
+
+    now = datetime(2026, 5, 10, 12, 0)
+    sent = (now - timedelta(hours=30)).isoformat()
+    with db.get_conn() as conn:
+        _seed_leads(conn, 5)
+        conn.execute("UPDATE leads SET telefone_e164 = '+55119000000' || id")
+        conn.execute(
+            "INSERT INTO messages(lead_id, kind, message_text, status, sent_at)"
+            " SELECT id, 'first', 'x', 'sent', ? FROM leads",
+            (sent,),
+        )
+        conn.execute("UPDATE leads SET status='respondeu' WHERE id=2")
+        conn.execute("INSERT INTO opt_out(phone, created_at) VALUES ('+551190000003', 'x')")
+        conn.execute(
+            "INSERT INTO messages(lead_id, kind, message_text, status) VALUES (4, 'followup_24h', 'y', 'queued')"
+        )
+        conn.execute("UPDATE messages SET status='failed' WHERE lead_id=5")
+
+    counts = schedule_followups(now)
+    assert counts == {"followup_24h": 1, "followup_72h": 0, "followup_7d": 0}
+
+    with db.get_conn() as conn:
+        rows = conn.execute(
+            "SELECT lead_id, template_key, message_text FROM messages"
+            " WHERE kind='followup_24h' AND status='queued' ORDER BY lead_id"
+        ).fetchall()
+        plan = " ".join(r["detail"] for r in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM messages WHERE kind=? AND sent_at > ? AND sent_at <= ?",
+            ("first", "a", "b"),
+        ))
+    assert [tuple(r) for r in rows] == [
+        (1, "template_followup_24h", "Oi Empresa 0, viu minha mensagem?"),
+        (4, None, "y"),
+    ]
+    assert "idx_messages_kind_sent_at" in plan
+
+    # A watermark avançou: rodar de novo não reprocessa nem duplica
+    assert schedule_followups(now + timedelta(minutes=30))["followup_24h"] == 0
+
+    # O passo seguinte conta a partir do envio do follow-up anterior
+    with db.get_conn() as conn:
+        conn.execute(
+            "UPDATE messages SET status='sent', sent_at=? WHERE kind='followup_24h' AND lead_id=1",
+            ((now + timedelta(hours=1)).isoformat(),),
+        )
+    assert schedule_followups(now + timedelta(hours=50))["followup_72h"] == 1
+    scheduler_jobs.schedule_followups_job()
+
+
+def test_capture_job_uses_ledger_to_fetch_only_new_days(db, monkeypatch):
+    import scheduler_jobs
+
+    monkeypatch.setattr("capture_engine.log_event", lambda t, p="": None)
+    monkeypatch.setattr("capture_engine.CNPJA_RATE_PER_MIN", 60000)
+    monkeypatch.setattr("scheduler_jobs.CAPTURE_WINDOW_DAYS", 4)
+    monkeypatch.setattr("scheduler_jobs.CAPTURE_RECHECK_DAYS", 1)
+    monkeypatch.setattr("scheduler_jobs.drain_notifications_job", lambda: None)
+    monkeypatch.delenv("CNAE_FILTRO", raising=False)
+    monkeypatch.delenv("UF_FILTRO", raising=False)
+
+    fetched = []
+
+    def fake_fetch(date_start, date_end, cursor=None, **params):
+        fetched.append(date_start)
+        return {"records": [{"taxId": date_start.replace("-", "")}], "next": None}
+
+    monkeypatch.setattr("cnpj_scraper.fetch_offices_by_founded_range", fake_fetch)
+    monkeypatch.setattr("scheduler_jobs.today_str", lambda: "2024-03-10")
+
+    assert scheduler_jobs.capture_job()["inserted"] == 5
+    assert sorted(fetched) == ["2024-03-06", "2024-03-07", "2024-03-08", "2024-03-09", "2024-03-10"]
+
+    # Dia seguinte: só o dia novo e a cauda de re-checagem
+    fetched.clear()
+    monkeypatch.setattr("scheduler_jobs.today_str", lambda: "2024-03-11")
+    result = scheduler_jobs.capture_job()
+    assert sorted(fetched) == ["2024-03-10", "2024-03-11"]
+    assert (result["ledger_skipped"], result["inserted"]) == (3, 1)
+
+    # Backfill reaproveita o ledger; force refaz
+    fetched.clear()
+    scheduler_jobs.capture_backfill_job("2024-03-05", "2024-03-07")
+    assert fetched == ["2024-03-05"]
+    fetched.clear()
+    scheduler_jobs.capture_backfill_job("2024-03-05", "2024-03-07", force=True)
+    assert sorted(fetched) == ["2024-03-05", "2024-03-06", "2024-03-07"]
+
+
+def test_capture_filter_change_refetches_and_drops_old_cursor(db, monkeypatch):
+    import scheduler_jobs
+
+    monkeypatch.setattr("capture_engine.log_event", lambda t, p="": None)
+    monkeypatch.setattr("capture_engine.CNPJA_RATE_PER_MIN", 60000)
+    monkeypatch.setattr("scheduler_jobs.drain_notifications_job", lambda: None)
+    monkeypatch.setenv("UF_FILTRO", "SP")
+    monkeypatch.setenv("CNAE_FILTRO", "47")
+
+    calls = []
+
+    def fake_fetch(date_start, date_end, cursor=None, **params):
+        calls.append(cursor)
+        return {"records": [], "next": None}
+
+    monkeypatch.setattr("cnpj_scraper.fetch_offices_by_founded_range", fake_fetch)
+
+    scheduler_jobs.capture_backfill_job("2024-03-01", "2024-03-01")
+    scheduler_jobs.capture_backfill_job("2024-03-01", "2024-03-01")
+    assert calls == [None]
+
+    # Cursor de uma paginação interrompida ainda com CNAE 47
+    from capture_engine import build_shards, shard_signature
+    from lead_filters import get_target_filters, upstream_params
+
+    filters = get_target_filters()
+    shard = build_shards("2024-03-02", "2024-03-02", None, upstream_params(filters), filters)[0]
+    with db.get_conn() as conn:
+        db.save_capture_cursor(conn, shard["key"], "p7", shard_signature(shard))
+
+    # Mesmos params na CNPJA (prefixo não vai na consulta), filtro local diferente
+    monkeypatch.setenv("CNAE_FILTRO", "56")
+    calls.clear()
+    scheduler_jobs.capture_backfill_job("2024-03-01", "2024-03-02")
+    assert calls == [None, None]
+
+
+def test_concurrent_drains_notify_each_lead_once(db, monkeypatch):
+    import threading
+    import time
+
+    import scheduler_jobs
+
+    with db.get_conn() as conn:
+        result = _seed_leads(conn, 6)
+        conn.execute(
+            "INSERT INTO notification_outbox(lead_id, created_at) SELECT id, ? FROM leads",
+            (result["created_at"],),
+        )
+
+    monkeypatch.setenv("NOTIFY_DIGEST_SIZE", "1")
+    sent = []
+
+    def notify(cnpj, *args):
+        time.sleep(0.01)
+        sent.append(cnpj)
+        return {"ok": True}
+
+    monkeypatch.setattr("scheduler_jobs.notify_admin_new_lead", notify)
+
+    # Dois processos: o lock local não serializa, só a reserva no banco
+    barrier = threading.Barrier(2)
+
+    def drain():
+        barrier.wait()
+        scheduler_jobs._drain_outbox()
+        db.close_thread_conns()
+
+    threads = [threading.Thread(target=drain) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+
+    assert len(sent) == len(set(sent)) == 6
+    with db.get_conn() as conn:
+        status = {r[0] for r in conn.execute("SELECT status FROM notification_outbox")}
+    assert status == {"sent"}
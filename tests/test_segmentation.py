@@ -0,0 +1,32 @@
+def test_longest_prefix_wins_regardless_of_table_order():
+    from segmentation import segmento_por_cnae
+
+    assert segmento_por_cnae("5611201") == "restaurante"
+    assert segmento_por_cnae("56.20-1-01") == "restaurante"
+    assert segmento_por_cnae(1091102) == "restaurante"  # subclasse dentro de 10 (indústria)
+    assert segmento_por_cnae(1091101) == "industria"
+    assert segmento_por_cnae("4520001") == "servicos"  # classe dentro de 45 (comércio)
+    assert segmento_por_cnae("4530701") == "comercio"
+    assert segmento_por_cnae("6311900") == "tecnologia"
+    assert segmento_por_cnae(111301) == "agro"  # int sem o zero à esquerda
+    assert segmento_por_cnae(None) == "servicos"
+
+
+def test_every_cnae_division_is_mapped():
+    from segmentation import CNAE_SEGMENTOS
+
+    divisoes = {
+        "01", "02", "03", "05", "06", "07", "08", "09", *(str(d) for d in range(10, 34)),
+        "35", "36", "37", "38", "39", "41", "42", "43", "45", "46", "47", "49", "50", "51",
+        "52", "53", "55", "56", "58", "59", "60", "61", "62", "63", "64", "65", "66", "68",
+        "69", "70", "71", "72", "73", "74", "75", "77", "78", "79", "80", "81", "82", "84",
+        "85", "86", "87", "88", "90", "91", "92", "93", "94", "95", "96", "97", "99",
+    }
+    assert divisoes <= set(CNAE_SEGMENTOS)
+
+
+def test_bulk_classification_matches_single():
+    from segmentation import segmento_por_cnae, segmentos_por_cnae
+
+    codes = ["5611201", "4711302", None, "5611201", 6201501]
+    assert segmentos_por_cnae(codes) == [segmento_por_cnae(c) for c in codes]
@@ -0,0 +1,59 @@
+import json
+import os
+
+import pytest
+
+
+def test_compiled_template_renders_and_validates():
+    from templating import CompiledTemplate, TemplateError, compile_templates
+
+    tpl = CompiledTemplate("t", "Olá {empresa} de {cidade}/{uf}! {{literal}}")
+    lead = {"razao_social": "ACME", "cidade": "Santos", "uf": "SP"}
+    assert tpl.render(lead) == "Olá ACME de Santos/SP! {literal}"
+
+    with pytest.raises(TemplateError, match="nome"):
+        compile_templates({"t": "Oi {nome}"})
+    with pytest.raises(TemplateError):
+        compile_templates({"t": "Oi {empresa"})
+    with pytest.raises(TemplateError):
+        compile_templates({"t": "Oi {empresa!r}"})
+
+
+def test_get_templates_reloads_on_change_and_render_batch(monkeypatch, tmp_path):
+    import templating
+
+    path = str(tmp_path / "templates.json")
+    monkeypatch.setattr("templating.TEMPLATES_PATH", path)
+    templating.save_templates({
+        "template_restaurante": "Oi {empresa}",
+        "template_servicos": "Olá {empresa} ({segmento})",
+    })
+
+    first = templating.get_templates()
+    assert templating.get_templates() is first  # sem releitura
+
+    leads = [
+        {"id": 1, "razao_social": "Bar", "segmento": "restaurante"},
+        {"id": 2, "razao_social": "Obra", "segmento": "construcao"},
+        {"id": 3, "razao_social": "Cantina", "segmento": "restaurante"},
+    ]
+    assert sorted(templating.render_batch(leads)) == [
+        (1, "template_restaurante", "Oi Bar"),
+        (2, "template_servicos", "Olá Obra (construcao)"),
+        (3, "template_restaurante", "Oi Cantina"),
+    ]
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"template_servicos": "Novo texto para {empresa}!"}, f)
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+
+    assert templating.render_batch(leads[:1]) == [(1, "template_servicos", "Novo texto para Bar!")]
+
+
+def test_shipped_templates_are_valid():
+    import templating
+
+    path = os.path.join(os.path.dirname(__file__), "..", "message_templates", "templates.json")
+    with open(path, encoding="utf-8") as f:
+        templating.compile_templates(json.load(f))
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def db(db):
+    with db.get_conn() as conn:
+        for i, phone in enumerate(["+5511912345678", "+5511912345679", "+5511912345670"]):
+            conn.execute(
+                "INSERT INTO leads(cnpj, telefone_e164, status, created_at) VALUES (?, ?, 'contatado', 'x')",
+                (str(i), phone),
+            )
+            conn.execute(
+                "INSERT INTO messages(lead_id, kind, message_text, status, provider_message_id)"
+                " VALUES (?, 'first', 'oi', 'sent', ?)",
+                (i + 1, f"m{i + 1}"),
+            )
+    return db
+
+
+def test_process_webhook_inbox_batches_receipts_replies_and_optouts(db):
+    from webhooks import enqueue_webhook, process_webhook_inbox
+    from optout import optouts
+
+    callbacks = [
+        {"type": "MessageStatusCallback", "status": "RECEIVED", "ids": ["m1", "m2"], "momment": 1700000000000},
+        {"type": "MessageStatusCallback", "status": "RECEIVED", "ids": ["m1"], "momment": 1700000009000},
+        {"type": "MessageStatusCallback", "status": "READ", "ids": ["m1"], "momment": 1700000060000},
+        {"type": "ReceivedCallback", "phone": "5511912345679", "fromMe": False, "text": {"message": "Quero saber"}},
+        {"type": "ReceivedCallback", "phone": "5511912345670", "fromMe": False, "text": {"message": "sair"}},
+        {"type": "ReceivedCallback", "phone": "5511912345678", "fromMe": True, "text": {"message": "eco"}},
+    ]
+    for cb in callbacks:
+        enqueue_webhook(json.dumps(cb))
+    enqueue_webhook("não é json")
+
+    counts = process_webhook_inbox(batch_size=3)
+    assert counts == {"callbacks": 7, "receipts": 2, "replies": 1, "optouts": 1}
+    assert process_webhook_inbox()["callbacks"] == 0
+
+    with db.get_conn() as conn:
+        msgs = conn.execute("SELECT delivered_at, read_at FROM messages ORDER BY id").fetchall()
+        leads = [r[0] for r in conn.execute("SELECT status FROM leads ORDER BY id")]
+        opted = [r[0] for r in conn.execute("SELECT phone FROM opt_out")]
+        plan = " ".join(r["detail"] for r in conn.execute(
+            "EXPLAIN QUERY PLAN UPDATE messages SET read_at=? WHERE provider_message_id=?", ("x", "m1")
+        ))
+    assert tuple(msgs[0]) == ("2023-11-14T22:13:20", "2023-11-14T22:14:20")
+    assert tuple(msgs[2]) == (None, None)
+    assert leads == ["contatado", "respondeu", "contatado"]
+    assert opted == ["+5511912345670"] and "+5511912345670" in optouts
+    assert "idx_messages_provider_id" in plan
@@ -1,5 +1,8 @@
 import os
+import threading
+import time
 from datetime import datetime
+from functools import lru_cache
 import pytz
 import phonenumbers
 from phonenumbers.phonenumberutil import NumberParseException
@@ -19,6 +22,7 @@ def is_business_hours() -> bool:
     return weekday_ok and hour_ok
 
 
+@lru_cache(maxsize=65536)
 def to_e164_br(phone_raw: str):
     if not phone_raw:
         return None
@@ -31,5 +35,41 @@ def to_e164_br(phone_raw: str):
         return None
 
 
+def to_e164_br_many(phones) -> list:
+    """
+    Normaliza um lote de telefones; repetidos (no lote ou em lotes anteriores)
+    não passam de novo pelo libphonenumber.
+    """
+    return [to_e164_br(p) if p else None for p in phones]
+
+
 def today_str() -> str:
     return datetime.now(tz).strftime("%Y-%m-%d")
+
+
+def ttl_cache(seconds: float):
+    """
+    Memoiza uma função sem argumentos por `seconds` segundos (thread-safe).
+    `func.cache_clear()` força a releitura.
+    """
+    def decorator(func):
+        state = {"at": None, "value": None}
+        lock = threading.Lock()
+
+        def wrapper():
+            with lock:
+                now = time.monotonic()
+                if state["at"] is None or now - state["at"] >= seconds:
+                    state["value"] = func()
+                    state["at"] = now
+                return state["value"]
+
+        def cache_clear():
+            with lock:
+                state["at"] = None
+
+        wrapper.cache_clear = cache_clear
+        wrapper.__wrapped__ = func
+        return wrapper
+
+    return decorator
@@ -0,0 +1,147 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+from database import get_conn
+from optout import optouts
+from utils import to_e164_br
+
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "500"))
+# Linhas já processadas do inbox são apagadas depois de N dias
+WEBHOOK_RETENTION_DAYS = int(os.getenv("WEBHOOK_RETENTION_DAYS", "7"))
+
+# Status do MessageStatusCallback da Z-API -> coluna de messages
+STATUS_COLUMNS = {
+    "RECEIVED": "delivered_at",
+    "DELIVERED": "delivered_at",
+    "READ": "read_at",
+    "PLAYED": "read_at",
+}
+
+# Lead que respondeu sai do funil de follow-up; convertido/bloqueado ficam como estão
+REPLY_FROM_STATUS = ("novo", "contatado")
+
+
+def enqueue_webhook(raw: str):
+    """
+    Guarda o corpo cru do callback; o processamento fica para o worker.
+    """
+    with get_conn() as conn:
+        conn.execute(
+            "INSERT INTO webhook_inbox(received_at, payload) VALUES (?, ?)",
+            (datetime.utcnow().isoformat(), raw),
+        )
+
+
+def _text(payload: dict) -> str:
+    text = payload.get("text") or payload.get("message") or ""
+    if isinstance(text, dict):
+        text = text.get("message") or ""
+    return str(text).strip()
+
+
+def _when(payload: dict) -> str:
+    # "momment" (sic) vem em milissegundos na Z-API
+    ms = payload.get("momment")
+    if isinstance(ms, (int, float)) and ms > 0:
+        return datetime.utcfromtimestamp(ms / 1000).isoformat()
+    return datetime.utcnow().isoformat()
+
+
+def parse_callbacks(rows) -> dict:
+    """
+    Consolida um lote do inbox: recibos por provider_message_id (fica o
+    primeiro horário de cada coluna), respostas e opt-outs por telefone.
+    """
+    receipts = {}
+    replies = {}
+    opt_outs = {}
+    for row in rows:
+        try:
+            payload = json.loads(row["payload"] or "{}")
+        except ValueError:
+            continue
+        if not isinstance(payload, dict):
+            continue
+
+        status = str(payload.get("status") or "").upper()
+        if payload.get("type") == "MessageStatusCallback" or status in STATUS_COLUMNS:
+            column = STATUS_COLUMNS.get(status)
+            ids = payload.get("ids") or [payload.get("messageId") or payload.get("id")]
+            if column:
+                when = _when(payload)
+                for message_id in filter(None, ids):
+                    receipt = receipts.setdefault(message_id, {})
+                    receipt[column] = min(receipt.get(column) or when, when)
+            continue
+
+        if payload.get("fromMe") or payload.get("isGroup"):
+            continue
+        phone = payload.get("phone") or payload.get("from")
+        phone_e164 = (to_e164_br(str(phone)) or phone) if phone else None
+        if not phone_e164:
+            continue
+        if "SAIR" in _text(payload).upper():
+            opt_outs[phone_e164] = _when(payload)
+        else:
+            replies.setdefault(phone_e164, _when(payload))
+
+    return {"receipts": receipts, "replies": replies, "opt_outs": opt_outs}
+
+
+def process_webhook_inbox(batch_size: int = None) -> dict:
+    """
+    Processa o inbox em lotes: uma transação por lote com executemany para
+    recibos (via idx_messages_provider_id), respostas e opt-outs.
+    """
+    batch_size = batch_size or WEBHOOK_BATCH_SIZE
+    counts = {"callbacks": 0, "receipts": 0, "replies": 0, "optouts": 0}
+    while True:
+        with get_conn() as conn:
+            rows = conn.execute(
+                "SELECT id, payload FROM webhook_inbox WHERE processed_at IS NULL ORDER BY id LIMIT ?",
+                (batch_size,),
+            ).fetchall()
+            if not rows:
+                break
+            parsed = parse_callbacks(rows)
+
+            conn.executemany(
+                """
+                UPDATE messages SET
+                    delivered_at = COALESCE(delivered_at, :delivered_at, :read_at),
+                    read_at = COALESCE(read_at, :read_at)
+                WHERE provider_message_id = :id
+                """,
+                [
+                    {"id": mid, "delivered_at": r.get("delivered_at"), "read_at": r.get("read_at")}
+                    for mid, r in parsed["receipts"].items()
+                ],
+            )
+            marks = ",".join("?" for _ in REPLY_FROM_STATUS)
+            conn.executemany(
+                f"UPDATE leads SET status='respondeu' WHERE telefone_e164=? AND status IN ({marks})",
+                [(phone, *REPLY_FROM_STATUS) for phone in parsed["replies"]],
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO opt_out(phone, created_at, source) VALUES (?, ?, 'webhook')",
+                list(parsed["opt_outs"].items()),
+            )
+            conn.execute(
+                "UPDATE webhook_inbox SET processed_at=? WHERE processed_at IS NULL AND id <= ?",
+                (datetime.utcnow().isoformat(), rows[-1]["id"]),
+            )
+
+        for phone in parsed["opt_outs"]:
+            optouts.add(phone)
+        counts["callbacks"] += len(rows)
+        counts["receipts"] += len(parsed["receipts"])
+        counts["replies"] += len(parsed["replies"])
+        counts["optouts"] += len(parsed["opt_outs"])
+        if len(rows) < batch_size:
+            break
+
+    cutoff = (datetime.utcnow() - timedelta(days=WEBHOOK_RETENTION_DAYS)).isoformat()
+    with get_conn() as conn:
+        conn.execute("DELETE FROM webhook_inbox WHERE processed_at < ?", (cutoff,))
+    return counts
@@ -1,7 +1,7 @@
 import os
 import time
-import requests
 from datetime import datetime
+import http_client
 from database import log_event
 from utils import to_e164_br
 
@@ -22,12 +22,26 @@ def send_text(phone_e164: str, text: str):
     headers = {"Client-Token": ZAPI_TOKEN}
     payload = {"phone": phone_e164, "message": text}
 
-    r = requests.post(url, json=payload, headers=headers, timeout=30)
+    # Não idempotente: só repete em 429 ou falha de conexão (evita duplicar envio)
+    r = http_client.request(
+        "zapi", "POST", url, endpoint="zapi POST /send-text",
+        idempotent=False, json=payload, headers=headers,
+    )
     if r.status_code not in (200, 201):
         log_event("error", f"ZAPI status={r.status_code} body={r.text[:500]}")
         return {"ok": False, "status": r.status_code, "error": r.text}
 
-    return {"ok": True, "data": r.json()}
+    data = r.json()
+    return {"ok": True, "data": data, "message_id": provider_message_id(data)}
+
+
+def provider_message_id(data):
+    """
+    Id da mensagem no provedor (Z-API devolve zaapId/messageId/id).
+    """
+    if not isinstance(data, dict):
+        return None
+    return data.get("messageId") or data.get("id") or data.get("zaapId")
 
 
 def sleep_interval(seconds: int):
@@ -66,4 +80,36 @@ def notify_admin_new_lead(cnpj: str, razao_social: str, cidade: str, uf: str, se
     else:
         log_event("error", f"Falha ao enviar notificação ao admin: {result.get('error')}")
     
-    return result
\ No newline at end of file
+    return result
+
+def notify_admin_digest(leads: list):
+    """
+    Notifica o admin com um resumo de vários CNPJs novos, agrupados por segmento.
+    `leads` são dicts/rows com cnpj, razao_social, cidade, uf e segmento.
+    """
+    if not ADMIN_PHONE:
+        log_event("warning", "ADMIN_PHONE não configurado. Notificação não enviada.")
+        return {"ok": False, "error": "ADMIN_PHONE não configurado"}
+
+    admin_e164 = to_e164_br(ADMIN_PHONE)
+
+    por_segmento = {}
+    for lead in leads:
+        por_segmento.setdefault(lead["segmento"] or "sem segmento", []).append(lead)
+
+    linhas = [f"🆕 *{len(leads)} NOVOS CNPJs ABERTOS*"]
+    for segmento, itens in sorted(por_segmento.items(), key=lambda kv: -len(kv[1])):
+        linhas.append(f"\n*{segmento}* ({len(itens)})")
+        for lead in itens:
+            linhas.append(
+                f"• {lead['razao_social']} - {lead['cidade']}/{lead['uf']} - {lead['cnpj']}"
+            )
+    linhas.append("\n_Mensagem automática do Prospec CNPJ_")
+
+    result = send_text(admin_e164, "\n".join(linhas))
+    if result.get("ok"):
+        log_event("admin_notification", f"Resumo enviado para admin - {len(leads)} CNPJs")
+    else:
+        log_event("error", f"Falha ao enviar resumo ao admin: {result.get('error')}")
+
+    return result
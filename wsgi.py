@@ -0,0 +1,10 @@
+"""
+Entrada WSGI de produção:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Cada worker roda bootstrap(); só o líder eleito (leader.py) roda os jobs.
+"""
+from app import app, bootstrap
+
+bootstrap()